@@ -0,0 +1,36 @@
+"""Per-element overhead of chained maps, before and after `Stream.compile()`.
+
+Usage:
+
+    python benchmarks/fusion.py
+"""
+
+import time
+
+from aleatora.streams import count
+
+
+ELEMENTS = 200000
+
+def chain(length):
+    strm = count()
+    for _ in range(length):
+        strm = strm.map(lambda x: x + 1)
+    return strm[:ELEMENTS]
+
+def ns_per_element(strm, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in strm:
+            pass
+        best = min(best, time.perf_counter() - start)
+    return best / ELEMENTS * 1e9
+
+if __name__ == '__main__':
+    print(f"{'maps':>5} {'chained':>12} {'compiled':>12} {'speedup':>8}")
+    for length in (1, 2, 5, 20, 100):
+        strm = chain(length)
+        before = ns_per_element(strm)
+        after = ns_per_element(strm.compile())
+        print(f"{length:>5} {before:>9.1f} ns {after:>9.1f} ns {before/after:>7.2f}x")
@@ -0,0 +1,35 @@
+"""Cost of mixing many concurrent voices with MixStream, per sample and in blocks.
+
+Voices have staggered lengths, so some finish (and get retired) throughout the run.
+
+Usage:
+
+    python benchmarks/mix.py
+"""
+
+import time
+
+from aleatora.streams import const, iter_blocks, MixStream
+
+
+def voices(count, length):
+    return MixStream([const(0.001)[:length // 2 + i * length // (2 * count)] for i in range(count)])
+
+def timed(fn):
+    start = time.perf_counter()
+    samples = fn()
+    return (time.perf_counter() - start) / samples * 1e9
+
+def per_sample(strm):
+    return sum(1 for _ in strm)
+
+def per_block(strm):
+    return sum(len(block) for block in iter_blocks(strm))
+
+if __name__ == '__main__':
+    print(f"{'voices':>6} {'per sample':>14} {'blocks':>14}")
+    for count in (1, 16, 256, 4096):
+        # Keep the total amount of work roughly constant.
+        length = max(1024, 2**21 // count)
+        strm = voices(count, length)
+        print(f"{count:>6} {timed(lambda: per_sample(strm)):>9.0f} ns/s {timed(lambda: per_block(strm)):>9.0f} ns/s")
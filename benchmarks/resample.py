@@ -0,0 +1,70 @@
+"""Throughput and aliasing of the resamplers, on a swept sine downsampled from 48 kHz to 22.05 kHz.
+
+Aliasing is the level of whatever comes out while the sweep is above the new Nyquist frequency
+(ideally silence), relative to the level while it's well below.
+
+Usage:
+
+    python benchmarks/resample.py
+"""
+
+import time
+
+import numpy as np
+
+from aleatora.streams import iter_blocks, Resampler, resample
+
+
+RATE = 48000
+NEW_RATE = 22050
+RATIO = RATE / NEW_RATE
+DURATION = 4
+
+def sweep():
+    t = np.arange(RATE * DURATION) / RATE
+    # Linear sweep from 20 Hz to just below the original Nyquist frequency.
+    top = RATE / 2 * 0.95
+    phase = 2 * np.pi * (20 * t + (top - 20) * t**2 / (2 * DURATION))
+    frequency = 20 + (top - 20) * t / DURATION
+    return np.sin(phase), frequency
+
+def aliasing(output, frequency):
+    # Frequency of the input at each output sample.
+    frequency = frequency[np.minimum((np.arange(len(output)) * RATIO).astype(int), len(frequency) - 1)]
+    nyquist = NEW_RATE / 2
+    passband = output[frequency < 0.8 * nyquist]
+    stopband = output[frequency > 1.2 * nyquist]
+    return 20 * np.log10(np.sqrt(np.mean(stopband**2)) / np.sqrt(np.mean(passband**2)))
+
+def per_sample_linear(x):
+    return np.array(list(resample(x.tolist(), RATIO, quality='linear')))
+
+def interp(x):
+    # What `wav.load(resample=True)` used to do.
+    new_x = np.arange(int(len(x) / RATIO)) * RATIO
+    return np.interp(new_x, np.arange(len(x)), x)
+
+def sinc(quality):
+    def run(x):
+        resampler = Resampler(RATIO, quality)
+        return np.concatenate([resampler.process(block) for block in iter_blocks(x, 512)] + [resampler.flush()])
+    return run
+
+def sinc_stream(x):
+    return np.concatenate(list(iter_blocks(resample(x, RATIO))))
+
+if __name__ == '__main__':
+    x, frequency = sweep()
+    print(f"{'resampler':>18} {'ns/sample':>10} {'x real time':>12} {'aliasing':>10}")
+    for name, fn in [
+        ('per-sample linear', per_sample_linear),
+        ('np.interp', interp),
+        ('sinc fast', sinc('fast')),
+        ('sinc medium', sinc('medium')),
+        ('sinc best', sinc('best')),
+        ('resample() stream', sinc_stream),
+    ]:
+        start = time.perf_counter()
+        output = fn(x)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>18} {elapsed / len(x) * 1e9:>10.1f} {DURATION / elapsed:>11.1f}x {aliasing(output, frequency):>7.1f} dB")
@@ -0,0 +1,321 @@
+"""Benchmark suite for the core stream combinators and DSP primitives.
+
+Each benchmark renders about `--duration` seconds of audio (per sample, or in blocks where noted),
+and reports the best of `--repeat` runs as nanoseconds per sample and as a multiple of real time at SAMPLE_RATE.
+Results can be saved as a baseline and compared against in later runs, to catch regressions.
+Baselines are kept per interpreter (e.g. `baselines/cpython-3.11.json`, `baselines/pypy-3.10.json`),
+since CPython and PyPy perform very differently; the suite itself sticks to what both support.
+Baselines also depend on the machine. The checked-in baselines are only a reference for how fast things are expected to be:
+to check for regressions, save one on your own machine before making changes, then compare.
+
+Usage:
+
+    python benchmarks/suite.py                # run everything
+    python benchmarks/suite.py osc svf        # run benchmarks with 'osc' or 'svf' in their names
+    python benchmarks/suite.py --list         # list benchmarks
+    python benchmarks/suite.py --save         # save the results as the baseline
+    python benchmarks/suite.py --compare      # compare with the baseline; exits with status 1 if anything got slower
+
+Benchmarks that need a missing optional dependency are skipped.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+from aleatora import midi, wav
+from aleatora.filters import comb, lpf, svf
+from aleatora.streams import (
+    ConcatStream, const, count, freeze, freeze_to, iter_blocks, MixStream, osc, resample, saw, SAMPLE_RATE, Stream, tbl,
+)
+
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Register a benchmark. The decorated function takes the number of samples to render,
+    and returns a function that does the work (and returns the number of samples it actually rendered)."""
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return decorator
+
+def samples(strm):
+    n = 0
+    for _ in strm:
+        n += 1
+    return n
+
+def blocks(strm):
+    return sum(len(block) for block in iter_blocks(strm))
+
+
+# Combinators
+
+@benchmark('map')
+def _(n):
+    strm = osc(440).map(lambda x: x * 0.5)[:n]
+    return lambda: samples(strm)
+
+@benchmark('map chain')
+def _(n):
+    strm = ((osc(440) * 0.5 + 0.25) * osc(3) - 0.1)[:n]
+    return lambda: samples(strm)
+
+@benchmark('map chain (compiled)')
+def _(n):
+    strm = ((osc(440) * 0.5 + 0.25) * osc(3) - 0.1)[:n].compile()
+    return lambda: samples(strm)
+
+@benchmark('map chain (blocks)')
+def _(n):
+    strm = ((osc(440) * 0.5 + 0.25) * osc(3) - 0.1)[:n]
+    return lambda: blocks(strm)
+
+@benchmark('mix 16 voices')
+def _(n):
+    strm = MixStream([osc(110 * (i + 1)) for i in range(16)])[:n]
+    return lambda: samples(strm)
+
+@benchmark('mix 16 voices (blocks)')
+def _(n):
+    strm = MixStream([osc(110 * (i + 1)) for i in range(16)])[:n]
+    return lambda: blocks(strm)
+
+@benchmark('concat short clips')
+def _(n):
+    # Clips of 10ms each.
+    clip = SAMPLE_RATE // 100
+    strm = ConcatStream([osc(440)[:clip] for _ in range(math.ceil(n / clip))])
+    return lambda: samples(strm)
+
+@benchmark('concat short clips (blocks)')
+def _(n):
+    clip = SAMPLE_RATE // 100
+    strm = ConcatStream([osc(440)[:clip] for _ in range(math.ceil(n / clip))])
+    return lambda: blocks(strm)
+
+@benchmark('slice')
+def _(n):
+    strm = count()[1000:n + 1000:1]
+    return lambda: samples(strm)
+
+# Oscillators
+
+@benchmark('osc')
+def _(n):
+    strm = osc(440)[:n]
+    return lambda: samples(strm)
+
+@benchmark('osc (blocks)')
+def _(n):
+    strm = osc(440)[:n]
+    return lambda: blocks(strm)
+
+@benchmark('osc (modulated, blocks)')
+def _(n):
+    strm = osc(440 + 10 * osc(5))[:n]
+    return lambda: blocks(strm)
+
+@benchmark('saw')
+def _(n):
+    strm = saw(440)[:n]
+    return lambda: samples(strm)
+
+@benchmark('saw (blocks)')
+def _(n):
+    strm = saw(440)[:n]
+    return lambda: blocks(strm)
+
+@benchmark('tbl')
+def _(n):
+    table = [math.sin(2 * math.pi * i / 1024) for i in range(1024)]
+    strm = tbl(440, const(table))[:n]
+    return lambda: samples(strm)
+
+# Filters
+
+@benchmark('svf (tuples)')
+def _(n):
+    strm = svf(saw(110), 1000, 2)[:n]
+    return lambda: samples(strm)
+
+@benchmark('lpf (blocks)')
+def _(n):
+    strm = lpf(saw(110)[:n], 1000, 2)
+    return lambda: blocks(strm)
+
+@benchmark('lpf (modulated, blocks)')
+def _(n):
+    strm = lpf(saw(110)[:n], 1000 + 500 * osc(2), 2)
+    return lambda: blocks(strm)
+
+@benchmark('lpf (modulated, smooth, blocks)')
+def _(n):
+    strm = lpf(saw(110)[:n], 1000 + 500 * osc(2), 2, smooth=True)
+    return lambda: blocks(strm)
+
+@benchmark('comb feedback (blocks)')
+def _(n):
+    strm = comb(saw(110)[:n], 0.5, -300)
+    return lambda: blocks(strm)
+
+@benchmark('comb feedback')
+def _(n):
+    strm = comb(saw(110)[:n], 0.5, -300)
+    return lambda: samples(strm)
+
+@benchmark('resample (blocks)')
+def _(n):
+    strm = resample(saw(110)[:math.ceil(n * 1.5)], 1.5)
+    return lambda: blocks(strm)
+
+@benchmark('resample (linear)')
+def _(n):
+    strm = resample(saw(110), 1.5, quality='linear')[:n]
+    return lambda: samples(strm)
+
+# Rendering and files
+
+@benchmark('freeze')
+def _(n):
+    strm = saw(110)[:n]
+    def run():
+        freeze(strm)
+        return n
+    return run
+
+@benchmark('freeze to file')
+def _(n):
+    strm = saw(110)[:n]
+    path = os.path.join(tempfile.mkdtemp(), 'frozen')
+    def run():
+        freeze_to(path, strm)
+        return n
+    return run
+
+@benchmark('wav.save')
+def _(n):
+    strm = saw(110)[:n]
+    path = os.path.join(tempfile.mkdtemp(), 'save.wav')
+    def run():
+        wav.save(strm, path)
+        return n
+    return run
+
+@benchmark('wav.load (blocks)')
+def _(n):
+    path = os.path.join(tempfile.mkdtemp(), 'load.wav')
+    wav.save(saw(110)[:n], path)
+    return lambda: blocks(wav.load(path))
+
+# Instruments
+
+def _notes(n):
+    # A note every 50ms, each lasting 200ms, so that about four overlap.
+    # For short runs, notes are shortened to fit several in, so there's always something to play.
+    length = max(1, min(SAMPLE_RATE // 5, n // 5))
+    step = max(1, length // 4)
+    events = [[] for _ in range(n)]
+    starts = range(0, n - length, step)
+    assert starts, f"too short to play any notes ({n} samples)"
+    for i, start in enumerate(starts):
+        note = 48 + i % 24
+        events[start].append(midi.Message('note_on', note, 100))
+        events[start + length].append(midi.Message('note_off', note, 0))
+    return Stream(list(map(tuple, events)))
+
+@benchmark('midi.poly_instrument')
+def _(n):
+    strm = midi.poly_instrument(_notes(n))[:n]
+    return lambda: samples(strm)
+
+@benchmark('fauxdot.tune')
+def _(n):
+    from aleatora import fauxdot
+    # Renders the event stream only (tune() produces messages for an instrument).
+    strm = fauxdot.tune([0, 2, 4, 7], dur=0.25)[:n]
+    return lambda: samples(strm)
+
+
+def measure(fn, n, repeat):
+    run = fn(n)
+    best = math.inf
+    rendered = n
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rendered = run()
+        best = min(best, time.perf_counter() - start)
+    return best / rendered * 1e9
+
+def baseline_path():
+    impl = sys.implementation.name
+    return os.path.join(BASELINES, f'{impl}-{sys.version_info.major}.{sys.version_info.minor}.json')
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streams and DSP primitives.")
+    parser.add_argument('names', nargs='*', help="only run benchmarks with any of these in their names")
+    parser.add_argument('--duration', type=float, default=1.0, help="seconds of audio per benchmark (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark; the best is reported (default: %(default)s)")
+    parser.add_argument('--list', action='store_true', help="list benchmarks and exit")
+    parser.add_argument('--save', action='store_true', help="save the results as the baseline for this interpreter")
+    parser.add_argument('--compare', action='store_true', help="compare with the baseline for this interpreter")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown (as a fraction) counted as a regression (default: %(default)s)")
+    args = parser.parse_args()
+
+    selected = [name for name in BENCHMARKS if not args.names or any(part in name for part in args.names)]
+    if args.list:
+        print('\n'.join(selected))
+        return
+    baseline = {}
+    if args.compare:
+        try:
+            with open(baseline_path()) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            sys.exit(f"No baseline at {baseline_path()}; run with --save first.")
+
+    n = int(args.duration * SAMPLE_RATE)
+    budget = 1e9 / SAMPLE_RATE
+    print(f"{sys.implementation.name} {sys.version.split()[0]}, {SAMPLE_RATE} Hz ({budget:.0f} ns per sample in real time)")
+    print(f"{'benchmark':<30} {'ns/sample':>10} {'x real time':>12}" + (f" {'baseline':>10} {'change':>8}" if baseline else ""))
+    results = {}
+    regressions = []
+    for name in selected:
+        try:
+            ns = measure(BENCHMARKS[name], n, args.repeat)
+        except ImportError as exc:
+            print(f"{name:<30} skipped ({exc})")
+            continue
+        results[name] = ns
+        line = f"{name:<30} {ns:>10.1f} {budget / ns:>11.1f}x"
+        if name in baseline:
+            change = ns / baseline[name] - 1
+            line += f" {baseline[name]:>10.1f} {change:>+7.0%}"
+            if change > args.tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        saved = {}
+        if os.path.exists(baseline_path()):
+            with open(baseline_path()) as f:
+                saved = json.load(f)
+        saved.update(results)
+        with open(baseline_path(), 'w') as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {baseline_path()}")
+    if regressions:
+        print(f"{len(regressions)} regression{'' if len(regressions) == 1 else 's'} (more than {args.tolerance:.0%} slower):", ', '.join(regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -45,5 +45,6 @@ low = m.resample(low_rate)
 mid = silence[:5.0] >> (m.resample(mid_rate[5.0:]) * basic_envelope(58.0 - 5.0))
 high = silence[:10.0] >> (m.resample(high_rate[10.0:]) * basic_envelope(56.0 - 10.0))
 
-composition = (low + mid + high)/3
-wav.save(composition, "csick.wav", verbose=True)
+# Keep the mix at the top level, so render() can give each layer its own process.
+composition = low/3 + mid/3 + high/3
+wav.render(composition, "csick.wav", verbose=True)
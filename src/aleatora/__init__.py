@@ -2,7 +2,7 @@
 
 __version__ = '0.2.2-dev'
 
-from .audio import input_stream, play, query_devices, run, setup, volume
+from .audio import input_stream, InputStream, play, query_devices, run, setup, volume
 from .chord import chord
 from .fauxdot import beat, tune, P, PEuclid, PRand, Scale, Root
 from .filters import *
@@ -13,4 +13,5 @@ from .profile import profile
 from .speech import speech, sing
 from .streams.core import *
 from .streams.audio import *
+from .streams.cache import *
 from . import wav
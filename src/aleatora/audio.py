@@ -1,12 +1,22 @@
+import collections
+import queue
+import threading
+import time
 import traceback
 
+import numpy as np
 import sounddevice as sd
 
-from .streams import audio, empty, frame, FunctionStream, Stream, peek
+from .streams import audio, BLOCK_SIZE, BlockReader, empty, frame, has_blocks, iter_blocks, MixStream, Stream, peek
+from .streams.core import _unblock
 
 
 def get_playback_stream(streams):
-    if len(streams) == 1:
+    if len(streams) == 1 and has_blocks(streams[0]):
+        # Pull whole blocks rather than individual samples.
+        stream = BlockReader(iter_blocks(streams[0]))
+        channels = stream.channels()
+    elif len(streams) == 1:
         # Peek ahead to determine the number of channels automatically.
         sample, stream = peek(streams[0])
         channels = getattr(sample, "__len__", lambda: 1)()
@@ -16,25 +26,266 @@ def get_playback_stream(streams):
         channels = len(streams)
     return stream, channels
 
+
+class PlaybackStats:
+    """Timing measurements for live playback, kept for the last `history` callbacks and rendered blocks.
+
+    Render load is the time taken to render a block divided by the block's duration, so anything
+    approaching 1 means the stream can barely keep up. Callback headroom is the fraction of each callback's
+    duration left over after copying out samples. `flags` counts the xrun flags reported by PortAudio.
+    """
+    FLAGS = ('input_underflow', 'input_overflow', 'output_underflow', 'output_overflow', 'priming_output')
+    # Upper edges of the render load histogram buckets.
+    BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, float('inf'))
+
+    def __init__(self, history=2000):
+        self.callbacks = 0
+        self.errors = 0
+        self.flags = collections.Counter()
+        self.callback_load = collections.deque(maxlen=history)
+        self.render_load = collections.deque(maxlen=history)
+        self.log = None
+
+    def record_callback(self, seconds, frames, status):
+        self.callbacks += 1
+        self.callback_load.append(seconds * audio.SAMPLE_RATE / frames if frames else 0)
+        if status:
+            for flag in self.FLAGS:
+                if getattr(status, flag):
+                    self.flags[flag] += 1
+
+    def record_render(self, seconds, samples, buffered, underruns):
+        load = seconds * audio.SAMPLE_RATE / samples if samples else 0
+        self.render_load.append(load)
+        log = self.log
+        if log:
+            try:
+                log.write(f"{time.time():.6f},{samples},{seconds*1e3:.4f},{load:.4f},{buffered},{underruns},{sum(self.flags.values())}\n")
+            except ValueError:
+                # Closed by stop_log() in the meantime.
+                pass
+
+    def histogram(self):
+        "Counts of recent render loads falling in each of BUCKETS (e.g. the first is loads up to 10%)."
+        counts = [0] * len(self.BUCKETS)
+        for load in self.render_load:
+            for i, edge in enumerate(self.BUCKETS):
+                if load <= edge:
+                    counts[i] += 1
+                    break
+        return counts
+
+    def start_log(self, path):
+        "Append a CSV line to `path` for every rendered block."
+        self.stop_log()
+        self.log = open(path, 'a', buffering=1)
+        if not self.log.tell():
+            self.log.write("time,samples,render_ms,load,buffered,underruns,xruns\n")
+
+    def stop_log(self):
+        if self.log:
+            log = self.log
+            self.log = None
+            log.close()
+
+    def summary(self, underruns=0):
+        def describe(loads):
+            if not loads:
+                return None
+            loads = np.array(loads)
+            return {'mean': float(loads.mean()), 'p99': float(np.percentile(loads, 99)), 'max': float(loads.max())}
+        callback_load = describe(self.callback_load)
+        return {
+            'callbacks': self.callbacks,
+            'underruns': underruns,
+            'errors': self.errors,
+            'flags': dict(self.flags),
+            'render_load': describe(self.render_load),
+            'callback_headroom': callback_load and 1 - callback_load['max'],
+            'histogram': dict(zip((f"<={edge:.0%}" if edge < float('inf') else ">100%" for edge in self.BUCKETS), self.histogram())),
+        }
+
+
+class OutputBuffer:
+    """Renders streams ahead of playback on a separate thread.
+
+    A producer thread reads blocks of `block_size` samples from the current source into a ring buffer
+    holding `blocks` blocks, and the audio callback just copies samples out with `read_into()`.
+    Only the producer touches sources and the write position, and only the callback moves the read position,
+    so neither side waits on the other.
+    """
+    def __init__(self, channels, blocks=4, block_size=BLOCK_SIZE):
+        self.channels = channels
+        self.block_size = block_size
+        self.ring = np.zeros((blocks * block_size, channels), dtype=np.float32)
+        # Total samples written and read; positions in the ring are these modulo its length.
+        self.write_pos = 0
+        self.read_pos = 0
+        # Samples before this were rendered from a source that has since been replaced.
+        self.skip_to = 0
+        self.source = None
+        # Set while there is (or is about to be) a source to render. Shared by the producer, the callback, and `play()`.
+        self.active = threading.Event()
+        # Number of callbacks that found the buffer empty while a source was still playing.
+        self.underruns = 0
+        self.stats = PlaybackStats()
+        self.commands = queue.SimpleQueue()
+        self.wake = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def play(self, stream, mix=False):
+        "Start rendering `stream` (replacing the current source, or mixed in with it)."
+        reader = stream if isinstance(stream, BlockReader) else BlockReader(iter_blocks(stream))
+        # Queue the command before setting `active`, so the producer can't clear it after seeing an empty queue.
+        self.commands.put((reader, mix))
+        self.active.set()
+        self.wake.set()
+
+    def stop(self):
+        "Stop the producer thread, and return whatever remains of the source (including samples already rendered)."
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+        self.stats.stop_log()
+        # Apply any commands the producer didn't get to.
+        self._update_source()
+        pending = self.ring[np.arange(max(self.read_pos, self.skip_to), self.write_pos) % len(self.ring)]
+        if self.channels == 1:
+            pending = pending[:, 0]
+        if not len(pending):
+            return self.source
+        if self.source is None:
+            return BlockReader([pending])
+        return BlockReader(_prepend(pending, self.source))
+
+    def _update_source(self):
+        while True:
+            try:
+                reader, mix = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            if mix and self.source is not None:
+                # Existing layers continue after the samples we've already rendered.
+                reader = BlockReader(iter_blocks(MixStream([reader, self.source])))
+            else:
+                # Drop whatever was rendered from the previous source.
+                self.skip_to = self.write_pos
+            self.source = reader
+
+    def _produce(self):
+        size = self.block_size
+        capacity = len(self.ring)
+        while self.running:
+            self.wake.clear()
+            self._update_source()
+            if self.source is None or self.write_pos - max(self.read_pos, self.skip_to) > capacity - size:
+                # Nothing to do until the callback reads something or we get a new source.
+                self.wake.wait(0.1)
+                continue
+            start = time.perf_counter()
+            try:
+                block = self.source.read(size)
+            except Exception:
+                traceback.print_exc()
+                self.stats.errors += 1
+                block = np.empty(0)
+            self.stats.record_render(time.perf_counter() - start, len(block), self.write_pos - self.read_pos, self.underruns)
+            if len(block):
+                if block.ndim == 1:
+                    block = block[:, None]
+                start = self.write_pos % capacity
+                # `block` never wraps around more than once, since it's at most `size` samples.
+                first = min(len(block), capacity - start)
+                self.ring[start:start+first] = block[:first]
+                self.ring[:len(block)-first] = block[first:]
+                self.write_pos += len(block)
+            if len(block) < size:
+                self.source = None
+                # Clear first, then check for a command that `play()` queued in the meantime.
+                self.active.clear()
+                if not self.commands.empty():
+                    self.active.set()
+
+    def read_into(self, outdata, frames):
+        """Copy the next `frames` samples into `outdata`, filling with silence if there aren't enough.
+
+        Returns False once the source has finished and everything it rendered has been read.
+        """
+        if self.skip_to > self.read_pos:
+            self.read_pos = self.skip_to
+        capacity = len(self.ring)
+        n = min(frames, self.write_pos - self.read_pos)
+        start = self.read_pos % capacity
+        first = min(n, capacity - start)
+        outdata[:first] = self.ring[start:start+first]
+        outdata[first:n] = self.ring[:n-first]
+        self.read_pos += n
+        self.wake.set()
+        if n < frames:
+            outdata[n:frames] = 0
+            if self.active.is_set():
+                self.underruns += 1
+        return self.active.is_set() or self.read_pos < self.write_pos
+
+class InputBuffer:
+    """Ring buffer of recent input samples (all channels), written by the audio callback.
+
+    Samples are addressed by absolute position (the number of samples captured before them),
+    so readers can stay aligned with the output no matter how many samples they ask for at a time.
+    """
+    def __init__(self, channels, size):
+        self.ring = np.zeros((size, channels), dtype=np.float32)
+        self.write_pos = 0
+
+    def write(self, indata, frames):
+        capacity = len(self.ring)
+        start = self.write_pos % capacity
+        first = min(frames, capacity - start)
+        self.ring[start:start+first] = indata[:first]
+        self.ring[:frames-first] = indata[first:frames]
+        self.write_pos += frames
+
+    def read(self, pos, n):
+        "Return the `n` samples starting at `pos`, with silence for any that haven't been captured (or were overwritten)."
+        capacity = len(self.ring)
+        block = np.zeros((n, self.ring.shape[1]), dtype=self.ring.dtype)
+        # Only the part that's still in the ring.
+        start = max(pos, self.write_pos - capacity, 0)
+        stop = min(pos + n, self.write_pos)
+        if start < stop:
+            block[start-pos:stop-pos] = self.ring[np.arange(start, stop) % capacity]
+        return block
+
+def _prepend(block, reader):
+    # Blocks of `block` followed by those of `reader`.
+    yield block
+    yield from iter_blocks(reader)
+
 # Non-interactive version; blocking, cleans up and returns when the composition is finished.
-def run(*streams, blocksize=0):
+def run(*streams, blocksize=0, buffer_blocks=4):
     stream, channels = get_playback_stream(streams)
-    samples = iter(stream)
+    output = OutputBuffer(channels, buffer_blocks)
 
-    def callback(outdata, frames, time, status):
-        i = -1
-        for i, sample in zip(range(frames), samples):
-            outdata[i] = sample
-        if i < frames - 1:
+    def callback(outdata, frames, time_info, status):
+        start = time.perf_counter()
+        more = output.read_into(outdata, frames)
+        output.stats.record_callback(time.perf_counter() - start, frames, status)
+        if not more:
             raise sd.CallbackStop
 
-    with sd.OutputStream(channels=channels, callback=callback, blocksize=blocksize) as stream:
-        audio.SAMPLE_RATE = stream.samplerate
+    device_stream = sd.OutputStream(channels=channels, callback=callback, blocksize=blocksize)
+    audio.SAMPLE_RATE = device_stream.samplerate
+    # Start rendering before the device stream starts asking for samples.
+    output.play(stream)
+    with device_stream:
         try:
-            while stream.active:
+            while device_stream.active:
                 sd.sleep(100)
         except KeyboardInterrupt:
             print("Finishing early due to user interrupt.")
+    output.stop()
 
 
 # Interactive version: setup(), volume(), play(), addplay(). Non-blocking, works with the REPL.
@@ -43,7 +294,11 @@ def run(*streams, blocksize=0):
 
 _channels = 0
 _stream = None
-_samples = None
+_output = None
+_buffer_blocks = 4
+_stats_log = None
+# Recent input samples, for InputStream.
+_input = None
 # Might make this public after moving on from `from audio import *`.
 _volume = 1.0
 
@@ -62,69 +317,127 @@ def volume(vol=None):
         _volume = vol
     return _volume
 
+def underruns():
+    "Number of times playback ran out of rendered samples (because the stream couldn't keep up) since setup()."
+    return _output.underruns if _output else 0
+
+def stats():
+    """Summarize playback timing since setup(): callback count, underruns, stream errors, PortAudio xrun flags,
+    render load (mean, 99th percentile, and max), the worst callback headroom, and a histogram of render load.
+
+    For example, a p99 render load of 0.8 means rendering 99% of blocks took at most 80% of their duration.
+    """
+    if not _output:
+        return None
+    return _output.stats.summary(_output.underruns)
+
+def log_stats(path=None):
+    "Log timing for every rendered block to the CSV file at `path` (or stop logging if `path` is None)."
+    global _stats_log
+    _stats_log = path
+    if not _output:
+        # We'll start logging in setup().
+        return
+    if path is None:
+        _output.stats.stop_log()
+    else:
+        _output.stats.start_log(path)
+
 # For convenience, expose this:
 query_devices = sd.query_devices
 
-def setup(device=None, channels=1, input=False, **kwargs):
-    global _channels, _stream, _samples
+def setup(device=None, channels=1, input=False, buffer_blocks=None, input_channels=None, **kwargs):
+    """Open an audio stream for play().
+
+    Playback is rendered `buffer_blocks` blocks (of BLOCK_SIZE samples) ahead on a separate thread.
+    More blocks make underruns less likely, at the cost of latency when starting a new stream.
+    If `input` is set, the stream is full-duplex, with `input_channels` (by default, `channels`) available via InputStream.
+    """
+    global _channels, _stream, _output, _buffer_blocks, _input
+    if buffer_blocks is not None:
+        _buffer_blocks = buffer_blocks
+    remaining = None
     if _stream:
         _cleanup()
+    if _output:
+        remaining = _output.stop()
 
     if device is not None:
         sd.default.device = device
+    _output = OutputBuffer(channels, _buffer_blocks)
+    if _stats_log:
+        _output.stats.start_log(_stats_log)
     if input:
-        _stream = sd.Stream(channels=channels, callback=play_record_callback, **kwargs)
+        input_channels = input_channels or channels
+        # Enough to cover the output buffer, plus plenty of slack for readers that lag behind.
+        _input = InputBuffer(input_channels, max(len(_output.ring) * 4, 48000))
+        _stream = sd.Stream(channels=(input_channels, channels), callback=play_record_callback, **kwargs)
     else:
+        _input = None
         _stream = sd.OutputStream(channels=channels, callback=play_callback, **kwargs)
     audio.SAMPLE_RATE = _stream.samplerate
+    if remaining is not None:
+        # Carry on with whatever was playing.
+        _output.play(remaining)
     _stream.start()
     _channels = channels
 
-def play_callback(outdata, frames, time, status):
-    global _samples
-    if _samples is None:
-        outdata[:frames] = 0
-        return
-    try:
-        i = -1
-        for i, sample in zip(range(frames), _samples):
-            outdata[i] = sample
-    except Exception as e:
-        _samples = None
-        traceback.print_exc()
-    if i < frames - 1:
-        # Note: we avoid stopping the PortAudio stream,
-        # because making a new stream later will break connections in Jack.
-        outdata[i+1:frames] = 0
-        _samples = None
+def play_callback(outdata, frames, time_info, status):
+    start = time.perf_counter()
+    # Note: when the stream finishes, we avoid stopping the PortAudio stream,
+    # because making a new stream later will break connections in Jack.
+    _output.read_into(outdata, frames)
     outdata *= _volume
+    _output.stats.record_callback(time.perf_counter() - start, frames, status)
 
-_input_sample = 0
-@FunctionStream
-def input_stream():
-    while True:
-        yield _input_sample
+class InputStream(Stream):
+    """Live input from the audio device (see `setup(input=True)`), as samples from `channel`,
+    or as frames of all channels if `channel` is None. Silent if there is no input.
 
-def play_record_callback(indata, outdata, frames, time, status):
-    global _samples, _input_sample
-    if _samples is None:
-        outdata[:frames] = 0
-        return
-    try:
-        i = -1
-        indata = indata[:frames, 0].tolist()
-        # NOTE: _input_sample gets bound BEFORE we pull the next sample from _samples.
-        for i, _input_sample, sample in zip(range(frames), indata, _samples):
-            outdata[i] = sample
-    except Exception as e:
-        _samples = None
-        traceback.print_exc()
-    if i < frames - 1:
-        # Note: we avoid stopping the PortAudio stream,
-        # because making a new stream later will break connections in Jack.
-        outdata[i+1:frames] = 0
-        _samples = None
+    Input is aligned with the output: the input captured at some moment shows up in the output
+    one output buffer later (see `setup(buffer_blocks=...)`), regardless of how far ahead we are rendering.
+    """
+    def __init__(self, channel=0):
+        self.channel = channel
+
+    def __iter__(self):
+        for block in self.__iter_blocks__(BLOCK_SIZE):
+            yield from _unblock(block)
+
+    def __iter_blocks__(self, size):
+        if _input is None:
+            pos = 0
+        elif _output is None:
+            pos = _input.write_pos
+        else:
+            # The output we're about to render will be heard once everything already buffered has played,
+            # and we can count on having the input up to a full buffer's worth before that.
+            pos = _input.write_pos + (_output.write_pos - max(_output.read_pos, _output.skip_to)) - len(_output.ring)
+        while True:
+            if _input is None:
+                block = np.zeros((size, 1), dtype=np.float32)
+            else:
+                block = _input.read(pos, size)
+            pos += size
+            if self.channel is None:
+                yield block
+            elif self.channel < block.shape[1]:
+                yield block[:, self.channel]
+            else:
+                yield np.zeros(size, dtype=block.dtype)
+
+    def has_blocks(self):
+        return True
+
+# Mono input (the first channel), for convenience.
+input_stream = InputStream()
+
+def play_record_callback(indata, outdata, frames, time_info, status):
+    start = time.perf_counter()
+    _input.write(indata, frames)
+    _output.read_into(outdata, frames)
     outdata *= _volume
+    _output.stats.record_callback(time.perf_counter() - start, frames, status)
 
 
 # play() -> stops playing
@@ -133,22 +446,17 @@ def play_record_callback(indata, outdata, frames, time, status):
 
 
 def play(*streams, mix=False):
-    global _samples
-
     if not streams:
         stream = empty
         channels = _channels
     else:
         stream, channels = get_playback_stream(streams)
-    
-    if mix and _samples is not None:
-        # Add another layer to playback without resetting the position of existing layers.
-        # NOTE: We add _samples _after_ the peek(), to avoid "generator already executing" errors due to the audio thread.
-        channels = max(channels, _channels)
-        stream += _samples
 
     if not _stream:
         setup(channels=channels)
     elif _channels < channels:
+        # Note that setup() carries the current stream over to the new device stream.
         setup(device=_stream.device, channels=channels, input=isinstance(_stream, sd.InputStream))
-    _samples = iter(stream)
+    # The producer thread combines this with the current stream (if `mix` is set),
+    # so we never touch a stream that it might be in the middle of running.
+    _output.play(stream, mix)
@@ -2,7 +2,7 @@ import collections
 import heapq
 from typing import TYPE_CHECKING
 
-from .streams import const, empty, fit, just, SAMPLE_RATE, silence, stream, Stream
+from .streams import const, convert_time, empty, fit, just, SAMPLE_RATE, silence, stream, Stream
 from . import midi
 from . import wav
 
@@ -120,8 +120,12 @@ def beat(pattern, dur=0.5, sus=None, delay=0, amp=1, bpm=120, sample=0):
 
 # TODO: can root, scale, oct be patterns?
 # Used for regular instruments (everything except play(), e.g. pluck()).
-@stream
 def events_to_messages(event_stream, root=Root.default, scale=Scale.default, oct=5):
+    "Convert FoxDot-style events into a sparse stream of MIDI-style messages (see `midi.SparseEventStream`)."
+    return midi.SparseEventStream(_message_pairs(event_stream, root, scale, oct))
+
+@stream
+def _message_pairs(event_stream, root, scale, oct):
     # Maintain a priority queue of upcoming events to yield.
     # We use this to support cases where `sus` is greater than `dur`
     # (where one note's note_off will come after a subsequent note's note_on).
@@ -154,28 +158,29 @@ def events_to_messages(event_stream, root=Root.default, scale=Scale.default, oct
             i += 2
         return dur * 60/bpm
 
+    def pop_simultaneous():
+        # Pop the next message, with any that happen at the same time. Returns them with the gap until them.
+        nonlocal t
+        time, _, event = heapq.heappop(queue)
+        events = (event,)
+        while queue and queue[0][0] <= time:
+            events += (heapq.heappop(queue)[2],)
+        gap = max(0, convert_time(time - t))
+        t = time + 1/SAMPLE_RATE
+        return (gap, events)
+
     for event in event_stream:
         dur = enqueue_event(event, t)
         end = t + dur
         while queue and queue[0][0] < end:
-            time, _, event = heapq.heappop(queue)
-            yield from const(())[:time - t]
-            events = (event,)
-            while queue and queue[0][0] <= time:
-                events += (heapq.heappop(queue)[2],)
-            yield events
-            t = time + 1/SAMPLE_RATE
-        yield from const(())[:end - t]
+            yield pop_simultaneous()
+        gap = max(0, convert_time(end - t))
+        if gap:
+            yield (gap, ())
         t = end
     # Flush any remaining `note_off`s.
     while queue:
-        time, _, event = heapq.heappop(queue)
-        yield from const(())[:time - t]
-        events = (event,)
-        while queue and queue[0][0] <= time:
-            events += (heapq.heappop(queue)[2],)
-        yield events
-        t = time + 1/SAMPLE_RATE
+        yield pop_simultaneous()
 
 
 # Return an event stream suitable for passing into an instrument.
@@ -1,59 +1,575 @@
-from .streams import maybe_const, SAMPLE_RATE, stream
+from . import streams, wav
+from .streams import BLOCK_SIZE, has_blocks, iter_blocks, known_length, maybe_const, stream, stream_with, Stream
+from .streams.core import _rechunk, _unblock
 
+import functools
 import math
+import numbers
 
+import numpy as np
 
-# For reference:
-# https://www.musicdsp.org/en/latest/Filters/142-state-variable-filter-chamberlin-version.html
-# Seems unstable at 1/2 of Nyquist (1/4 of sampling rate)
+
+# Two-pole filters, in two flavors:
+# - `svf()` and friends use the state variable filter. By default, this is Chamberlin's digital SVF,
+#   which is cheap but goes unstable as the cutoff approaches a quarter of the sample rate (more so at low q).
+#   With `topology='tpt'`, they use the trapezoidal ("zero-delay feedback") SVF instead,
+#   which is stable all the way up to Nyquist and behaves well when its cutoff is modulated.
+#   For reference: https://cytomic.com/files/dsp/SvfLinearTrapOptimised2.pdf
+# - `biquad()` and `rbj()` use the direct form II transposed biquad, with the designs from the Audio EQ Cookbook.
+#   For reference: https://www.w3.org/TR/audio-eq-cookbook/
+#
+# All of these are linear systems with two state variables. With a constant cutoff, the coefficients are computed once,
+# and blocks are filtered with matrix products (see `_LinearSystem`) rather than sample by sample.
+# With a time-varying cutoff, the coefficients are computed for a whole block at once,
+# and the recurrence runs in a plain loop over the block.
+# With `smooth=True`, the cutoff is averaged over each block instead, and each block goes through `_LinearSystem`
+# with its own coefficients (carrying the state over), which is several times faster but only follows the cutoff at block rate.
+
+def _clip_freq(freq):
+    # Keep the cutoff between DC and just below Nyquist.
+    return np.clip(freq, 0, streams.audio.SAMPLE_RATE * 0.4999)
+
+def _matrix_powers(A, n):
+    # A^0, ..., A^n for the 2x2 matrix A. By the Cayley-Hamilton theorem, A^2 = tA - dI (with t the trace and d the determinant),
+    # so every power is p A + q I for scalars p and q that follow a simple recurrence: far cheaper than n matrix products.
+    (a, b), (c, e) = A.tolist()
+    t = a + e
+    d = a*e - b*c
+    # A^(k+1) = A A^k = p_k A^2 + q_k A, so p_(k+1) = t p_k + q_k and q_(k+1) = -d p_k.
+    p = [0.0, 1.0]
+    p_, q = 1.0, 0.0
+    for _ in range(n - 1):
+        p_, q = t*p_ + q, -d*p_
+        p.append(p_)
+    p = np.array(p[:n + 1])
+    q = np.concatenate(([1.0], -d*p[:-1]))
+    powers = np.empty((len(p), 2, 2))
+    powers[:, 0, 0] = p*a + q
+    powers[:, 0, 1] = p*b
+    powers[:, 1, 0] = p*c
+    powers[:, 1, 1] = p*e + q
+    return powers
+
+@functools.lru_cache(maxsize=None)
+def _carry_lags(steps):
+    # For `_LinearSystem._carry_matrix()`: which power of the step matrix goes where.
+    lags = np.arange(steps + 1)[:, None] - 1 - np.arange(steps)[None, :]
+    return np.maximum(lags, 0), (lags >= 0)[:, :, None, None]
+
+class _LinearSystem:
+    """Filter blocks with the linear system s[n+1] = A s[n] + B x[n], y[n] = C s[n] + D x[n], carrying state between blocks.
+
+    Blocks are split into steps of STEP samples. Within a step, the output is the input convolved with the impulse response
+    (a STEP x STEP matrix product) plus the response to the state at the start of the step,
+    and the states at the start of every step are computed together from the state at the start of the block.
+    This gives the same results as running the recurrence sample by sample (up to rounding).
+    The matrix for the states grows with the square of the number of steps, so longer blocks are processed MAX_STEPS steps at a time.
+    """
+    STEP = 32
+    MAX_STEPS = 32
+    _LAGS = np.arange(STEP)[:, None] - np.arange(STEP)[None, :]
+
+    def __init__(self, A, B, C, D):
+        step = self.STEP
+        A = np.asarray(A, dtype=np.float64)
+        # A^n for n = 0..STEP.
+        self.powers = _matrix_powers(A, step)
+        # Response to the initial state: row n is C A^n.
+        self.observe = C @ self.powers[:step]
+        # Impulse response, as a lower-triangular Toeplitz matrix.
+        impulse = np.concatenate(([D], self.observe[:step - 1] @ B))
+        self.response = np.where(self._LAGS >= 0, impulse[np.maximum(self._LAGS, 0)], 0)
+        # Effect of each input sample in a step on the state at the end of it: column j is A^(STEP-1-j) B.
+        self.inject = (self.powers[step - 1::-1] @ B).T
+        self.state = None
+        self._carry = {}
+
+    def _carry_matrix(self, steps):
+        # Maps the initial state, and the input's contribution from each step, to the state at the start of each step (and the end):
+        # state[j] = A^(STEP j) state[0] + sum over i < j of A^(STEP (j-1-i)) injected[i].
+        # Both matrices are flattened so that this is two matrix products.
+        if steps not in self._carry:
+            jumps = _matrix_powers(self.powers[-1], steps)
+            # carry[j, :, i] is A^(STEP (j-1-i)) for i < j, and zero otherwise.
+            lags, mask = _carry_lags(steps)
+            carry = (jumps[lags] * mask).transpose(0, 2, 1, 3)
+            self._carry[steps] = (jumps.reshape(-1, 2), carry.reshape((steps + 1) * 2, steps * 2))
+        return self._carry[steps]
+
+    def process(self, block):
+        "Return `block` (1-D, or 2-D with a column per channel) filtered, continuing from the previous block."
+        block = np.asarray(block, dtype=np.float64)
+        # Work with a column per channel (and per step, below), so that everything is a plain matrix product.
+        x = block.reshape(len(block), -1)
+        if self.state is None:
+            self.state = np.zeros((2, x.shape[1]))
+        piece = self.STEP * self.MAX_STEPS
+        if len(x) <= piece:
+            return self._process(x).reshape(block.shape)
+        return np.concatenate([self._process(x[i:i+piece]) for i in range(0, len(x), piece)]).reshape(block.shape)
+
+    def _process(self, x):
+        channels = x.shape[1]
+        step = self.STEP
+        steps, rest = divmod(len(x), step)
+        out = np.empty(x.shape)
+        if steps:
+            # Column k*channels + c holds step k of channel c.
+            columns = x[:steps * step].reshape(steps, step, channels).transpose(1, 0, 2).reshape(step, steps * channels)
+            jumps, carry = self._carry_matrix(steps)
+            injected = (self.inject @ columns).reshape(2, steps, channels).transpose(1, 0, 2).reshape(steps * 2, channels)
+            states = (jumps @ self.state + carry @ injected).reshape(steps + 1, 2, channels)
+            starts = states[:steps].transpose(1, 0, 2).reshape(2, steps * channels)
+            y = self.response @ columns + self.observe @ starts
+            out[:steps * step] = y.reshape(step, steps, channels).transpose(1, 0, 2).reshape(steps * step, channels)
+            self.state = states[steps]
+        if rest:
+            x = x[steps * step:]
+            out[steps * step:] = self.response[:rest, :rest] @ x + self.observe[:rest] @ self.state
+            self.state = self.powers[rest] @ self.state + self.inject[:, step - rest:] @ x
+        return out
+
+
+class _TwoPoleStream(Stream):
+    # Subclasses implement `_system(freq)`, returning (A, B, C, D) for a constant cutoff `freq`,
+    # `_coefficients(freqs)`, returning the coefficients for an array of cutoffs (one row per coefficient),
+    # and `_recurrence(x, coefficients, state)`, filtering the 1-D block `x` with those coefficients and updating `state` in place.
+    clip = True
+    smooth = False
+
+    def __iter__(self):
+        for block in self.__iter_blocks__(BLOCK_SIZE):
+            yield from _unblock(block)
+
+    def _cutoff(self, freq):
+        return _clip_freq(freq) if self.clip else freq
+
+    def __iter_blocks__(self, size):
+        if isinstance(self.freq, numbers.Number):
+            system = _LinearSystem(*self._system(self._cutoff(self.freq)))
+            for block in iter_blocks(self.stream, size):
+                yield system.process(block)
+            return
+        state = None
+        for block, freqs in zip(iter_blocks(self.stream, size), iter_blocks(self.freq, size)):
+            length = min(len(block), len(freqs))
+            if not length:
+                return
+            block = np.asarray(block[:length], dtype=np.float64)
+            freqs = self._cutoff(np.asarray(freqs[:length], dtype=np.float64))
+            if self.smooth:
+                system = _LinearSystem(*self._system(float(freqs.mean())))
+                system.state = state
+                yield system.process(block)
+                state = system.state
+                if length < size:
+                    return
+                continue
+            if state is None:
+                state = np.zeros((2,) + block.shape[1:])
+            coefficients = self._coefficient_array(freqs)
+            if block.ndim > 1:
+                out = np.empty(block.shape)
+                for channel in range(block.shape[1]):
+                    out[:, channel] = self._recurrence(block[:, channel], coefficients, state[:, channel])
+                yield out
+            else:
+                yield self._recurrence(block, coefficients, state)
+            if length < size:
+                return
+
+    def _coefficient_array(self, freqs):
+        return np.array(np.broadcast_arrays(*self._coefficients(freqs)), dtype=np.float64).reshape(-1, len(freqs))
+
+    def has_blocks(self):
+        return has_blocks(self.stream) and (isinstance(self.freq, numbers.Number) or has_blocks(self.freq))
+
+    def known_length(self):
+        if isinstance(self.freq, numbers.Number):
+            return known_length(self.stream)
+        lengths = [known_length(self.stream), known_length(self.freq)]
+        return None if None in lengths else min(lengths)
+
+
+# Output modes of the state variable filter, as weights for (low, high, band) given the damping k = 1/q.
+SVF_MODES = {
+    'low': lambda k: (1, 0, 0),
+    'high': lambda k: (0, 1, 0),
+    'band': lambda k: (0, 0, 1),
+    'notch': lambda k: (1, 1, 0),
+    'peak': lambda k: (-1, 1, 0),
+    'all': lambda k: (1, 1, -k),
+}
+
+SVF_TOPOLOGIES = ('chamberlin', 'tpt')
+
+def _chamberlin_coefficient(freq):
+    return 2 * np.sin(np.pi * freq / streams.audio.SAMPLE_RATE)
+
+def _tpt_coefficients(freq, q):
+    g = np.tan(np.pi * freq / streams.audio.SAMPLE_RATE)
+    a1 = 1 / (1 + g * (g + 1/q))
+    a2 = g * a1
+    a3 = g * a2
+    return a1, a2, a3
+
+class SVFStream(_TwoPoleStream):
+    """State variable filter with a single output `mode` (one of SVF_MODES). Works in blocks.
+
+    `topology` is 'chamberlin' (the default) or 'tpt' (see the comment at the top of this module).
+    """
+    def __init__(self, stream, freq, q=1.0, mode='low', topology='chamberlin', smooth=False):
+        if topology not in SVF_TOPOLOGIES:
+            raise ValueError(f"Unknown SVF topology '{topology}'")
+        if topology == 'chamberlin':
+            assert q >= 0.5
+        else:
+            assert q > 0
+        self.stream = stream
+        self.freq = freq
+        self.q = q
+        self.mode = mode
+        self.topology = topology
+        self.smooth = smooth
+        # Chamberlin's SVF has always taken its cutoff as given.
+        self.clip = topology == 'tpt'
+        self.weights = SVF_MODES[mode](1/q)
+
+    def _outputs(self, freq):
+        # (low, high, band) outputs, each as (C, D) in terms of the state and input.
+        k = 1/self.q
+        if self.topology == 'chamberlin':
+            # State is (low, band).
+            f1 = 2 * math.sin(math.pi * freq / streams.audio.SAMPLE_RATE)
+            low = np.array([1, f1]), 0
+            high = np.array([-1, -(f1 + k)]), 1
+            band = np.array([-f1, 1 - f1*(f1 + k)]), f1
+            A = np.array([low[0], band[0]])
+            B = np.array([low[1], band[1]])
+        else:
+            a1, a2, a3 = _tpt_coefficients(freq, self.q)
+            band = np.array([a1, -a2]), a2
+            low = np.array([a2, 1 - a3]), a3
+            high = -k*band[0] - low[0], 1 - k*band[1] - low[1]
+            A = np.array([[2*a1 - 1, -2*a2], [2*a2, 1 - 2*a3]])
+            B = np.array([2*a2, 2*a3])
+        return A, B, (low, high, band)
+
+    def _system(self, freq):
+        A, B, outputs = self._outputs(freq)
+        C = sum(weight * output[0] for weight, output in zip(self.weights, outputs))
+        D = sum(weight * output[1] for weight, output in zip(self.weights, outputs))
+        return A, B, C, D
+
+    def _coefficients(self, freqs):
+        if self.topology == 'chamberlin':
+            return (_chamberlin_coefficient(freqs),)
+        return _tpt_coefficients(freqs, self.q)
+
+    def _recurrence(self, x, coefficients, state):
+        # The loops only track the state; the outputs are mixed for the whole block afterwards.
+        k = 1/self.q
+        low_weight, high_weight, band_weight = self.weights
+        s1, s2 = state.tolist()
+        lows = []
+        bands = []
+        if self.topology == 'chamberlin':
+            low, band = s1, s2
+            for v0, f1 in zip(x.tolist(), coefficients[0].tolist()):
+                low += f1 * band
+                band += f1 * (v0 - low - k * band)
+                lows.append(low)
+                bands.append(band)
+            state[:] = low, band
+            lows = np.array(lows)
+            bands = np.array(bands)
+            # The high output is computed from the band output before it's updated.
+            previous = np.concatenate(([s2], bands[:-1]))
+            return low_weight*lows + high_weight*(x - lows - k*previous) + band_weight*bands
+        for v0, a1, a2, a3 in zip(x.tolist(), *coefficients.tolist()):
+            v3 = v0 - s2
+            band = a1*s1 + a2*v3
+            low = s2 + a2*s1 + a3*v3
+            s1 = 2*band - s1
+            s2 = 2*low - s2
+            lows.append(low)
+            bands.append(band)
+        state[:] = s1, s2
+        lows = np.array(lows)
+        bands = np.array(bands)
+        return low_weight*lows + high_weight*(x - k*bands - lows) + band_weight*bands
 
 @stream
-def svf(stream, freq, q=1.0):
+def _chamberlin_outputs(stream, freq, q):
     assert(q >= 0.5)
     low = band = 0
+    last_freq = None
     for x, f in zip(stream, maybe_const(freq)):
-        f1 = 2*math.sin(math.pi * f / SAMPLE_RATE)
-        # Faster approximation:
-        # f1 = 2*math.pi*f/SAMPLE_RATE
+        if f != last_freq:
+            f1 = 2*math.sin(math.pi * f / streams.audio.SAMPLE_RATE)
+            last_freq = f
         low += f1 * band
         high = x - low - 1/q * band
         band += f1 * high
         yield (low, high, band)
 
-def lpf(stream, f, q=1.0):
-    return svf(stream, f, q).map(lambda p: p[0])
+@stream
+def _tpt_outputs(stream, freq, q):
+    assert q > 0
+    k = 1/q
+    s1 = s2 = 0
+    nyquist = streams.audio.SAMPLE_RATE * 0.4999
+    last_freq = None
+    for v0, f in zip(stream, maybe_const(freq)):
+        if f != last_freq:
+            g = math.tan(math.pi * min(max(f, 0), nyquist) / streams.audio.SAMPLE_RATE)
+            a1 = 1 / (1 + g * (g + k))
+            a2 = g * a1
+            a3 = g * a2
+            last_freq = f
+        v3 = v0 - s2
+        band = a1*s1 + a2*v3
+        low = s2 + a2*s1 + a3*v3
+        s1 = 2*band - s1
+        s2 = 2*low - s2
+        yield (low, v0 - k*band - low, band)
+
+def svf(stream, freq, q=1.0, mode=None, topology='chamberlin', smooth=False):
+    """State variable filter with cutoff (or center) frequency `freq`, which may be a stream, and resonance `q`.
 
-def hpf(stream, f, q=1.0):
-    return svf(stream, f, q).map(lambda p: p[1])
+    With `mode` (one of SVF_MODES), returns that output alone, in blocks;
+    `smooth` then averages a time-varying `freq` over each block and filters the block with matrix products, rather than following `freq` every sample.
+    Otherwise, yields (low, high, band) tuples.
+    `topology` is 'chamberlin' (the default) or 'tpt' (see the comment at the top of this module).
+    """
+    if mode is not None:
+        return SVFStream(stream, freq, q, mode, topology, smooth)
+    if topology == 'chamberlin':
+        return _chamberlin_outputs(stream, freq, q)
+    if topology == 'tpt':
+        return _tpt_outputs(stream, freq, q)
+    raise ValueError(f"Unknown SVF topology '{topology}'")
 
-def bpf(stream, f, q=1.0):
-    return svf(stream, f, q).map(lambda p: p[2])
+def lpf(stream, f, q=1.0, topology='chamberlin', smooth=False):
+    return SVFStream(stream, f, q, 'low', topology, smooth)
 
-def notch(stream, f, q=1.0):
-    return svf(stream, f, q).map(lambda p: p[0] + p[1])
+def hpf(stream, f, q=1.0, topology='chamberlin', smooth=False):
+    return SVFStream(stream, f, q, 'high', topology, smooth)
 
-@stream
+def bpf(stream, f, q=1.0, topology='chamberlin', smooth=False):
+    return SVFStream(stream, f, q, 'band', topology, smooth)
+
+def notch(stream, f, q=1.0, topology='chamberlin', smooth=False):
+    return SVFStream(stream, f, q, 'notch', topology, smooth)
+
+
+def _shelf_terms(freq, q, gain):
+    w = 2 * np.pi * freq / streams.audio.SAMPLE_RATE
+    cos = np.cos(w)
+    alpha = np.sin(w) / (2*q)
+    A = 10 ** (gain / 40)
+    return cos, alpha, A
+
+def rbj_coefficients(kind, freq, q=math.sqrt(0.5), gain=0):
+    """Return (b, a) for one of the Audio EQ Cookbook biquads, normalized so that a[0] is 1.
+
+    `kind` is 'lowpass', 'highpass', 'bandpass' (0 dB peak), 'notch', 'allpass', 'peak', 'lowshelf', or 'highshelf';
+    `gain` (in dB) applies to the last three. `freq` may be an array, in which case so are the coefficients.
+    """
+    cos, alpha, A = _shelf_terms(freq, q, gain)
+    if kind == 'lowpass':
+        b, a = ((1 - cos)/2, 1 - cos, (1 - cos)/2), (1 + alpha, -2*cos, 1 - alpha)
+    elif kind == 'highpass':
+        b, a = ((1 + cos)/2, -(1 + cos), (1 + cos)/2), (1 + alpha, -2*cos, 1 - alpha)
+    elif kind == 'bandpass':
+        b, a = (alpha, 0*cos, -alpha), (1 + alpha, -2*cos, 1 - alpha)
+    elif kind == 'notch':
+        b, a = (1 + 0*cos, -2*cos, 1 + 0*cos), (1 + alpha, -2*cos, 1 - alpha)
+    elif kind == 'allpass':
+        b, a = (1 - alpha, -2*cos, 1 + alpha), (1 + alpha, -2*cos, 1 - alpha)
+    elif kind == 'peak':
+        b, a = (1 + alpha*A, -2*cos, 1 - alpha*A), (1 + alpha/A, -2*cos, 1 - alpha/A)
+    elif kind in ('lowshelf', 'highshelf'):
+        sign = 1 if kind == 'lowshelf' else -1
+        root = 2 * np.sqrt(A) * alpha
+        b = (A*((A + 1) - sign*(A - 1)*cos + root), sign*2*A*((A - 1) - sign*(A + 1)*cos), A*((A + 1) - sign*(A - 1)*cos - root))
+        a = ((A + 1) + sign*(A - 1)*cos + root, -sign*2*((A - 1) + sign*(A + 1)*cos), (A + 1) + sign*(A - 1)*cos - root)
+    else:
+        raise ValueError(f"Unknown biquad kind '{kind}'")
+    return tuple(c / a[0] for c in b), tuple(c / a[0] for c in a)
+
+class BiquadStream(_TwoPoleStream):
+    """Direct form II transposed biquad. Works in blocks.
+
+    The coefficients come from `design(freq)`, which returns (b, a) as in `rbj_coefficients()`;
+    `freq` may be a stream, in which case `design` must accept arrays. `smooth` is as in `svf()`.
+    """
+    def __init__(self, stream, freq, design, smooth=False):
+        self.stream = stream
+        self.freq = freq
+        self.design = design
+        self.smooth = smooth
+
+    def _system(self, freq):
+        (b0, b1, b2), (_, a1, a2) = self.design(freq)
+        A = np.array([[-a1, 1], [-a2, 0]])
+        B = np.array([b1 - a1*b0, b2 - a2*b0])
+        C = np.array([1, 0])
+        return A, B, C, b0
+
+    def _coefficients(self, freqs):
+        (b0, b1, b2), (_, a1, a2) = self.design(freqs)
+        return b0, b1, b2, a1, a2
+
+    def _recurrence(self, x, coefficients, state):
+        s1, s2 = state.tolist()
+        out = []
+        for x0, b0, b1, b2, a1, a2 in zip(x.tolist(), *coefficients.tolist()):
+            y = b0*x0 + s1
+            s1 = b1*x0 - a1*y + s2
+            s2 = b2*x0 - a2*y
+            out.append(y)
+        state[:] = s1, s2
+        return np.array(out)
+
+def biquad(stream, b, a):
+    "Filter `stream` with the biquad with (constant) coefficients `b` and `a`, each of length 3."
+    b = [c / a[0] for c in b]
+    a = [c / a[0] for c in a]
+    return BiquadStream(stream, 0, lambda freq: (b, a))
+
+def rbj(stream, kind, freq, q=math.sqrt(0.5), gain=0, smooth=False):
+    "Filter `stream` with an Audio EQ Cookbook biquad (see `rbj_coefficients()`). `freq` may be a stream."
+    return BiquadStream(stream, freq, lambda freq: rbj_coefficients(kind, freq, q, gain), smooth)
+
+class DelayLine:
+    """Circular buffer holding the recent past of a signal, for reading it back at delays of up to `max_delay` samples.
+
+    Samples are added a block at a time with `write()`. Between writes, any number of taps can be read with `read()`,
+    at integer or fractional (linearly interpolated) delays, which may vary from sample to sample.
+    (`AllpassTap` reads a constant fractional delay with allpass interpolation instead.)
+    Delays count from the samples about to be written, so a block of `n` samples can only read delays of at least `n`
+    before it is written. Feedback loops, which write what they read, must therefore use blocks no longer than their shortest delay.
+    Feedforward taps can instead read after writing, adding the length of the block to the delay.
+    """
+    def __init__(self, max_delay, channels=None):
+        self.max_delay = max_delay
+        self.channels = channels
+        # Number of samples written so far.
+        self.time = 0
+        self.buffer = self._allocate(math.ceil(max_delay) + BLOCK_SIZE + 2)
+
+    def _allocate(self, size):
+        return np.zeros((size,) if self.channels is None else (size, self.channels))
+
+    def _reserve(self, n):
+        # Make room for `n` more samples without overwriting any within `max_delay` of the oldest sample a tap may still read.
+        needed = math.ceil(self.max_delay) + n + 2
+        size = len(self.buffer)
+        if needed <= size:
+            return
+        past = np.arange(self.time - size, self.time)
+        buffer = self._allocate(max(needed, size * 2))
+        buffer[past % len(buffer)] = self.buffer.take(past, axis=0, mode='wrap')
+        self.buffer = buffer
+
+    def write(self, block):
+        "Append `block` to the delay line."
+        n = len(block)
+        self._reserve(n)
+        start = self.time % len(self.buffer)
+        first = min(n, len(self.buffer) - start)
+        self.buffer[start:start + first] = block[:first]
+        self.buffer[:n - first] = block[first:]
+        self.time += n
+
+    def read(self, delay, n=None):
+        """Read the samples `delay` samples before each of the next `n` samples to be written.
+
+        `delay` may be a number, in which case `n` is required, or an array with a delay for each sample
+        (and optionally, as a 2-D array, for each channel).
+        """
+        if np.ndim(delay) == 0:
+            if delay == int(delay):
+                start = self.time - int(delay)
+                return self.buffer.take(np.arange(start, start + n), axis=0, mode='wrap')
+            delay = np.full(n, float(delay))
+        delay = np.asarray(delay)
+        positions = self.time - delay + np.arange(len(delay)).reshape((-1,) + (1,) * (delay.ndim - 1))
+        if np.issubdtype(delay.dtype, np.integer):
+            return self._gather(positions)
+        base = np.floor(positions).astype(np.intp)
+        frac = positions - base
+        before = self._gather(base)
+        after = self._gather(base + 1)
+        if before.ndim > frac.ndim:
+            frac = frac[:, None]
+        return before + (after - before) * frac
+
+    def _gather(self, positions):
+        # Samples at `positions`: 1-D for every channel, or 2-D for a position per channel.
+        if positions.ndim == 1:
+            return self.buffer.take(positions, axis=0, mode='wrap')
+        # Index the flattened buffer, which is faster than indexing rows and columns separately.
+        channels = positions.shape[1]
+        return self.buffer.ravel().take(positions % len(self.buffer) * channels + np.arange(channels))
+
+def _one_pole(a, b):
+    # y[n] = b x[n] + a y[n-1], as a `_LinearSystem` (with an unused second state variable).
+    return _LinearSystem(np.array([[a, 0], [0, 0]]), np.array([b, 0]), np.array([a, 0]), b)
+
+class AllpassTap:
+    """Tap reading a constant fractional `delay` from `line` with first-order allpass interpolation.
+
+    Unlike linear interpolation, this passes all frequencies at full amplitude, which suits tuned feedback loops (like waveguides).
+    It keeps state between reads, so it should read every sample exactly once. `delay` must be at least 0.5.
+    """
+    def __init__(self, line, delay):
+        self.line = line
+        # Keep the fractional part between 0.5 and 1.5, where the allpass is well-behaved.
+        self.whole = math.floor(delay - 0.5)
+        frac = delay - self.whole
+        coefficient = (1 - frac) / (1 + frac)
+        self.coefficient = coefficient
+        self.filter = _LinearSystem(np.array([[-coefficient, 0], [0, 0]]), np.array([1, 0]), np.array([-coefficient, 0]), 1)
+
+    def read(self, n):
+        "Read the next `n` samples (before they are written, as with `DelayLine.read()`)."
+        # Integer-delayed samples, along with the one before them.
+        delayed = self.line.read(self.whole + 1, n + 1)
+        return self.filter.process(self.coefficient * delayed[1:] + delayed[:-1])
+
+def _delay_line_for(block, max_delay):
+    return DelayLine(max_delay, block.shape[1] if block.ndim > 1 else None)
+
+def _comb_blocks(size, stream, amp, delay):
+    line = None
+    for block in iter_blocks(stream, size):
+        block = np.asarray(block, dtype=np.float64)
+        if line is None:
+            line = _delay_line_for(block, abs(delay))
+        if delay >= 0:
+            line.write(block)
+            yield block + amp * line.read(delay + len(block), len(block))
+            continue
+        # Feedback, in pieces no longer than the delay.
+        out = np.empty(block.shape)
+        for start in range(0, len(block), -delay):
+            piece = block[start:start - delay]
+            y = piece + amp * line.read(-delay, len(piece))
+            line.write(y)
+            out[start:start + len(piece)] = y
+        yield out
+
+@stream_with(blocks=_comb_blocks, length=lambda stream, *args: known_length(stream))
 def comb(stream, amp, delay):
     "Comb filter: delay >= 0 for feedforward, delay < 0 for feedback. Expects integer delay."
-    if delay >= 0:
-        # Feedforward
-        buf = [0] * (delay + 1)
-        index = 0
-        for x in stream:
-            buf[index] = x
-            yield x + amp * buf[(index - delay) % len(buf)]
-            index = (index + 1) % len(buf)
-    else:
-        # Feedback (note that a delay of 0 would be invalid here, as it would cause a zero-delay cycle).
-        delay = -delay
-        buf = [0] * (delay + 1)
-        index = 0
-        for x in stream:
-            buf[index] = x + amp * buf[(index - delay) % len(buf)]
-            yield buf[index]
-            index = (index + 1) % len(buf)
+    # Note that a feedback delay of 0 would be invalid, as it would cause a zero-delay cycle.
+    for block in _comb_blocks(BLOCK_SIZE, stream, amp, delay):
+        yield from _unblock(block)
 
 # More generic:
+@stream
 def feed(stream, buffer_size, fn):
     buf = [0] * buffer_size
     index = 0
@@ -63,22 +579,258 @@ def feed(stream, buffer_size, fn):
         buf[index] = b
         index = (index + 1) % len(buf)
 
+def _var_comb_blocks(size, stream, amp, delay_stream, max_delay):
+    line = None
+    for block, delays in zip(iter_blocks(stream, size), iter_blocks(delay_stream, size)):
+        n = min(len(block), len(delays))
+        block = np.asarray(block[:n], dtype=np.float64)
+        delays = np.asarray(delays[:n], dtype=np.float64)
+        if line is None:
+            line = _delay_line_for(block, max_delay)
+        if (delays >= 0).all():
+            # Feedforward: read after writing.
+            line.write(block)
+            yield block + amp * line.read(delays + n)
+        else:
+            # Feedback (at least in part): in pieces no longer than the shortest delay in them.
+            # Feedforward samples write their input, and feedback samples write their output.
+            out = np.empty(block.shape)
+            start = 0
+            while start < n:
+                length = n - start
+                while length > 1 and np.abs(delays[start:start + length]).min() < length:
+                    length = max(1, int(np.abs(delays[start:start + length]).min()))
+                piece = block[start:start + length]
+                piece_delays = delays[start:start + length]
+                y = piece + amp * line.read(np.maximum(np.abs(piece_delays), 1))
+                forward = piece_delays >= 0
+                line.write(np.where(forward[:, None] if piece.ndim > 1 else forward, piece, y))
+                out[start:start + length] = y
+                start += length
+            yield out
+        if n < size:
+            return
+
+def _var_comb_length(stream, amp, delay_stream, max_delay):
+    lengths = [known_length(stream), known_length(delay_stream)]
+    return None if None in lengths else min(lengths)
 
+@stream_with(blocks=_var_comb_blocks, length=_var_comb_length)
 def var_comb(stream, amp, delay_stream, max_delay):
-    def fn(p, buf, index):
-        x, delay = p
-        # Linear interpolation for fractional delays.
-        index = (index - abs(delay)) % len(buf)
-        iindex = int(index)
-        a = index - iindex
-        y = x + amp * ((1-a) * buf[iindex] + a * buf[(iindex + 1) % len(buf)])
-        if delay >= 0:
-            return y, x
+    """Comb filter with a time-varying delay (in samples, up to `max_delay`), linearly interpolated for fractional delays.
+
+    As with `comb()`, positive delays are feedforward and negative delays are feedback.
+    """
+    for block in _var_comb_blocks(BLOCK_SIZE, stream, amp, delay_stream, max_delay):
+        yield from _unblock(block)
+
+
+# Freeverb's tunings, in samples at 44.1 kHz, and its other constants.
+# For reference: https://ccrma.stanford.edu/~jos/pasp/Freeverb.html
+FREEVERB_COMBS = (1116, 1188, 1277, 1356, 1422, 1491, 1557, 1617)
+FREEVERB_ALLPASSES = (556, 441, 341, 225)
+FREEVERB_SPREAD = 23
+_FREEVERB_GAIN = 0.015
+
+def _lowpass_combs(line, delays, lowpass, feedback, x):
+    # Feedback combs with a one-pole lowpass in the loop, one per channel of `line`, with `delays` in samples.
+    # Outputs the delayed signals.
+    out = np.empty((len(x), len(delays)))
+    step = min(delays)
+    for start in range(0, len(x), step):
+        piece = x[start:start + step]
+        delayed = line.read(np.broadcast_to(delays, (len(piece), len(delays))))
+        line.write(piece + feedback * lowpass.process(delayed))
+        out[start:start + len(piece)] = delayed
+    return out
+
+def _schroeder_allpass(line, delays, feedback, x):
+    out = np.empty(x.shape)
+    step = min(delays)
+    for start in range(0, len(x), step):
+        piece = x[start:start + step]
+        delayed = line.read(np.broadcast_to(delays, piece.shape))
+        line.write(piece + feedback * delayed)
+        out[start:start + len(piece)] = delayed - piece
+    return out
+
+def _reverb_blocks(size, stream, room=0.5, damp=0.5, wet=1/3, dry=0, width=1):
+    scale = streams.audio.SAMPLE_RATE / 44100
+    feedback = room * 0.28 + 0.7
+    damp *= 0.4
+    wet1 = wet * 3 * (width / 2 + 0.5)
+    wet2 = wet * 3 * (1 - width) / 2
+    dry *= 2
+    # All the combs (for both sides) run together, with a channel each: left side first, then right.
+    comb_delays = [round((tuning + spread) * scale) for spread in (0, FREEVERB_SPREAD) for tuning in FREEVERB_COMBS]
+    combs = DelayLine(max(comb_delays), len(comb_delays))
+    lowpass = _one_pole(damp, 1 - damp)
+    # Each allpass stage has a channel for each side.
+    allpasses = []
+    for tuning in FREEVERB_ALLPASSES:
+        delays = [round(tuning * scale), round((tuning + FREEVERB_SPREAD) * scale)]
+        allpasses.append((DelayLine(max(delays), 2), delays))
+    for block in iter_blocks(stream, size):
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim > 1:
+            left, right = block[:, 0], block[:, -1]
+            x = (left + right) * _FREEVERB_GAIN
         else:
-            return y, y
-    return feed(stream.zip(delay_stream), max_delay + 1, fn)
+            left = right = block
+            x = block * _FREEVERB_GAIN
+        x = np.broadcast_to(x[:, None], (len(x), len(comb_delays)))
+        out = _lowpass_combs(combs, comb_delays, lowpass, feedback, x).reshape(len(x), 2, -1).sum(axis=2)
+        for line, delays in allpasses:
+            out = _schroeder_allpass(line, delays, 0.5, out)
+        yield np.stack((out[:, 0] * wet1 + out[:, 1] * wet2 + left * dry, out[:, 1] * wet1 + out[:, 0] * wet2 + right * dry), axis=1)
+
+@stream_with(blocks=_reverb_blocks, length=lambda stream, *args, **kwargs: known_length(stream))
+def reverb(stream, room=0.5, damp=0.5, wet=1/3, dry=0, width=1):
+    """Freeverb-style stereo reverb. Takes mono or stereo input; outputs stereo.
+
+    `room` (size), `damp` (high-frequency damping), `wet`, `dry`, and `width` (stereo) range from 0 to 1, as in Freeverb.
+    The output is as long as the input, so append silence to hear the tail.
+    """
+    for block in _reverb_blocks(BLOCK_SIZE, stream, room, damp, wet, dry, width):
+        yield from _unblock(block)
+
+def _chorus_blocks(size, stream, rate=1.0, depth=0.002, delay=0.012, mix=0.5, spread=0.25):
+    sample_rate = streams.audio.SAMPLE_RATE
+    center = delay * sample_rate
+    swing = depth * sample_rate
+    phases = np.array([0, spread * 2*math.pi])
+    line = DelayLine(math.ceil(center + swing) + 1, 2)
+    t = 0
+    for block in iter_blocks(stream, size):
+        block = np.asarray(block, dtype=np.float64)
+        n = len(block)
+        x = np.broadcast_to(block[:, None] if block.ndim == 1 else block[:, :2], (n, 2))
+        lfo = np.sin(2*math.pi * rate * (t + np.arange(n))[:, None] / sample_rate + phases)
+        # Feedforward, so read after writing.
+        line.write(x)
+        yield (1 - mix) * x + mix * line.read(center + swing * lfo + n)
+        t += n
+
+@stream_with(blocks=_chorus_blocks, length=lambda stream, *args, **kwargs: known_length(stream))
+def chorus(stream, rate=1.0, depth=0.002, delay=0.012, mix=0.5, spread=0.25):
+    """Stereo chorus: mixes the input with copies delayed by around `delay` seconds, swept by `depth` seconds at `rate` Hz.
+
+    The right channel's sweep is `spread` cycles ahead of the left's. Takes mono or stereo input; outputs stereo.
+    """
+    for block in _chorus_blocks(BLOCK_SIZE, stream, rate, depth, delay, mix, spread):
+        yield from _unblock(block)
+
+
+class Convolver:
+    """Uniformly-partitioned FFT convolution with the impulse response `ir` (1-D, or 2-D with a column per channel).
+
+    Works incrementally: `process()` takes exactly `partition` samples at a time and returns as many.
+    The impulse response is split into partitions of the same length, and each input partition's spectrum is kept
+    for as many partitions as the impulse response has, so every call does the same amount of work
+    (one FFT, one inverse FFT, and a multiply-add per impulse response partition).
+    """
+    def __init__(self, ir, partition=BLOCK_SIZE):
+        ir = np.asarray(ir, dtype=np.float64)
+        self.partition = partition
+        self.ir_length = len(ir)
+        count = max(1, math.ceil(len(ir) / partition))
+        parts = np.zeros((count * partition,) + ir.shape[1:])
+        parts[:len(ir)] = ir
+        parts = parts.reshape((count, partition) + ir.shape[1:])
+        # Spectra of the impulse response partitions, with a channel axis, in reverse order and repeated twice,
+        # so that the ones matching the input spectra (which are kept in a ring) are always a contiguous slice.
+        spectra = np.fft.rfft(parts, 2 * partition, axis=1).reshape(count, partition + 1, -1)[::-1]
+        self.spectra = np.concatenate((spectra, spectra))
+        self.history = None
+        self.position = 0
+        self.overlap = None
+
+    def process(self, block):
+        "Return the next `partition` samples of output, after adding `block` (of `partition` samples) to the input."
+        block = np.asarray(block, dtype=np.float64)
+        count = len(self.spectra) // 2
+        spectrum = np.fft.rfft(block, 2 * self.partition, axis=0).reshape(self.partition + 1, -1)
+        if self.history is None:
+            channels = max(spectrum.shape[1], self.spectra.shape[2])
+            self.history = np.zeros((count, self.partition + 1, spectrum.shape[1]), dtype=complex)
+            self.overlap = np.zeros((self.partition, channels))
+            # Mono output for mono input and a mono impulse response.
+            self.mono = block.ndim == 1 and self.spectra.shape[2] == 1
+        self.position = (self.position + 1) % count
+        self.history[self.position] = spectrum
+        # Pair the input spectrum from k partitions ago with impulse response partition k.
+        spectra = self.spectra[count - 1 - self.position:2 * count - 1 - self.position]
+        out = np.fft.irfft((self.history * spectra).sum(axis=0), 2 * self.partition, axis=0)
+        out[:self.partition] += self.overlap
+        self.overlap = out[self.partition:]
+        out = out[:self.partition]
+        return out[:, 0] if self.mono else out
+
+def _load_ir(ir):
+    if isinstance(ir, str):
+        ir = wav.load_array(ir, resample=True)
+        return ir[:, 0] if ir.shape[1] == 1 else ir
+    return np.asarray(ir, dtype=np.float64)
+
+class ConvolvedStream(Stream):
+    "Stream convolved with an impulse response using `Convolver`, including the tail after the stream ends. Works in blocks."
+    def __init__(self, stream, ir, partition=BLOCK_SIZE):
+        self.stream = stream
+        self.ir = _load_ir(ir)
+        self.partition = partition
+
+    def __iter__(self):
+        for block in self.__iter_blocks__(BLOCK_SIZE):
+            yield from _unblock(block)
+
+    def __iter_blocks__(self, size):
+        return _rechunk(self._convolved_blocks(), size)
+
+    def _convolved_blocks(self):
+        convolver = Convolver(self.ir, self.partition)
+        length = 0
+        last = None
+        for block in iter_blocks(self.stream, self.partition):
+            length += len(block)
+            last = block
+            if len(block) < self.partition:
+                break
+            yield convolver.process(block)
+        if last is None:
+            return
+        # Pad the last partition, then flush out the tail.
+        remaining = length + len(self.ir) - 1 - (length // self.partition) * self.partition
+        padded = np.zeros((self.partition,) + np.shape(last)[1:])
+        if len(last) < self.partition:
+            padded[:len(last)] = last
+        while remaining > 0:
+            out = convolver.process(padded)
+            yield out[:remaining]
+            remaining -= len(out)
+            padded[:] = 0
+
+    def has_blocks(self):
+        return True
+
+    def known_length(self):
+        length = known_length(self.stream)
+        if length is None or length == math.inf or length == 0:
+            return length
+        return length + len(self.ir) - 1
+
+def convolve(stream, ir, partition=BLOCK_SIZE):
+    """Convolve `stream` with the impulse response `ir`, for convolution reverb and the like.
+
+    `ir` is an array (with a column per channel for multichannel responses) or the name of a wave file,
+    which is resampled to SAMPLE_RATE if needed.
+    A stereo impulse response makes mono input stereo; with stereo input, each channel is convolved with its own.
+    The work per sample depends on the length of the impulse response, but not on the position in the stream.
+    `partition` sets the number of input samples read at a time, which bounds the latency with live input.
+    """
+    return ConvolvedStream(stream, ir, partition)
 
 
 # play(bpf(rand, 1000 + 500 * osc(0.1), 5))
 # play(bpf(rand, 2000 + 500 * (osc(1000) + osc(0.1)), 100))
 # play(notch(rand, 1000 + 500 * osc(0.1), 0.5))
+# play(reverb(osc(440)[:0.1] >> silence[:3.0]))
@@ -12,16 +12,26 @@ At any point in the stream, multiple events may occur simultaneously (tuple of l
 Because event streams yield tuples, they may be composed in parallel by addition:
 `event_stream_a + event_stream_b` creates a combined event stream with all the events from both.
 
+Since most samples have no events, event streams may also be sparse (see `SparseEventStream`):
+pairs of `(gap, events)`, meaning `gap` samples with no events followed by a sample with `events`.
+A sparse event stream still yields a tuple per sample when iterated, so it works anywhere an event stream does,
+but functions that understand the sparse form (like `load()`, `save()`, and the instruments here) skip over the gaps.
+`sparse()` and `dense()` convert between the two forms.
+
 An _instrument_ is any function that takes an event stream and returns a sample stream.
 
 Example usage:
 play(midi.poly_instrument(midi.input_stream()))
 """
+import itertools
+import math
+
 import mido
+import numpy as np
 
-from aleatora.streams.core import FunctionStream
+from aleatora.streams.core import FunctionStream, _rechunk, _unblock
 
-from .streams import const, events_in_time, frame, m2f, osc, ramp, repeat, SAMPLE_RATE, stream
+from .streams import BLOCK_SIZE, BlockReader, events_in_time, frame, has_blocks, iter_blocks, m2f, osc, ramp, repeat, SAMPLE_RATE, stream, Stream
 
 get_input_names = mido.get_input_names
 
@@ -43,20 +53,85 @@ def input_stream(port=None):
         port = mido.open_input(port)
     return repeat(lambda: tuple(port.iter_pending()))
 
-@stream
+# Sparse event streams
+
+class SparseEventStream(Stream):
+    """Event stream stored as `(gap, events)` pairs: `gap` samples with no events, followed by a sample with `events`.
+    A pair with no events just adds the gap (e.g. for silence at the end, or a stretch of silence read from a dense stream).
+
+    `pairs` may be any iterable that can be iterated more than once, such as a list or a Stream.
+    Iterating yields the dense form, with a tuple per sample.
+    """
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    def __iter__(self):
+        for gap, events in self.pairs:
+            yield from itertools.repeat((), gap)
+            if events:
+                yield events
+
+def iter_sparse(stream, max_gap=BLOCK_SIZE):
+    """Iterate over an event stream, sparse or dense, as `(gap, events)` pairs.
+
+    A dense stream may be live (like `input_stream()`), with no telling when the next events will come,
+    so it is read at most `max_gap` samples at a time, and runs of samples without events come out as pairs with no events.
+    """
+    if isinstance(stream, SparseEventStream):
+        return iter(stream.pairs)
+    return _sparse_pairs(stream, max_gap)
+
+def _sparse_pairs(stream, max_gap=BLOCK_SIZE):
+    gap = 0
+    for events in stream:
+        if events:
+            yield (gap, events)
+            gap = 0
+        else:
+            gap += 1
+            if gap == max_gap:
+                yield (gap, ())
+                gap = 0
+    if gap:
+        yield (gap, ())
+
+def sparse(stream):
+    "Convert a dense event stream (with a tuple per sample) to a `SparseEventStream`."
+    if isinstance(stream, SparseEventStream):
+        return stream
+    return SparseEventStream(FunctionStream(lambda: _sparse_pairs(stream)))
+
+def dense(stream):
+    "Convert a `SparseEventStream` to a plain event stream with a tuple per sample."
+    return FunctionStream(lambda: iter(stream))
+
 def load(filename, include_meta=False):
+    "Load a MIDI file as a `SparseEventStream`."
+    return SparseEventStream(_load_pairs(filename, include_meta))
+
+@stream
+def _load_pairs(filename, include_meta):
     simultaneous = []
+    gap = 0
     delta = 0
     for message in mido.MidiFile(filename):
         delta += message.time * SAMPLE_RATE
         if int(delta) > 0:
-            yield tuple(simultaneous)
+            if simultaneous:
+                yield (gap, tuple(simultaneous))
+                gap = 0
+            else:
+                gap += 1
             delta -= 1
-            yield from const(())[:int(delta)]
+            gap += int(delta)
             delta -= int(delta)
             simultaneous = []
         if not message.is_meta or include_meta:
             simultaneous.append(message)
+    if simultaneous:
+        yield (gap, tuple(simultaneous))
+    elif gap:
+        yield (gap, ())
 
 def save(stream, filename, rate=None, bpm=120):
     if rate is None:
@@ -64,15 +139,18 @@ def save(stream, filename, rate=None, bpm=120):
     mid = mido.MidiFile()
     track = mido.MidiTrack()
     mid.tracks.append(track)
+    ticks = 1/rate * (bpm / 60) * mid.ticks_per_beat
     t = 0
-    for messages in stream:
+    for gap, messages in iter_sparse(stream):
+        t += gap * ticks
         for message in messages:
             if not isinstance(message, mido.Message):
                 message = mido.Message(message.type, note=int(message.note), velocity=int(message.velocity or 0))
             message.time = int(t)
             t -= int(t)
             track.append(message)
-        t += 1/rate * (bpm / 60) * mid.ticks_per_beat
+        if messages:
+            t += ticks
     mid.save(filename)
 
 # Instruments take a stream of tuples of MIDI-style messages
@@ -87,20 +165,22 @@ def save(stream, filename, rate=None, bpm=120):
 def mono_instrument(stream, freq=0, amp=0, velocity=0, waveform=osc):
     freq_stream = repeat(lambda: freq)
     waveform_iter = iter(waveform(freq_stream))
-    for events in stream:
-        if not events:
-            pass
-        elif events[-1].type == 'note_on':
-            freq = m2f(events[-1].note)
-            velocity = events[-1].velocity
-        elif events[-1].type == 'note_off':
-            velocity = 0
-        target_amp = velocity / 127
-        if amp > target_amp:
-            amp = max(target_amp, amp - 1e-4)
-        else:
-            amp = min(target_amp, amp + 1e-6 * velocity**2)
-        yield amp * next(waveform_iter)
+    target_amp = velocity / 127
+    for gap, events in iter_sparse(stream):
+        # The events land on the sample after the gap.
+        for i in range(gap + 1 if events else gap):
+            if i == gap:
+                if events[-1].type == 'note_on':
+                    freq = m2f(events[-1].note)
+                    velocity = events[-1].velocity
+                elif events[-1].type == 'note_off':
+                    velocity = 0
+                target_amp = velocity / 127
+            if amp > target_amp:
+                amp = max(target_amp, amp - 1e-4)
+            else:
+                amp = min(target_amp, amp + 1e-6 * velocity**2)
+            yield amp * next(waveform_iter)
     while amp > 0:
         if amp > target_amp:
             amp = max(target_amp, amp - 1e-4)
@@ -108,70 +188,243 @@ def mono_instrument(stream, freq=0, amp=0, velocity=0, waveform=osc):
             amp = min(target_amp, amp + 1e-6 * velocity**2)
         yield amp * next(waveform_iter)
 
-# Convert a monophonic instrument into a polyphonic instrument.
-def make_poly(monophonic_instrument, persist_internal=False):
-    # Provides a 'substream' of messages for a single voice in a polyphonic instrument.
-    def make_event_substream():
-        @FunctionStream
-        def substream():
-            while substream.last_event is None:
-                yield substream.events
-            yield (substream.last_event,)
-        substream.events = ()
-        substream.last_event = None
-        return substream
+# Polyphony: a polyphonic instrument plays each note on a voice, which is a monophonic instrument
+# reading its own event substream (the events for that note). Voices live in a pool of slots
+# which are reused from note to note, so that dense event streams don't allocate constantly.
 
-    @stream
+VOICE_STEALING = ('oldest', 'quietest', 'same-note')
+
+class _Voice:
+    # A slot in the voice pool. `queue` holds the events for the voice in the block being rendered,
+    # as (offset, events, ending) triples; only voices that receive events are touched when dispatching.
+    # `output` reads the monophonic instrument's output in blocks (a `BlockReader`) or samples (according to `in_blocks`),
+    # and `start` is where its output begins in the block being rendered.
+    __slots__ = ('substream', 'output', 'in_blocks', 'start', 'queue', 'note', 'held', 'started', 'level')
+
+    def __init__(self, pool):
+        self.substream = SparseEventStream(FunctionStream(lambda: _voice_events(self, pool)))
+        self.output = None
+        self.in_blocks = False
+        self.start = 0
+        self.queue = []
+        self.note = None
+        self.held = False
+        self.started = 0
+        self.level = 0.0
+
+def _voice_events(voice, pool):
+    # Sparse substream for a voice. Voices are rendered a block at a time, once all the events in the block have been dispatched,
+    # so each block of the substream is the voice's queued events, with gaps between them and up to the end of the block.
+    # Unless voices persist, the substream ends after the events that end the note.
+    while True:
+        queue, voice.queue = voice.queue, []
+        position = voice.start
+        for offset, events, ending in queue:
+            yield (offset - position, events)
+            position = offset + 1
+            if ending and not pool.persist:
+                return
+        if position < pool.size:
+            yield (pool.size - position, ())
+
+class _VoicePool:
+    # The voices of one iteration of a `PolyStream`, and the notes they're holding.
+    def __init__(self, monophonic_instrument, kwargs, persist, max_voices, steal, size):
+        self.monophonic_instrument = monophonic_instrument
+        self.kwargs = kwargs
+        self.persist = persist
+        self.max_voices = max_voices
+        self.steal = steal
+        self.voices = []
+        self.held = {}
+        # Block size, and the block being rendered.
+        self.size = size
+        self.out = np.zeros(size)
+        self.rendered = 0
+
+    def dispatch(self, events, t, offset):
+        held = self.held
+        for event in events:
+            if event.type == 'note_on':
+                voice = held.get(event.note)
+                if voice is None:
+                    # New note
+                    voice = held[event.note] = self.allocate(event.note, t, offset)
+                # Otherwise, retrigger existing voice.
+                self.send(voice, offset, event, False)
+            elif event.type == 'note_off':
+                voice = held.pop(event.note, None)
+                if voice is not None:
+                    self.send(voice, offset, event, True)
+                    voice.held = False
+
+    def send(self, voice, offset, event, ending):
+        # As before, only the last event for a voice in a given sample counts.
+        if voice.queue and voice.queue[-1][0] == offset:
+            voice.queue.pop()
+        voice.queue.append((offset, (event,), ending))
+
+    def allocate(self, note, t, offset):
+        voices = self.voices
+        voice = None
+        if self.persist or self.steal == 'same-note':
+            # Reuse the voice that's releasing the same note, if any.
+            voice = next((v for v in voices if v.note == note and v.output is not None and not v.held), None)
+            if voice is not None and not self.persist:
+                # Its substream ended with the note, so start it over.
+                self.interrupt(voice, offset)
+        if voice is None:
+            # Finished voices are free.
+            voice = next((v for v in voices if v.output is None), None)
+        if voice is None and (self.max_voices is None or len(voices) < self.max_voices):
+            voice = _Voice(self)
+            voices.append(voice)
+        if voice is None:
+            # Steal a voice, preferring those that are already releasing.
+            candidates = [v for v in voices if not v.held] or voices
+            if self.steal == 'quietest':
+                voice = min(candidates, key=lambda v: v.level)
+            else:
+                voice = min(candidates, key=lambda v: v.started)
+            if voice.held:
+                del self.held[voice.note]
+            if not self.persist:
+                self.interrupt(voice, offset)
+        if voice.output is None:
+            voice.queue = []
+            instrument = self.monophonic_instrument(voice.substream, **self.kwargs)
+            # Voices start right on the note. Instruments that work in blocks are read through a BlockReader,
+            # so each of their blocks straddles two of ours, and the part past the end of this one carries over to the next.
+            voice.in_blocks = has_blocks(instrument)
+            voice.output = BlockReader(iter_blocks(instrument, self.size)) if voice.in_blocks else iter(instrument)
+            voice.start = offset
+        voice.note = note
+        voice.held = True
+        voice.started = t
+        # Don't let a new voice look like the quietest before it has made a sound.
+        voice.level = math.inf
+        return voice
+
+    def interrupt(self, voice, offset):
+        # Cut the voice off at `offset` in the current block, freeing its slot.
+        # It has all of its events up to there, so render it now.
+        self.mix(self.read(voice, offset), voice.start)
+        voice.output = None
+
+    def read(self, voice, end):
+        # The voice's output from its start in the current block up to `end`.
+        if voice.in_blocks:
+            return voice.output.read(end - voice.start)
+        return np.array(list(itertools.islice(voice.output, end - voice.start)))
+
+    def mix(self, block, start):
+        if len(block):
+            if block.ndim > self.out.ndim:
+                self.out = np.repeat(self.out[:, None], block.shape[1], axis=1)
+            elif block.ndim < self.out.ndim:
+                block = block[:, None]
+            self.out[start:start + len(block)] += block
+            self.rendered = max(self.rendered, start + len(block))
+
+    def render(self):
+        # Mix the current block of every active voice, and start on the next block.
+        # Returns the mixed block and the number of samples any voice rendered.
+        for voice in self.voices:
+            if voice.output is None:
+                continue
+            block = self.read(voice, self.size)
+            if len(block):
+                self.mix(block, voice.start)
+                voice.level = float(np.abs(block).max())
+            if len(block) < self.size - voice.start:
+                # Voice finished; its slot is free.
+                voice.output = None
+                if voice.held:
+                    del self.held[voice.note]
+                    voice.held = False
+            voice.start = 0
+        out, rendered = self.out, self.rendered
+        self.out = np.zeros(out.shape)
+        self.rendered = 0
+        return out, rendered
+
+class PolyStream(Stream):
+    """Output of a polyphonic instrument (see `make_poly()`). Works in blocks.
+
+    Each block, the events in the block are sent to the voices, and then every voice renders the block
+    (in one piece, if the monophonic instrument works in blocks).
+    """
+    def __init__(self, monophonic_instrument, stream, kwargs, persist_internal=False, max_voices=None, steal='oldest'):
+        self.monophonic_instrument = monophonic_instrument
+        self.stream = stream
+        self.kwargs = kwargs
+        self.persist_internal = persist_internal
+        self.max_voices = max_voices
+        self.steal = steal
+
+    def __iter__(self):
+        for block in self.__iter_blocks__(BLOCK_SIZE):
+            yield from _unblock(block)
+
+    def __iter_blocks__(self, size):
+        return _rechunk(self._render(size), size)
+
+    def has_blocks(self):
+        return True
+
+    def _render(self, size):
+        pool = _VoicePool(self.monophonic_instrument, self.kwargs, self.persist_internal, self.max_voices, self.steal, size)
+        pairs = iter_sparse(self.stream, size)
+        # Samples until the next events are due, and those events.
+        # Once the event stream ends, keep going until the voices finish.
+        due, events = next(pairs, (math.inf, ()))
+        t = 0
+        while True:
+            length = 0 if due == math.inf else size
+            position = 0
+            while position + due < size:
+                position += due
+                pool.dispatch(events, t + position, position)
+                gap, next_events = next(pairs, (math.inf, ()))
+                if gap == math.inf:
+                    length = position + 1 if events else position
+                # The events just dispatched take up a sample, too.
+                due = gap + 1 if events else gap
+                events = next_events
+            due -= size - position
+            out, rendered = pool.render()
+            length = max(length, rendered)
+            if not length:
+                return
+            t += size
+            yield out[:length]
+
+def make_poly(monophonic_instrument, persist_internal=False, max_voices=None, steal='oldest'):
+    """Convert a monophonic instrument into a polyphonic instrument.
+
+    Each note plays on a voice from a pool of at most `max_voices`. This is unlimited by default, as polyphony always was,
+    so that no notes are cut off unless you ask for it; set it to bound the cost of dense passages.
+    When the pool is full, a new note steals a voice according to `steal`:
+    'oldest' takes the voice that started longest ago, 'quietest' the one with the lowest recent level,
+    and 'same-note' the one releasing the same note (or else the oldest). Voices that are releasing are stolen first.
+    With 'same-note', a note played again while it is still releasing always takes over its old voice, even if the pool isn't full.
+
+    Voices are reused rather than rebuilt. If `persist_internal`, voices persist after their notes end,
+    and later notes are sent to them as new events (so the monophonic instrument must handle retriggering):
+    to the voice that last played the same note, or to a stolen voice once the pool is full.
+    Otherwise, each note plays on a fresh instance of the monophonic instrument, which frees its voice when it ends.
+    """
+    if steal not in VOICE_STEALING:
+        raise ValueError(f"Unknown voice stealing policy {steal!r}; expected one of {', '.join(VOICE_STEALING)}")
     def polyphonic_instrument(stream, **kwargs):
-        substreams = {}
-        voices = []
-        for events in stream:
-            acc = 0
-            # Clear old messages:
-            for substream in substreams.values():
-                substream.events = ()
-            for event in events:
-                if event.type == 'note_on':
-                    if event.note in substreams:
-                        # Retrigger existing voice
-                        substreams[event.note].events = (event,)
-                    else:
-                        # New voice
-                        substream = make_event_substream()
-                        substream.events = (event,)
-                        substreams[event.note] = substream
-                        voices.append(iter(monophonic_instrument(substream, **kwargs)))
-                elif event.type == 'note_off':
-                    if event.note in substreams:
-                        if persist_internal:
-                            substreams[event.note].events = (event,)
-                        else:
-                            substreams[event.note].last_event = event
-                            del substreams[event.note]
-
-            for i in range(len(voices) - 1, -1, -1):
-                try:
-                    sample = next(voices[i])
-                    acc += sample
-                except StopIteration:
-                    del voices[i]
-            yield acc
-        while voices:
-            acc = 0
-            for i in range(len(voices) - 1, -1, -1):
-                try:
-                    sample = next(voices[i])
-                    acc += sample
-                except StopIteration:
-                    del voices[i]
-            yield acc
+        return PolyStream(monophonic_instrument, stream, kwargs, persist_internal, max_voices, steal)
     return polyphonic_instrument
 
 # Handy decorator version
-def poly(monophonic_instrument=None, persist_internal=False):
+def poly(monophonic_instrument=None, persist_internal=False, max_voices=None, steal='oldest'):
     if monophonic_instrument is None:
-        return lambda mi: make_poly(mi, persist_internal)
-    return make_poly(monophonic_instrument, persist_internal)
+        return lambda mi: make_poly(mi, persist_internal, max_voices, steal)
+    return make_poly(monophonic_instrument, persist_internal, max_voices, steal)
 
 poly_instrument = poly(mono_instrument)
 
@@ -182,7 +435,8 @@ def events_to_notes(event_stream, rate=None):
         rate = SAMPLE_RATE
     t = 0
     ongoing = {}
-    for messages in event_stream:
+    for gap, messages in iter_sparse(event_stream):
+        t += gap/rate
         for message in messages:
             if message.type not in ('note_on', 'note_off'):
                 continue
@@ -193,7 +447,8 @@ def events_to_notes(event_stream, rate=None):
                 start, velocity = ongoing[pitch]
                 yield {"start": start, "end": t, "pitch": pitch, "velocity": velocity}
                 del ongoing[pitch]
-        t += 1/rate
+        if messages:
+            t += 1/rate
 
 def sampler(mapping, fade=0.01):
     "Instrument that maps MIDI pitches to streams. Resamples to account for octave jumps."
@@ -239,18 +494,28 @@ def soundfont(event_stream, preset=0, chunk_size=1024, path="/usr/share/sounds/s
     sfid = fs.sfload(path)
     fs.program_select(0, sfid, 0, preset)
 
-    for chunk in event_stream.chunk(chunk_size):
-        for events in chunk:
-            for event in events:
-                channel = getattr(event, "channel", 0)
-                if event.type == 'note_on':
-                    fs.noteon(channel, int(event.note), event.velocity)
-                elif event.type == 'note_off':
-                    fs.noteoff(channel, int(event.note))
-                elif event.type == 'control_change':
-                    fs.cc(channel, event.control, event.value)
-                elif event.type == 'program_change':
-                    fs.program_change(channel, event.program)
+    # Events take effect at the start of the chunk they fall in.
+    position = 0
+    for gap, events in iter_sparse(event_stream):
+        position += gap
+        while position >= chunk_size:
+            yield from map(frame, fs.get_samples(chunk_size).reshape((-1, 2)) / (2**15-1))
+            position -= chunk_size
+        for event in events:
+            channel = getattr(event, "channel", 0)
+            if event.type == 'note_on':
+                fs.noteon(channel, int(event.note), event.velocity)
+            elif event.type == 'note_off':
+                fs.noteoff(channel, int(event.note))
+            elif event.type == 'control_change':
+                fs.cc(channel, event.control, event.value)
+            elif event.type == 'program_change':
+                fs.program_change(channel, event.program)
+        if events:
+            position += 1
+    # Finish the last chunk.
+    while position > 0:
         yield from map(frame, fs.get_samples(chunk_size).reshape((-1, 2)) / (2**15-1))
+        position -= chunk_size
 
     fs.delete()
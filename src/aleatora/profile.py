@@ -12,11 +12,47 @@ Example usage:
     mix: 441001 calls (1 ending)
         0.226us avg | 0.099s total | 0.99% of budget
     >>> profile.reset()
+
+To profile every stream in a composition without wrapping them by hand, enable the hierarchical profiler:
+
+    >>> profile.enable()
+    >>> _ = list((osc(440) + osc(660))[:10.0])
+    >>> profile.disable()
+    >>> profile.dump()
+    Real-time budget: 22.676us per sample
+    SliceStream: 441000 samples in 441001 calls
+      0.312s total | 0.071s self | 1.60% of budget (0.36% self)
+        MixStream: 441000 samples in 441000 calls (0 endings)
+          0.241s total | 0.102s self | 1.24% of budget (0.52% self)
+            osc: 882000 samples in 882000 calls (0 endings)
+              0.139s total | 0.139s self | 0.71% of budget (0.71% self)
+    >>> profile.dump_collapsed('profile.txt')
+
+Streams with the same label under the same parent (like the two `osc`s above) are counted together.
+Times include the profiler's own overhead (about a microsecond per call), so they are only meaningful relative to each other.
+
+For live sessions, where even that overhead would get in the way, use the sampling profiler instead.
+It periodically records what the thread rendering audio is doing, from a separate thread:
+
+    >>> profile.start_sampling()
+    >>> play(composition)
+    >>> # ...
+    >>> profile.stop_sampling()
+    >>> profile.dump()
+    ...
+    Sampled 2000 stacks from Thread-1 (_produce), every 5.0ms:
+       self   total  function
+      31.2%   88.4%  MixStream.__iter__
+      ...
 """
 
+import collections
+import sys
+import threading
 import time
+import types
 
-from . import streams
+from . import audio, streams
 
 
 @streams.stream
@@ -35,12 +71,175 @@ def profile_stream(entry, stream):
         yield value
 
 
+# Hierarchical profiling: while enabled, the `__iter__` and `__iter_blocks__` methods of every Stream class are replaced
+# with versions that wrap the resulting iterators in timers. Each timer belongs to a node in a tree,
+# which is a child of whichever node was running when the iterator was created.
+# When disabled, the original methods are restored, so there is no overhead.
+
+# The tree only keeps labels, never the streams themselves: children with the same label are counted together,
+# and once there are `_MAX_NODES` nodes, new streams are counted in a single '...' child of their parent.
+_MAX_NODES = 10000
+_OVERFLOW = '...'
+
+class _Node:
+    __slots__ = ('label', 'children', 'calls', 'samples', 'ends', 'time', 'child_time')
+    # Number of nodes in the tree.
+    count = 0
+
+    def __init__(self, label):
+        _Node.count += 1
+        self.label = label
+        # Keyed by label (which says whether the child is in blocks).
+        self.children = {}
+        self.calls = 0
+        self.samples = 0
+        self.ends = 0
+        self.time = 0.0
+        self.child_time = 0.0
+
+    def child(self, strm, blocks):
+        label = _label(strm) + (' [blocks]' if blocks else '')
+        node = self.children.get(label)
+        if node is None:
+            if _Node.count >= _MAX_NODES:
+                if self.label == _OVERFLOW:
+                    # Streams under the overflow node are counted in it, too.
+                    return self
+                label = _OVERFLOW
+                node = self.children.get(label)
+            if node is None:
+                node = self.children[label] = _Node(label)
+        return node
+
+    @property
+    def self_time(self):
+        return self.time - self.child_time
+
+def _label(strm):
+    if isinstance(strm, streams.FunctionStream):
+        # Find the generator function behind the stream (e.g. `osc`) in the closure of `@stream`/`stream_with`.
+        for cell in strm.func.__closure__ or ():
+            try:
+                value = cell.cell_contents
+            except ValueError:
+                continue
+            if isinstance(value, types.FunctionType) and value.__name__ != '<lambda>':
+                return value.__name__
+        # Or a global function called by the lambda (e.g. in `const()`).
+        for name in strm.func.__code__.co_names:
+            if isinstance(strm.func.__globals__.get(name), types.FunctionType):
+                return name.lstrip('_')
+    if isinstance(strm, streams.MapStream):
+        return f"map({getattr(strm.fn, '__qualname__', type(strm.fn).__name__)})"
+    return type(strm).__name__
+
+class _State(threading.local):
+    def __init__(self):
+        # Nodes whose iterators are currently running (in this thread), innermost last.
+        self.stack = []
+
+_state = _State()
+_root = _Node('')
+
+class _ProfiledIterator:
+    __slots__ = ('node', 'it', 'blocks')
+
+    def __init__(self, node, it, blocks):
+        self.node = node
+        self.it = it
+        self.blocks = blocks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        node = self.node
+        stack = _state.stack
+        stack.append(node)
+        start = time.perf_counter()
+        try:
+            value = next(self.it)
+        except StopIteration:
+            node.ends += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            node.calls += 1
+            # A node running inside itself (the overflow node) already counts this time when the outer call returns.
+            if not stack or stack[-1] is not node:
+                node.time += elapsed
+                if stack:
+                    stack[-1].child_time += elapsed
+        node.samples += len(value) if self.blocks else 1
+        return value
+
+def _instrument(method, blocks):
+    def instrumented(self, *args):
+        stack = _state.stack
+        node = (stack[-1] if stack else _root).child(self, blocks)
+        # Creating the iterator may do some work, too (and may create iterators for the children).
+        stack.append(node)
+        start = time.perf_counter()
+        try:
+            it = method(self, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if not stack or stack[-1] is not node:
+                node.time += elapsed
+                if stack:
+                    stack[-1].child_time += elapsed
+        return _ProfiledIterator(node, it, blocks)
+    instrumented.original = method
+    return instrumented
+
+class _Sampler:
+    # Records the call stack of `thread` every `interval` seconds, until stopped.
+    def __init__(self, thread, interval):
+        self.thread = thread
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._run, daemon=True)
+        self.sampler.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread.ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                # Leave out the thread machinery and the profiler itself.
+                if code.co_filename not in (threading.__file__, __file__):
+                    stack.append(getattr(code, 'co_qualname', code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.sampler.join()
+
+def _stream_classes():
+    classes = [streams.Stream]
+    for cls in classes:
+        classes.extend(subclass for subclass in cls.__subclasses__() if subclass not in classes)
+    return classes
+
+
 # This is what's exposed in the package.
 class profile:
     # Set class docstring to module docstring.
     __doc__ = __doc__
 
     data = {}
+    _patched = []
+    _sampler = None
+    # Call stacks recorded by the sampling profiler, with how many times each was seen.
+    samples = collections.Counter()
+    _sampled_thread = None
+    _sample_interval = None
 
     def __new__(cls, key, stream):
         if key not in profile.data:
@@ -49,10 +248,59 @@ class profile:
             profile.data[key] = [0, 0, 0.0]
         return profile_stream(profile.data[key], stream)
 
+    @staticmethod
+    def enable():
+        "Start profiling every stream (that is, every Stream class defined so far) as it is iterated."
+        if profile._patched:
+            return
+        for cls in _stream_classes():
+            for name, blocks in (('__iter__', False), ('__iter_blocks__', True)):
+                if name in cls.__dict__:
+                    setattr(cls, name, _instrument(cls.__dict__[name], blocks))
+                    profile._patched.append((cls, name))
+
+    @staticmethod
+    def disable():
+        "Stop profiling every stream. Iterators created while profiling was enabled still record their timings."
+        for cls, name in profile._patched:
+            setattr(cls, name, cls.__dict__[name].original)
+        profile._patched.clear()
+
+    @staticmethod
+    def start_sampling(thread=None, interval=0.005):
+        """Start sampling what `thread` is doing every `interval` seconds, from a separate thread.
+
+        By default, samples the thread that renders audio for playback (see `audio.setup()`), or the main thread if there isn't one.
+        Samples are only taken when the sampled thread lets go of the GIL, which it does every few milliseconds
+        (see `sys.setswitchinterval()`) and in many NumPy operations, so the results are approximate.
+        """
+        profile.stop_sampling()
+        if thread is None:
+            thread = audio._output.thread if audio._output else threading.main_thread()
+        profile._sampled_thread = thread.name
+        profile._sample_interval = interval
+        profile._sampler = _Sampler(thread, interval)
+
+    @staticmethod
+    def stop_sampling():
+        "Stop the sampling profiler, adding what it recorded to `profile.samples`."
+        if profile._sampler:
+            profile._sampler.stop()
+            profile.samples.update(profile._sampler.stacks)
+            profile._sampler = None
+
     @staticmethod
     def reset():
         "Reset profiler."
         profile.data.clear()
+        _root.children.clear()
+        _Node.count = 1
+        profile.samples.clear()
+
+    @staticmethod
+    def tree():
+        "Return the root of the tree collected by the hierarchical profiler. Its children are the outermost streams iterated."
+        return _root
 
     @staticmethod
     def dump():
@@ -62,3 +310,53 @@ class profile:
             avg = time / calls
             print(f"{key}: {calls} calls ({ends} ending{'' if ends == 1 else 's'})")
             print(f"{' ' * len(key)}  {avg*1e6:.3f}us avg | {time:.3f}s total | {avg*streams.SAMPLE_RATE*100:.2f}% of budget")
+        for node in _root.children.values():
+            _dump_node(node, 0)
+        if profile.samples:
+            _dump_samples(profile.samples, profile._sampled_thread, profile._sample_interval)
+
+    @staticmethod
+    def dump_collapsed(path, samples=False):
+        """Write the hierarchical profile in the "collapsed stack" format used by flame graph tools
+        (e.g. https://github.com/brendangregg/FlameGraph or https://www.speedscope.app), with self times in microseconds.
+
+        With `samples`, writes the stacks recorded by the sampling profiler instead, with the number of times each was seen.
+        """
+        with open(path, 'w') as f:
+            if samples:
+                for stack, count in profile.samples.items():
+                    f.write(f"{';'.join(label.replace(';', ',') for label in stack)} {count}\n")
+                return
+            for node in _root.children.values():
+                _write_collapsed(f, node, [])
+
+def _dump_node(node, depth):
+    indent = ' ' * 4 * depth
+    # Fraction of the real-time budget for the samples this stream produced.
+    budget = node.samples / streams.SAMPLE_RATE if node.samples else float('nan')
+    print(f"{indent}{node.label}: {node.samples} samples in {node.calls} calls" + (f" ({node.ends} ending{'' if node.ends == 1 else 's'})" if node.ends != 1 else ""))
+    print(f"{indent}  {node.time:.3f}s total | {node.self_time:.3f}s self | {node.time/budget*100:.2f}% of budget ({node.self_time/budget*100:.2f}% self)")
+    for child in node.children.values():
+        _dump_node(child, depth + 1)
+
+def _write_collapsed(f, node, stack):
+    stack = stack + [node.label.replace(';', ',')]
+    micros = round(node.self_time * 1e6)
+    if micros > 0:
+        f.write(f"{';'.join(stack)} {micros}\n")
+    for child in node.children.values():
+        _write_collapsed(f, child, stack)
+
+def _dump_samples(samples, thread, interval, top=20):
+    total = sum(samples.values())
+    # Self counts go to the innermost function; total counts go to every function on the stack (once).
+    own = collections.Counter()
+    inclusive = collections.Counter()
+    for stack, count in samples.items():
+        own[stack[-1]] += count
+        for label in set(stack):
+            inclusive[label] += count
+    print(f"Sampled {total} stacks from {thread}, every {interval*1e3:.1f}ms:")
+    print("   self   total  function")
+    for label, count in own.most_common(top):
+        print(f"  {count/total*100:5.1f}%  {inclusive[label]/total*100:5.1f}%  {label}")
@@ -22,7 +22,7 @@ from cppyy.gbl import stk
 # Integrate with Aleatora.
 from cppyy.gbl.stk import Stk, FreeVerb, JCRev, NRev, PRCRev
 from cppyy.gbl.stk import Bowed, Brass, Guitar, Mandolin, ModalBar, Moog, Rhodey, Shakers, Wurley
-from .midi import poly
+from .midi import iter_sparse, poly
 from .streams import frame, m2f, repeat, stream
 
 def stk_stereo_effect(effect_class):
@@ -44,13 +44,16 @@ def stk_mono_instrument(instrument_class):
     @stream
     def mono_instrument(event_stream, decay=0, tail=0.5):
         inst = instrument_class()
-        for events in event_stream:
-            for event in events:
-                if event.type == 'note_on':
-                    inst.noteOn(m2f(event.note), event.velocity / 127)
-                elif event.type == 'note_off':
-                    inst.noteOff(decay)
-            yield inst.tick()
+        for gap, events in iter_sparse(event_stream):
+            for _ in range(gap):
+                yield inst.tick()
+            if events:
+                for event in events:
+                    if event.type == 'note_on':
+                        inst.noteOn(m2f(event.note), event.velocity / 127)
+                    elif event.type == 'note_off':
+                        inst.noteOff(decay)
+                yield inst.tick()
         yield from repeat(inst.tick)[:tail]
     return mono_instrument
 
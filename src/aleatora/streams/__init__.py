@@ -1,2 +1,3 @@
 from .core import *
 from .audio import *
+from .cache import *
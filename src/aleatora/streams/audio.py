@@ -1,15 +1,21 @@
-import array
+import bisect
 import collections
+import fractions
+import functools
+import heapq
+import itertools
 import math
+import numbers
 import numpy as np
 import operator
 import os
 import pickle
 import random
+import struct
 import time
 from typing import overload
 
-from .core import FunctionStream, const, count, empty, stream, Stream, repeat
+from .core import _drop, _mix_samples, _rechunk, _unblock, BLOCK_SIZE, BlockReader, FunctionStream, const, count, empty, has_blocks, iter_blocks, known_length, stream, stream_with, Stream, repeat
 
 # This is the default sample rate, but it may be modified by audio module to
 # match what the audio device supports.
@@ -41,8 +47,10 @@ def make_frame_op(op, reversed=False):
 # Container for multiple values. Operators are overloaded for element-wise computation.
 # Created with samples in mind (to make it easier to work with stereo and beyond), but can be used with any types.
 # (e.g., frame('hell', 'good') + frame('o', 'bye') == frame('hello', 'goodbye'))
-# NOTE: Could make this faster for the stereo case by specializing for the 2-channel frame.
+# Two-channel frames are created as `stereo`, which is specialized for that case.
 class frame(tuple):
+    __slots__ = ()
+
     __add__ = make_frame_op(operator.add)
     __radd__ = make_frame_op(operator.add, reversed=True)
     __sub__ = make_frame_op(operator.sub)
@@ -75,14 +83,13 @@ class frame(tuple):
     def __invert__(self): return frame(map(operator.invert, self))
 
     def __new__(cls, *args):
-        if len(args) > 1:
-            # Multiple arguments: put them all in a frame.
-            return tuple.__new__(cls, args)
-        elif args:
+        if len(args) == 1:
             # One argument: assume it's a sequence that should be converted to a frame.
-            return tuple.__new__(cls, args[0])
-        else:
-            return tuple.__new__(cls)
+            args = tuple(args[0])
+        # Otherwise, put all the arguments in a frame.
+        if cls is frame and len(args) == 2:
+            cls = stereo
+        return tuple.__new__(cls, args)
 
     def __repr__(self):
         return f"frame{super().__repr__()}"
@@ -90,6 +97,68 @@ class frame(tuple):
     def __str__(self):
         return f"frame{super().__str__()}"
 
+# Like make_frame_op(), but unrolled for two channels.
+def make_stereo_op(op, reversed=False):
+    new = tuple.__new__
+    if reversed:
+        def fn(self, other):
+            if isinstance(other, frame):
+                return frame(map(op, other, self))
+            a, b = self
+            return new(stereo, (op(other, a), op(other, b)))
+        return fn
+    def fn(self, other):
+        a, b = self
+        if isinstance(other, frame):
+            if len(other) != 2:
+                return frame(map(op, self, other))
+            c, d = other
+            return new(stereo, (op(a, c), op(b, d)))
+        return new(stereo, (op(a, other), op(b, other)))
+    return fn
+
+def make_stereo_unary_op(op):
+    new = tuple.__new__
+    def fn(self):
+        a, b = self
+        return new(stereo, (op(a), op(b)))
+    return fn
+
+class stereo(frame):
+    "Two-channel frame. Created automatically by `frame()` when given two values."
+    __slots__ = ()
+
+    __add__ = make_stereo_op(operator.add)
+    __radd__ = make_stereo_op(operator.add, reversed=True)
+    __sub__ = make_stereo_op(operator.sub)
+    __rsub__ = make_stereo_op(operator.sub, reversed=True)
+    __mul__ = make_stereo_op(operator.mul)
+    __rmul__ = make_stereo_op(operator.mul, reversed=True)
+    __matmul__ = make_stereo_op(operator.matmul)
+    __rmatmul__ = make_stereo_op(operator.matmul, reversed=True)
+    __truediv__ = make_stereo_op(operator.truediv)
+    __rtruediv__ = make_stereo_op(operator.truediv, reversed=True)
+    __floordiv__ = make_stereo_op(operator.floordiv)
+    __rfloordiv__ = make_stereo_op(operator.floordiv, reversed=True)
+    __mod__ = make_stereo_op(operator.mod)
+    __rmod__ = make_stereo_op(operator.mod, reversed=True)
+    __pow__ = make_stereo_op(operator.pow)
+    __rpow__ = make_stereo_op(operator.pow, reversed=True)
+    __lshift__ = make_stereo_op(operator.lshift)
+    __rlshift__ = make_stereo_op(operator.lshift, reversed=True)
+    __rshift__ = make_stereo_op(operator.rshift)
+    __rrshift__ = make_stereo_op(operator.rshift, reversed=True)
+    __and__ = make_stereo_op(operator.and_)
+    __rand__ = make_stereo_op(operator.and_, reversed=True)
+    __xor__ = make_stereo_op(operator.xor)
+    __rxor__ = make_stereo_op(operator.xor, reversed=True)
+    __or__ = make_stereo_op(operator.or_)
+    __ror__ = make_stereo_op(operator.or_, reversed=True)
+    __neg__ = make_stereo_unary_op(operator.neg)
+    __pos__ = make_stereo_unary_op(operator.pos)
+    __abs__ = make_stereo_unary_op(operator.abs)
+    __invert__ = make_stereo_unary_op(operator.invert)
+
 
 # Monkey-patch stream slicing, freezing, and recording onto Stream.
 # Ideally, these would go in a subclass, but there are some unresolved problems there for Concat and Mix streams.
@@ -117,8 +186,8 @@ def AudioStream_hold(self, duration):
 
 Stream.hold = AudioStream_hold
 
-def AudioStream_freeze(self, key=None, redo=False, verbose=False):
-    return freeze(key, self, redo, verbose)
+def AudioStream_freeze(self, key=None, redo=False, verbose=False, cache=False):
+    return freeze(key, self, redo, verbose, cache=cache)
 
 Stream.freeze = AudioStream_freeze
 
@@ -127,16 +196,152 @@ def AudioStream_record(self, key=None, redo=False):
 
 Stream.record = AudioStream_record
 
+def _pan(x, pos):
+    # Called with samples, or with blocks (in which case we produce a block of shape (samples, 2)).
+    if isinstance(x, np.ndarray):
+        return np.stack((x * (1 - pos), x * pos), axis=-1)
+    return tuple.__new__(stereo, (x * (1 - pos), x * pos))
+
 def pan(stream, pos):
     if isinstance(pos, collections.abc.Iterable):
-        return stream.map(lambda x, pos: frame(x * (1 - pos), x * pos), pos)
-    return stream.map(lambda x: frame(x * (1 - pos), x * pos))
+        return stream.map(_pan, pos, vectorized=True)
+    return stream.map(lambda x: _pan(x, pos), vectorized=True)
 
 Stream.pan = pan
 
+# Resampling quality presets: (sinc zero crossings on each side, cutoff relative to Nyquist, Kaiser window beta,
+# number of filter phases for ratios that aren't simple fractions).
+RESAMPLE_QUALITY = {
+    'fast': (8, 0.85, 6.0, 128),
+    'medium': (16, 0.92, 8.6, 512),
+    'best': (32, 0.96, 12.0, 2048),
+}
+
+@functools.lru_cache(maxsize=64)
+def _sinc_table(phases, cutoff, half_width, beta):
+    # Filter taps for each of `phases` + 1 evenly-spaced fractional positions between input samples.
+    # Row p is for position p/phases past input sample 0, with taps for input samples -half_width+1 to half_width.
+    offsets = np.arange(-half_width + 1, half_width + 1)
+    distance = offsets[None, :] - np.arange(phases + 1)[:, None] / phases
+    x = np.clip(distance / half_width, -1, 1)
+    table = cutoff * np.sinc(cutoff * distance) * np.i0(beta * np.sqrt(1 - x**2)) / np.i0(beta)
+    # Normalize for unity gain at DC.
+    return table / table.sum(axis=1, keepdims=True)
+
+class Resampler:
+    """Windowed-sinc resampler for a constant `ratio` (input samples per output sample, as in `resample()`).
+
+    Works incrementally: feed it blocks of input with `process()`, and call `flush()` at the end for the rest.
+    When downsampling, the cutoff is lowered to avoid aliasing. `quality` is one of RESAMPLE_QUALITY.
+    Ratios that are simple fractions (as between common sample rates, e.g. 44.1k to 48k) are resampled exactly;
+    others use the nearest of the preset's filter phases.
+    """
+    def __init__(self, ratio, quality='medium'):
+        zeros, rolloff, beta, phases = RESAMPLE_QUALITY[quality]
+        self.ratio = ratio
+        fraction = fractions.Fraction(ratio).limit_denominator(4096)
+        if abs(fraction - ratio) < 1e-12:
+            # Output positions only ever land on `denominator` distinct fractional positions.
+            phases = fraction.denominator
+        self.phases = phases
+        cutoff = min(1, 1 / ratio) * rolloff
+        self.half_width = math.ceil(zeros / cutoff)
+        self.table = _sinc_table(phases, cutoff, self.half_width, beta)
+        # Input that's still needed, starting with silence before the first sample.
+        self.buffer = None
+        # Index of the input sample at the start of `buffer`.
+        self.offset = 1 - self.half_width
+        self.inputs = 0
+        self.outputs = 0
+
+    def process(self, block):
+        "Return as many output samples as can be computed after adding `block` to the input."
+        block = np.asarray(block, dtype=np.float64)
+        if self.buffer is None:
+            self.buffer = np.zeros((self.half_width - 1,) + block.shape[1:])
+        self.buffer = np.concatenate((self.buffer, block))
+        self.inputs += len(block)
+        return self._run()
+
+    def flush(self):
+        "Return the remaining output samples (assuming the input has ended)."
+        if self.buffer is None:
+            return np.empty(0)
+        needed = math.ceil(self.inputs / self.ratio) - self.outputs
+        self.buffer = np.concatenate((self.buffer, np.zeros((self.half_width + math.ceil(self.ratio),) + self.buffer.shape[1:])))
+        return self._run()[:max(needed, 0)]
+
+    def _run(self):
+        # The last output we can compute needs input up to `half_width` samples past its position.
+        available = len(self.buffer) - self.half_width
+        # Positions are computed from the output index (rather than accumulated),
+        # so the results don't depend on how the input was divided into blocks.
+        count = max(0, math.ceil((available + self.offset) / self.ratio - self.outputs))
+        positions = (self.outputs + np.arange(count)) * self.ratio - self.offset
+        base = np.floor(positions).astype(np.intp)
+        keep = base < available
+        positions, base = positions[keep], base[keep]
+        phase = np.rint((positions - base) * self.phases).astype(np.intp)
+        indices = (base - self.half_width + 1)[:, None] + np.arange(self.half_width * 2)[None, :]
+        taps = self.buffer[indices]
+        weights = self.table[phase]
+        if taps.ndim > 2:
+            out = np.einsum('nt,ntc->nc', weights, taps)
+        else:
+            out = np.einsum('nt,nt->n', weights, taps)
+        self.outputs += len(out)
+        # Drop input we won't need again.
+        start = max(0, math.floor(self.outputs * self.ratio - self.offset) - self.half_width + 1)
+        self.buffer = self.buffer[start:]
+        self.offset += start
+        return out
+
+class ResampledStream(Stream):
+    "Stream resampled by a constant ratio with `Resampler`. Works in blocks."
+    def __init__(self, stream, ratio, quality='medium'):
+        self.stream = stream
+        self.ratio = ratio
+        self.quality = quality
+
+    def __iter__(self):
+        for block in self.__iter_blocks__(BLOCK_SIZE):
+            yield from _unblock(block)
+
+    def __iter_blocks__(self, size):
+        return _rechunk(self._resampled_blocks(), size)
+
+    def _resampled_blocks(self):
+        resampler = Resampler(self.ratio, self.quality)
+        for block in iter_blocks(self.stream, BLOCK_SIZE):
+            out = resampler.process(block)
+            if len(out):
+                yield out
+        out = resampler.flush()
+        if len(out):
+            yield out
+
+    def has_blocks(self):
+        return True
+
+    def known_length(self):
+        length = known_length(self.stream)
+        if length is None or length == math.inf:
+            return length
+        return math.ceil(length / self.ratio)
+
+def resample(stream, rate, quality='medium'):
+    """Play `stream` back at `rate` times its speed (so rate=2 is twice as fast, an octave up).
+
+    `rate` may be a stream, for varispeed effects; this uses linear interpolation.
+    Constant rates use a windowed-sinc resampler (see `Resampler`), unless `quality` is 'linear'.
+    """
+    if isinstance(rate, numbers.Number) and quality != 'linear':
+        return ResampledStream(stream, rate, quality)
+    return _linear_resample(stream, rate)
+
 # Stream-controlled resampler. Think varispeed.
 @stream
-def resample(stream, rate):
+def _linear_resample(stream, rate):
     it = iter(stream)
     pos = 0
     sample = 0
@@ -170,26 +375,140 @@ def maybe_const(thing):
         return thing
     return const(thing)
 
-@stream
+# Block versions of the oscillators below share this phase accumulator.
+# It computes the running phase with a cumulative sum seeded by the current phase,
+# which performs the same sequence of additions as the per-sample versions,
+# and carries the phase over to the next block.
+# NOTE: The yielded buffer is reused for the next block.
+def _phase_blocks(size, freqs, phase, increment, wrap=False):
+    phases = np.empty(size + 1)
+    if isinstance(freqs, numbers.Number):
+        # Fast path for constant frequency: no frequency stream to pull from.
+        increments = itertools.repeat(np.full(size, increment(freqs)))
+    else:
+        increments = (increment(block) for block in iter_blocks(freqs, size))
+    for block in increments:
+        n = len(block)
+        phases[0] = phase
+        if wrap:
+            _accumulate_wrapped(phases, block)
+        else:
+            phases[1:n + 1] = block
+            np.cumsum(phases[:n + 1], out=phases[:n + 1])
+        phase = phases[n]
+        yield phases[:n]
+
+def _accumulate_wrapped(phases, increments):
+    # Like the cumulative sum above, but wrapping into [0, 1) exactly as the per-sample oscillators do
+    # (`t = (t + increment) % 1`): sum up to the next sample that leaves the range, wrap it, and continue from there.
+    n = len(increments)
+    wraps = np.abs(increments).sum()
+    if wraps * 32 > n:
+        # Wrapping every few samples: a plain loop is faster.
+        t = float(phases[0])
+        out = []
+        for increment in increments.tolist():
+            t = (t + increment) % 1
+            out.append(t)
+        phases[1:n + 1] = out
+        return
+    # Sum about one period ahead at a time. While the phase only goes up, the next wrap can be found by bisection.
+    period = int(n / wraps) + 2 if wraps else n
+    increasing = 0 <= phases[0] < 1 and increments.min() >= 0
+    window = period
+    start = 0
+    while start < n:
+        stop = min(n, start + window)
+        phases[start + 1:stop + 1] = increments[start:stop]
+        segment = phases[start:stop + 1]
+        np.cumsum(segment, out=segment)
+        if increasing:
+            i = segment[1:].searchsorted(1.0)
+            found = i < stop - start
+        else:
+            outside = (segment[1:] >= 1) | (segment[1:] < 0)
+            i = outside.argmax()
+            found = outside[i]
+        if not found:
+            start = stop
+            window *= 2
+            continue
+        i += start + 1
+        phases[i] %= 1
+        window = period
+        start = i
+
+def _osc_blocks(size, freqs, phase=0):
+    for phases in _phase_blocks(size, freqs, phase, lambda freq: 2*math.pi*freq/SAMPLE_RATE):
+        yield np.sin(phases)
+
+def _saw_blocks(size, freqs, t=0):
+    for ts in _phase_blocks(size, freqs, t, lambda freq: freq/SAMPLE_RATE, wrap=True):
+        yield ts*2 - 1
+
+def _sqr_blocks(size, freqs, t=0, duty=0.5):
+    for ts in _phase_blocks(size, freqs, t, lambda freq: freq/SAMPLE_RATE, wrap=True):
+        yield (ts < duty)*2 - 1
+
+def _tri_blocks(size, freqs, t=0):
+    for ts in _phase_blocks(size, freqs, t, lambda freq: freq/SAMPLE_RATE, wrap=True):
+        yield np.abs(ts - 0.5)*4 - 1
+
+# Seeking an oscillator jumps its phase ahead: analytically for constant frequency,
+# and otherwise by summing the skipped part of the frequency stream (in blocks).
+# The oscillator then resumes from the same reader, so the frequencies are computed only once,
+# and the phase matches the samples that follow even if the frequency stream is not deterministic.
+def _advance_phase(n, freqs, phase, increment):
+    if isinstance(freqs, numbers.Number):
+        return phase + increment(freqs)*n, freqs
+    reader = BlockReader(iter_blocks(freqs))
+    while n > 0:
+        block = reader.read(min(n, BLOCK_SIZE))
+        if not len(block):
+            break
+        phase += increment(block).sum()
+        n -= len(block)
+    return phase, reader
+
+def _osc_seek(n, freqs, phase=0):
+    phase, freqs = _advance_phase(n, freqs, phase, lambda freq: 2*math.pi*freq/SAMPLE_RATE)
+    return osc(freqs, phase)
+
+def _saw_seek(n, freqs, t=0):
+    t, freqs = _advance_phase(n, freqs, t, lambda freq: freq/SAMPLE_RATE)
+    return saw(freqs, t % 1)
+
+def _sqr_seek(n, freqs, t=0, duty=0.5):
+    t, freqs = _advance_phase(n, freqs, t, lambda freq: freq/SAMPLE_RATE)
+    return sqr(freqs, t % 1, duty)
+
+def _tri_seek(n, freqs, t=0):
+    t, freqs = _advance_phase(n, freqs, t, lambda freq: freq/SAMPLE_RATE)
+    return tri(freqs, t % 1)
+
+def _osc_length(freqs, *args, **kwargs):
+    return math.inf if isinstance(freqs, numbers.Number) else known_length(freqs)
+
+@stream_with(blocks=_osc_blocks, seek=_osc_seek, length=_osc_length)
 def osc(freqs, phase=0):
     for freq in maybe_const(freqs):
         yield math.sin(phase)
         phase += 2*math.pi*freq/SAMPLE_RATE
 
 # NOTE: Aliased. For versions that don't alias, see aa_{saw,sqr,tri}.
-@stream
+@stream_with(blocks=_saw_blocks, seek=_saw_seek, length=_osc_length)
 def saw(freqs, t=0):
     for freq in maybe_const(freqs):
         yield t*2 - 1
         t = (t + freq/SAMPLE_RATE) % 1
 
-@stream
+@stream_with(blocks=_sqr_blocks, seek=_sqr_seek, length=_osc_length)
 def sqr(freqs, t=0, duty=0.5):
     for freq in maybe_const(freqs):
         yield int(t < duty)*2 - 1
         t = (t + freq/SAMPLE_RATE) % 1
 
-@stream
+@stream_with(blocks=_tri_blocks, seek=_tri_seek, length=_osc_length)
 def tri(freqs, t=0):
     for freq in maybe_const(freqs):
         yield abs(t - 0.5)*4 - 1
@@ -206,17 +525,22 @@ def tbl(freqs, tables, phase=0):
         phase += freq/SAMPLE_RATE
         phase %= 1
 
-@stream
-def basic_envelope(length):
-    length = convert_time(length)
+def _basic_envelope(length, offset=0):
     ramp_time = int(length * 0.1)
-    for x in range(0, ramp_time):
+    for x in range(offset, ramp_time):
         yield x/ramp_time
-    for _ in range(length - ramp_time*2):
+    for _ in range(max(offset, ramp_time), length - ramp_time):
         yield 1
-    for x in range(ramp_time-1, -1, -1):
+    for x in range(min(ramp_time-1, length-1 - offset), -1, -1):
         yield x/ramp_time
 
+@stream_with(
+    seek=lambda n, length: FunctionStream(lambda: _basic_envelope(convert_time(length), n)),
+    length=lambda length: convert_time(length),
+)
+def basic_envelope(length):
+    return _basic_envelope(convert_time(length))
+
 def m2f(midi):
     return 2**((midi - 69)/12) * 440
 
@@ -236,7 +560,14 @@ def basic_sequencer(note_stream, bpm=80):
     # Assumes quarters have the beat.
     return note_stream.map(lambda n: sqr(m2f(n[0])) * basic_envelope(60.0 / bpm * n[1] * 4)).join()
 
-@stream
+def _ramp_seek(n, start, end, dur, hold=False):
+    dur = convert_time(dur)
+    if n >= dur:
+        return const(end) if hold else empty
+    # Same slope, starting further along.
+    return ramp(start + (end - start)/dur*n, end, dur - n, hold)
+
+@stream_with(seek=_ramp_seek, length=lambda start, end, dur, hold=False: math.inf if hold else convert_time(dur))
 def ramp(start, end, dur, hold=False):
     dur = convert_time(dur)
     for i in range(dur):
@@ -363,59 +694,168 @@ class Mixer:
         assert(isinstance(item, slice))
         assert(item.start is None)
         assert(item.step is None)
-        t = convert_time(item.stop)
-        iterators = self.iterators
-        fill = self.fill
-        for _ in range(t):
-            while iterators:
-                try:
-                    acc = next(iterators[-1])
-                    break
-                except StopIteration:
-                    del iterators[-1]
-            for i in range(len(iterators) - 2, -1, -1):
-                try:
-                    acc += next(iterators[i])
-                except StopIteration:
-                    del iterators[i]
-            if not iterators:
-                acc = fill
-            yield acc
+        return _mix_samples(self.iterators, convert_time(item.stop), self.fill)
+
+    def __iter__(self):
+        return _mix_samples(self.iterators)
+
+class Timeline(Stream):
+    """Analogous to a DAW timeline: streams placed at start times, playing simultaneously.
+
+    Streams are only started once playback reaches their start time,
+    and stretches where nothing is playing are filled in bulk (with `fill`).
+    Streams may be added (via `add()`) while the timeline is playing, for live sequencing;
+    they start as soon as playback reaches their start time (or right away, if that has passed).
+    Seeking or slicing from a start time (`timeline[10.0:]`) jumps straight to that point,
+    only starting the streams that are still playing there, which is quick for streams of known length.
+
+    By default, the timeline ends when everything on it has finished; with `persist=True`, it keeps yielding `fill`.
+
+    Example::
+
+        timeline = Timeline([(0.0, osc(440)[:1.0]), (0.5, osc(660)[:1.0])])
+        timeline.add(2.0, osc(880)[:0.5])
+        play(timeline[0.5:])
+    """
+    def __init__(self, items=(), fill=0, persist=False):
+        # Items in the order they were added, as (start time, stream, length or None).
+        self.items = []
+        # Start times in sorted order, and the corresponding indices into `items`.
+        self.starts = []
+        self.order = []
+        self.fill = fill
+        self.persist = persist
+        # Position (in samples) that iteration starts from; see __getitem__.
+        self.offset = 0
+        for time, strm in items:
+            self.add(time, strm)
+
+    def add(self, time, strm, length=None):
+        "Schedule `strm` to start at `time`. `length` is used to skip the stream when seeking past its end."
+        time = convert_time(time)
+        if length is None:
+            length = known_length(strm)
+        i = bisect.bisect_right(self.starts, time)
+        self.starts.insert(i, time)
+        self.order.insert(i, len(self.items))
+        self.items.append((time, strm, length if length == math.inf else convert_time(length)))
+
+    def seek(self, n):
+        # Shallow copy: shares the scheduled items (including future additions) with this timeline.
+        view = object.__new__(Timeline)
+        view.__dict__ = dict(self.__dict__, offset=self.offset + n)
+        return view
+
+    def known_length(self):
+        if self.persist:
+            return math.inf
+        if any(length is None for _, _, length in self.items):
+            return None
+        # Streams that end before the offset don't count (the timeline is empty if they all do).
+        return max(0, max((time + length - self.offset for time, _, length in self.items), default=0))
+
+    def _schedule(self, start):
+        # Return the streams that are already playing at `start` (with their positions), and a heap of upcoming ones.
+        k = bisect.bisect_left(self.starts, start)
+        playing = []
+        for i in self.order[:k]:
+            time, strm, length = self.items[i]
+            if length is None or time + length > start:
+                playing.append((strm, start - time))
+        # Already sorted, so already a heap.
+        pending = [(self.items[i][0], i, self.items[i][1]) for i in self.order[k:]]
+        return playing, pending
+
+    def _absorb(self, pending, seen, t):
+        # Pick up streams added since iteration began.
+        for i in range(seen, len(self.items)):
+            time, strm, _ = self.items[i]
+            heapq.heappush(pending, (max(time, t), i, strm))
+        return len(self.items)
 
     def __iter__(self):
-        # TODO: Reduce duplication between this, __getitem__(),
-        #       and MixStream.__iter__().
-        iterators = self.iterators
+        fill = self.fill
+        t = self.offset
+        playing, pending = self._schedule(t)
+        active = []
+        for strm, position in playing:
+            active.append(iter(_drop(strm, position)))
+        seen = len(self.items)
         while True:
-            while iterators:
-                try:
-                    acc = next(iterators[-1])
-                    break
-                except StopIteration:
-                    del iterators[-1]
-            for i in range(len(iterators) - 2, -1, -1):
-                try:
-                    acc += next(iterators[i])
-                except StopIteration:
-                    del iterators[i]
-            if not iterators:
-                break
+            seen = self._absorb(pending, seen, t)
+            while pending and pending[0][0] <= t:
+                active.append(iter(heapq.heappop(pending)[2]))
+            # Limit each step to a block, so that new additions are picked up promptly.
+            if pending:
+                n = min(pending[0][0] - t, BLOCK_SIZE)
+            elif active or self.persist:
+                n = BLOCK_SIZE
+            else:
+                return
+            i = 0
+            if active:
+                for i, x in enumerate(itertools.islice(_mix_samples(active), n), 1):
+                    yield x
+                if i < n:
+                    # Everything playing has finished; see what's next.
+                    t += i
+                    continue
+            yield from itertools.repeat(fill, n - i)
+            t += n
+
+    def __iter_blocks__(self, size):
+        return _rechunk(self._blocks(size), size)
+
+    def _blocks(self, size):
+        fill = self.fill
+        t = self.offset
+        playing, pending = self._schedule(t)
+        active = []
+        for strm, position in playing:
+            active.append(BlockReader(iter_blocks(_drop(strm, position), size)))
+        seen = len(self.items)
+        while True:
+            seen = self._absorb(pending, seen, t)
+            while pending and pending[0][0] <= t:
+                active.append(BlockReader(iter_blocks(heapq.heappop(pending)[2], size)))
+            if pending:
+                n = min(pending[0][0] - t, size)
+            elif active or self.persist:
+                n = size
+            else:
+                return
+            if not active:
+                yield np.full(n, fill)
+                t += n
+                continue
+            acc = np.zeros(n)
+            length = 0
+            for i in range(len(active) - 1, -1, -1):
+                block = active[i].read(n)
+                if len(block) < n:
+                    active[i] = active[-1]
+                    active.pop()
+                if block.ndim > acc.ndim:
+                    acc = np.repeat(acc[:, None], block.shape[1], axis=1)
+                elif block.ndim < acc.ndim:
+                    block = block[:, None]
+                acc[:len(block)] += block
+                length = max(length, len(block))
+            if length < n:
+                # Everything playing has finished; see what's next.
+                if length:
+                    yield acc[:length]
+                t += length
+                continue
             yield acc
+            t += n
 
-# Analagous to DAW timeline; takes a bunch of streams and their start times,
-# and arranges them to start at those times and play simultaneously.
-@stream
+    def has_blocks(self):
+        return isinstance(self.fill, numbers.Number) and all(has_blocks(strm) for _, strm, _ in self.items)
+
+# Takes a bunch of streams and their start times, and arranges them to start at those times and play simultaneously.
 def arrange(items, fill=0):
-    if not items:
-        return empty
-    items = sorted(items, key=lambda item: item[0])
-    out = Mixer(fill=fill)
-    last_time = 0
-    for time, stream in items:
-        yield from out[:time - last_time]
-        out <= stream
-        last_time = time
-    yield from out
+    return Timeline(items, fill)
 
 # More new stuff (3/2):
 def cons(item, stream):
@@ -434,22 +874,55 @@ def events_in_time(timed_events, filler=None):
         last_time = time + 1  # account for the fact that just(item) has length 1.
     return stream
 
-# Simple additive synthesis: takes in [(amplitude, frequency)].
-@stream
-def additive(parts, phase=0):
+# Additive synthesis engine: each partial is a unit phasor that rotates by its frequency every sample.
+# The samples of a block are the imaginary part of the amplitude-weighted sum of those phasors, rotated by 0..size-1 steps.
+# Those rotations are the same for every block, so they are computed once, and each block is a single matrix-vector product.
+# The rotation matrix has a row per partial, so blocks are computed at most ADDITIVE_BLOCK_SIZE at a time
+# (and regrouped into larger blocks if requested), which keeps it small even for hundreds of partials.
+ADDITIVE_BLOCK_SIZE = 1024
+
+def _additive_blocks(size, parts, phase=0, band_limit=False):
+    if size <= ADDITIVE_BLOCK_SIZE:
+        return _additive_partials(size, parts, phase, band_limit)
+    return _rechunk(_additive_partials(ADDITIVE_BLOCK_SIZE, parts, phase, band_limit), size)
+
+def _additive_partials(size, parts, phase, band_limit):
+    amplitudes = np.array([amplitude for amplitude, _ in parts], dtype=float)
+    freqs = np.array([freq for _, freq in parts], dtype=float)
+    if band_limit:
+        # Drop partials at or above Nyquist for the current sample rate.
+        audible = np.abs(freqs) < SAMPLE_RATE/2
+        amplitudes, freqs = amplitudes[audible], freqs[audible]
+    steps = 2*np.pi*freqs/SAMPLE_RATE
+    rotations = np.exp(1j * np.outer(steps, np.arange(size)))
+    advance = np.exp(1j * steps * size)
+    phasors = np.exp(1j * phase * freqs)
     while True:
-        yield sum(math.sin(phase*freq)*amplitude for amplitude, freq in parts)
-        phase += 2*math.pi/SAMPLE_RATE
+        yield ((amplitudes * phasors) @ rotations).imag
+        phasors *= advance
+        # Keep rounding errors from changing the amplitudes over time.
+        phasors /= np.abs(phasors)
+
+# Simple additive synthesis: takes in [(amplitude, frequency)].
+# If `band_limit` is true, partials above Nyquist (for the sample rate at the time of playback) are omitted.
+@stream_with(
+    blocks=_additive_blocks,
+    seek=lambda n, parts, phase=0, band_limit=False: additive(parts, phase + 2*math.pi*n/SAMPLE_RATE, band_limit),
+    length=lambda *args, **kwargs: math.inf,
+)
+def additive(parts, phase=0, band_limit=False):
+    for block in _additive_blocks(BLOCK_SIZE, parts, phase, band_limit):
+        yield from block.tolist()
 
 # Anti-aliased: these only generate harmonics up to half the sample rate.
 def aa_sqr(freq):
-    return additive([(4/math.pi/k, freq*k) for k in range(1, int(SAMPLE_RATE/2/freq) + 1, 2)])
+    return additive([(4/math.pi/k, freq*k) for k in range(1, int(SAMPLE_RATE/2/freq) + 1, 2)], band_limit=True)
 
 def aa_tri(freq):
-    return additive([((-1)**((k-1)/2)*8/math.pi**2/k**2, freq*k) for k in range(1, int(SAMPLE_RATE/2/freq) + 1, 2)])
+    return additive([((-1)**((k-1)/2)*8/math.pi**2/k**2, freq*k) for k in range(1, int(SAMPLE_RATE/2/freq) + 1, 2)], band_limit=True)
 
 def aa_saw(freq):
-    return additive([((-1)**k*2/math.pi/k, freq*k) for k in range(1, int(SAMPLE_RATE/2/freq) + 1)])
+    return additive([((-1)**k*2/math.pi/k, freq*k) for k in range(1, int(SAMPLE_RATE/2/freq) + 1)], band_limit=True)
 
 # Decorator for hot-swappable functions.
 HOT_STREAMS = {}
@@ -460,21 +933,184 @@ def hot(f):
 
 FROZEN_PATH = 'frozen'
 
+# Frozen files store samples as raw binary data after a short header,
+# so they can be written incrementally and memory-mapped when loaded.
+# Header: magic, format version, dtype character, channels (0 for mono samples, otherwise the size of each frame).
+FROZEN_HEADER = struct.Struct('<4sBcH8x')
+FROZEN_MAGIC = b'ALFZ'
+
+class FrozenStream(Stream):
+    "Stream of the samples in an array (such as a memory-mapped frozen file). Supports blocks and seeking."
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def __iter__(self):
+        for block in iter_blocks(self.array, BLOCK_SIZE):
+            yield from _unblock(block)
+
+    def __iter_blocks__(self, size):
+        return iter_blocks(self.array, size)
+
+    def has_blocks(self):
+        return True
+
+    def seek(self, n):
+        return FrozenStream(self.array[n:])
+
+    def known_length(self):
+        return len(self.array)
+
+def load_frozen(path):
+    "Load a stream saved by FrozenWriter at `path` (without extension). Returns None if there isn't one."
+    try:
+        with open(path + '.frz', 'rb') as f:
+            magic, _, dtype, channels = FROZEN_HEADER.unpack(f.read(FROZEN_HEADER.size))
+    except FileNotFoundError:
+        pass
+    else:
+        if magic != FROZEN_MAGIC:
+            raise ValueError(f"{path}.frz is not a frozen stream")
+        dtype = np.dtype(dtype.decode())
+        if os.path.getsize(path + '.frz') == FROZEN_HEADER.size:
+            # Can't memory-map an empty region.
+            array = np.empty(0, dtype)
+        else:
+            array = np.memmap(path + '.frz', dtype=dtype, mode='r', offset=FROZEN_HEADER.size)
+        return FrozenStream(array.reshape(-1, channels) if channels else array)
+    # Streams of non-numeric items, as well as older frozen streams, are pickled.
+    try:
+        with open(path + '.pkl', 'rb') as f:
+            items = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    return items if isinstance(items, Stream) else Stream(items)
+
+def _is_samples(block):
+    # True for an array of real numbers, either samples or frames (with at least one channel).
+    return block is not None and block.dtype.kind in 'biuf' and (block.ndim == 1 or (block.ndim == 2 and block.shape[1] > 0))
+
+class FrozenWriter:
+    """Incrementally write a stream to `path` (without extension), for loading with `load_frozen()`.
+
+    Numeric samples and frames are written as raw `dtype` data. If the stream turns out to contain
+    anything else, the writer switches to collecting the items in a list, which is pickled on `close()`.
+    """
+    def __init__(self, path, dtype=np.float64, buffer_size=16384):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.file = None
+        self.channels = None
+        # List of items, once we've given up on writing raw data.
+        self.items = None
+
+    def append(self, item):
+        if self.items is not None:
+            self.items.append(item)
+            return
+        self.buffer.append(item)
+        if len(self.buffer) >= self.buffer_size:
+            self._flush()
+
+    def write(self, block):
+        "Write a block of samples (see `iter_blocks()`)."
+        self._flush()
+        if self.items is None and not _is_samples(block):
+            self._fall_back()
+        if self.items is not None:
+            self.items.extend(_unblock(block))
+        else:
+            self._write_block(block)
+
+    def _flush(self):
+        if not self.buffer or self.items is not None:
+            return
+        try:
+            block = np.array(self.buffer)
+        except (TypeError, ValueError):
+            block = None
+        if not _is_samples(block):
+            # Not samples or frames of real numbers. (Converting to `dtype` directly would quietly turn None into nan, '1' into 1.0, etc.)
+            self._fall_back()
+            return
+        self.buffer = []
+        self._write_block(block)
+
+    def _write_block(self, block):
+        channels = block.shape[1] if block.ndim > 1 else 0
+        if self.file is None:
+            self.channels = channels
+            self.file = open(self.path + '.frz.tmp', 'wb')
+            self.file.write(FROZEN_HEADER.pack(FROZEN_MAGIC, 1, self.dtype.char.encode(), channels))
+        elif channels != self.channels:
+            # Mix of mono samples and frames.
+            self.buffer = list(_unblock(block)) + self.buffer
+            self._fall_back()
+            return
+        self.file.write(np.ascontiguousarray(block, dtype=self.dtype).tobytes())
+
+    def _fall_back(self):
+        self.items = []
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            written = np.fromfile(self.path + '.frz.tmp', dtype=self.dtype, offset=FROZEN_HEADER.size)
+            self.items.extend(_unblock(written.reshape(-1, self.channels) if self.channels else written))
+            os.remove(self.path + '.frz.tmp')
+        self.items.extend(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        "Finish writing, and return the frozen stream."
+        self._flush()
+        if self.items is not None:
+            with open(self.path + '.pkl', 'wb') as f:
+                pickle.dump(self.items, f)
+            stale = self.path + '.frz'
+        else:
+            if self.file is None:
+                # Empty stream.
+                self._write_block(np.empty(0, self.dtype))
+            self.file.close()
+            # Only replace any previous version once we're done, so an interrupted freeze doesn't leave a partial file.
+            os.replace(self.path + '.frz.tmp', self.path + '.frz')
+            stale = self.path + '.pkl'
+        if os.path.exists(stale):
+            os.remove(stale)
+        return load_frozen(self.path)
+
+def freeze_to(path, strm, dtype=np.float64):
+    "Render `strm` to a frozen file at `path` (without extension), and return the frozen stream."
+    writer = FrozenWriter(path, dtype)
+    if has_blocks(strm):
+        for block in iter_blocks(strm, writer.buffer_size):
+            writer.write(block)
+    else:
+        for item in strm:
+            writer.append(item)
+    return writer.close()
+
 @overload
-def freeze(strm, verbose=False):
+def freeze(strm, verbose=False, cache=False):
     ...
 @overload
-def freeze(key: str, strm, redo=False, verbose=False):
+def freeze(key: str, strm, redo=False, verbose=False, dtype=np.float64):
     ...
-def freeze(key=None, strm=None, redo=False, verbose=False):
+def freeze(key=None, strm=None, redo=False, verbose=False, dtype=np.float64, cache=False):
     """Freeze a stream and optionally save the result to a file. Assumes `stream` is finite.
 
     If the file already exists, load it instead of running the stream, unless redo=True.
+    Saved samples are stored as `dtype` and memory-mapped when loaded.
+    Without a key, cache=True saves the result in `render_cache`, keyed by the stream's structure.
     """
     if strm is None:
         # First overload.
         strm = key
         key = None
+    if key is None and cache:
+        from .cache import render_cache
+        return render_cache(strm, redo, dtype)
     if key is None:
         t = time.time()
         r = list(strm)
@@ -482,34 +1118,18 @@ def freeze(key=None, strm=None, redo=False, verbose=False):
             print("Done in", time.time() - t)
         return stream(r)
     os.makedirs(FROZEN_PATH, exist_ok=True)
-    path = os.path.join(FROZEN_PATH, f'frozen_{key}.pkl')
+    path = os.path.join(FROZEN_PATH, f'frozen_{key}')
     if not redo:
-        try:
-            # Considered using a default name generated via `hash(stream_fn.__code__)`, but this had too many issues.
-            # (Hashes differently between session, if referenced objects are created in the session.)
-            with open(path, 'rb') as f:
-                return Stream(pickle.load(f))
-        except FileNotFoundError:
-            # File doesn't exist: stream hasn't been frozen before.
-            pass
+        # Considered using a default name generated via `hash(stream_fn.__code__)`, but this had too many issues.
+        # (Hashes differently between session, if referenced objects are created in the session.)
+        frozen = load_frozen(path)
+        if frozen is not None:
+            return frozen
     t = time.time()
-    it = iter(strm)
-    # Try to freeze into an array, until we encounter an object that cannot be converted to float.
-    items = array.array('d')
-    for item in it:
-        try:
-            items.append(item)
-        except TypeError:
-            # Non-float item; switch from array to list.
-            items = list(items)
-            items.append(item)
-            items.extend(it)
-            break
+    frozen = freeze_to(path, strm, dtype)
     if verbose:
         print("Done in", time.time() - t)
-    with open(path, 'wb') as f:
-        pickle.dump(items, f)
-    return Stream(items)
+    return frozen
 
 # This is similar to frozen(), but it records the stream *as it plays* rather than forcing the entire stream ahead of time.
 # This is a critical distinction for any stream that depends on external time-varying state, such as audio.input_stream.
@@ -527,14 +1147,11 @@ def record(key=None, stream=None, redo=False):
         key = None
     if key is not None:
         os.makedirs(FROZEN_PATH, exist_ok=True)
-        path = os.path.join(FROZEN_PATH, f'record_{key}.pkl')
+        path = os.path.join(FROZEN_PATH, f'record_{key}')
         if not redo:
-            try:
-                with open(path, 'rb') as f:
-                    return pickle.load(f)
-            except FileNotFoundError:
-                # File doesn't exist: stream hasn't been recorded before.
-                pass
+            recorded = load_frozen(path)
+            if recorded is not None:
+                return recorded
     final_stream = None
     # After the initial record finishes, we want to replay the
     # stored stream (rather than recording again or appending).
@@ -542,15 +1159,18 @@ def record(key=None, stream=None, redo=False):
         if final_stream:
             return iter(final_stream)
         else:
-            recorded = []
+            if key is None:
+                recorded = []
+                append = recorded.append
+            else:
+                # Written to disk as we go.
+                writer = FrozenWriter(path)
+                append = writer.append
             def finish(_):
                 nonlocal final_stream
-                final_stream = Stream(recorded)
-                if key is not None:
-                    with open(path, 'wb') as f:
-                        pickle.dump(final_stream, f)
+                final_stream = Stream(recorded) if key is None else writer.close()
                 return empty
-            return iter(stream.map(lambda x: recorded.append(x) or x).bind(finish))
+            return iter(stream.map(lambda x: append(x) or x).bind(finish))
     return FunctionStream(helper)
 
 
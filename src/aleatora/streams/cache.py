@@ -0,0 +1,203 @@
+"""Content-addressed cache of rendered streams.
+
+Streams are keyed by a structural fingerprint rather than a user-supplied name, so rendering the same
+stream again (in this session or a later one) loads the earlier result instead of recomputing it.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import time
+import types
+
+import numpy as np
+
+from . import audio
+from .audio import freeze_to, load_frozen
+
+__all__ = ['fingerprint', 'RenderCache', 'render_cache']
+
+
+# Types whose values describe themselves.
+_PLAIN_TYPES = (type(None), bool, int, float, complex, str, bytes)
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+def _describe(thing, memo):
+    # Return a nested tuple of plain values describing `thing`, which is the same in every session.
+    if isinstance(thing, _PLAIN_TYPES):
+        return (type(thing).__name__, thing)
+    if id(thing) in memo:
+        # Shared (or recursive) reference to something we've already described.
+        return ('ref', memo[id(thing)][0])
+    # Hold on to `thing` so its id isn't reused while we're still describing.
+    memo[id(thing)] = (len(memo), thing)
+    if isinstance(thing, np.ndarray):
+        return ('ndarray', thing.dtype.str, thing.shape, hashlib.sha256(np.ascontiguousarray(thing).tobytes()).hexdigest())
+    if isinstance(thing, (tuple, list, frozenset, set)):
+        items = [_describe(item, memo) for item in thing]
+        if isinstance(thing, (set, frozenset)):
+            items.sort(key=repr)
+        return (type(thing).__name__, tuple(items))
+    if isinstance(thing, dict):
+        return ('dict', tuple(sorted(((_describe(k, memo), _describe(v, memo)) for k, v in thing.items()), key=repr)))
+    if isinstance(thing, range):
+        return ('range', thing.start, thing.stop, thing.step)
+    if isinstance(thing, types.CodeType):
+        return ('code', thing.co_code, thing.co_names, tuple(_describe(const, memo) for const in thing.co_consts))
+    if isinstance(thing, types.FunctionType):
+        closure = []
+        for cell in thing.__closure__ or ():
+            try:
+                closure.append(_describe(cell.cell_contents, memo))
+            except ValueError:
+                # Empty cell.
+                closure.append(None)
+        # Include the globals the function refers to, so that changing a helper (or a global setting) changes the key.
+        global_values = []
+        for name in sorted(_code_names(thing.__code__)):
+            if name not in thing.__globals__:
+                continue
+            value = thing.__globals__[name]
+            if isinstance(value, types.ModuleType):
+                value = ('module', value.__name__)
+            elif isinstance(value, type):
+                value = ('class', value.__module__, value.__qualname__)
+            else:
+                try:
+                    value = _describe(value, memo)
+                except TypeError:
+                    value = ('opaque',)
+            global_values.append((name, value))
+        return ('function', thing.__module__, thing.__qualname__, _describe(thing.__code__, memo),
+                _describe(thing.__defaults__, memo), _describe(thing.__kwdefaults__, memo), tuple(closure), tuple(global_values))
+    if isinstance(thing, types.MethodType):
+        return ('method', _describe(thing.__func__, memo), _describe(thing.__self__, memo))
+    if isinstance(thing, (types.BuiltinFunctionType, np.ufunc)):
+        return ('builtin', getattr(thing, '__module__', None), getattr(thing, '__qualname__', thing.__name__))
+    if isinstance(thing, functools.partial):
+        return ('partial', _describe(thing.func, memo), _describe(thing.args, memo), _describe(thing.keywords, memo))
+    if isinstance(thing, types.ModuleType):
+        return ('module', thing.__name__)
+    if isinstance(thing, type):
+        return ('class', thing.__module__, thing.__qualname__)
+    if isinstance(thing, (types.GeneratorType, types.CoroutineType)) or hasattr(thing, '__next__'):
+        # Iterators have hidden state, and can only be run once anyway.
+        raise TypeError(f"can't fingerprint iterator {thing!r}")
+    state = {}
+    if hasattr(thing, '__dict__'):
+        state.update(vars(thing))
+    for cls in type(thing).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            if hasattr(thing, slot):
+                state[slot] = getattr(thing, slot)
+    if not state and not hasattr(thing, '__dict__'):
+        raise TypeError(f"can't fingerprint {type(thing).__qualname__} object")
+    return ('object', type(thing).__module__, type(thing).__qualname__, _describe(state, memo))
+
+def fingerprint(strm, *extra):
+    """Return a hex digest identifying `strm` by its structure.
+
+    The fingerprint covers the stream's type, the code (and qualified names) of any functions involved,
+    their arguments, closures, and referenced globals, and the current SAMPLE_RATE, but not object identities,
+    so it is stable across sessions. Raises TypeError if the stream wraps an iterator or other opaque state.
+    """
+    description = (audio.SAMPLE_RATE, _describe(strm, {}), extra)
+    return hashlib.sha256(repr(description).encode()).hexdigest()
+
+
+class RenderCache:
+    """Cache of rendered streams in `path` (by default, `cache` under FROZEN_PATH), keyed by `fingerprint()`.
+
+    Once the rendered files exceed `max_size` bytes, the least recently used renders are removed.
+    The index of renders (with their sizes and last use) is kept in `index.json` alongside them.
+    """
+    def __init__(self, path=None, max_size=2**30):
+        self._path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def path(self):
+        return os.path.join(audio.FROZEN_PATH, 'cache') if self._path is None else self._path
+
+    def _index_path(self):
+        return os.path.join(self.path, 'index.json')
+
+    def _load_index(self):
+        try:
+            with open(self._index_path()) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_index(self, index):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._index_path() + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(self._index_path() + '.tmp', self._index_path())
+
+    def _files(self, key):
+        base = os.path.join(self.path, key)
+        return [path for path in (base + '.frz', base + '.pkl') if os.path.exists(path)]
+
+    def __call__(self, strm, redo=False, dtype=np.float64):
+        "Return the rendered (frozen) version of `strm`, rendering it only if it isn't already cached."
+        key = fingerprint(strm, np.dtype(dtype).str)
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, key)
+        index = self._load_index()
+        frozen = None if redo else load_frozen(path)
+        if frozen is None:
+            self.misses += 1
+            frozen = freeze_to(path, strm, dtype)
+        else:
+            self.hits += 1
+        index[key] = {'size': sum(map(os.path.getsize, self._files(key))), 'used': time.time()}
+        self._evict(index, key)
+        self._save_index(index)
+        return frozen
+
+    def _evict(self, index, keep):
+        total = sum(entry['size'] for entry in index.values())
+        for key in sorted(index, key=lambda key: index[key]['used']):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            try:
+                for path in self._files(key):
+                    os.remove(path)
+            except OSError:
+                # Probably still in use (memory-mapped files can't be removed on some platforms).
+                continue
+            total -= index.pop(key)['size']
+            self.evictions += 1
+
+    def stats(self):
+        "Return hit/miss/eviction counts for this session, along with the number and total size of cached renders."
+        index = self._load_index()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(index),
+            'size': sum(entry['size'] for entry in index.values()),
+        }
+
+    def clear(self):
+        "Remove all cached renders."
+        for key in self._load_index():
+            for path in self._files(key):
+                os.remove(path)
+        self._save_index({})
+
+render_cache = RenderCache()
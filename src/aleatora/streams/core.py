@@ -7,21 +7,35 @@
 
 import collections
 import itertools
+import math
+import numbers
 import operator
 
+import numpy as np
 
-def _make_stream_op(op, reversed=False):
+
+def _make_stream_op(op, reversed=False, vectorized=lambda other: False):
+    # `vectorized(other)` says whether the operator gives the same results on NumPy arrays as on samples
+    # when applied with `other` (a constant or another stream), in which case block mode applies it to whole blocks.
+    # Otherwise, block mode applies it sample by sample: e.g. `x ** 0.5` is complex for negative samples but nan in NumPy,
+    # and `1 / x` raises ZeroDivisionError where NumPy gives inf.
     if reversed:
         def fn(self, other):
             # No need to handle the iterable case, because it will be handled by the non-reversed version.
-            return self.map(lambda v: op(other, v))
+            return self.map(lambda v: op(other, v), vectorized=vectorized(other))
         return fn
     def fn(self, other):
         if isinstance(other, collections.abc.Iterable):
-            return self.zip(other).map(lambda p: op(*p))
-        return self.map(lambda v: op(v, other))
+            return self.map(op, other, vectorized=vectorized(other))
+        return self.map(lambda v: op(v, other), vectorized=vectorized(other))
     return fn
 
+def _elementwise(other):
+    return isinstance(other, (numbers.Number, collections.abc.Iterable))
+
+def _nonzero_constant(other):
+    return isinstance(other, numbers.Number) and other != 0
+
 def stream(thing):
     if isinstance(thing, collections.abc.Iterable):
         return Stream(thing)
@@ -29,6 +43,137 @@ def stream(thing):
         return lambda *args, **kwargs: FunctionStream(lambda: thing(*args, **kwargs))
     raise ValueError("Expected iterable or function")
 
+def stream_with(blocks=None, seek=None, length=None):
+    """Like `@stream`, but also attaches implementations of the block and seeking protocols (see `iter_blocks()` and `seek()`).
+
+    Each function takes the same arguments as the decorated generator function, preceded by an extra argument for `blocks` and `seek`:
+    `blocks(size, ...)` returns an iterator of blocks containing the same samples that the generator yields,
+    `seek(n, ...)` returns a stream of the elements from position `n` onwards, and
+    `length(...)` returns the number of elements the generator yields (see `known_length()`).
+    """
+    def decorator(fn):
+        def make(*args, **kwargs):
+            return FunctionStream(
+                lambda: fn(*args, **kwargs),
+                blocks and (lambda size: blocks(size, *args, **kwargs)),
+                seek and (lambda n: seek(n, *args, **kwargs)),
+                length and (lambda: length(*args, **kwargs)),
+            )
+        return make
+    return decorator
+
+
+# Block mode: instead of yielding one sample at a time, streams of numbers may be evaluated in blocks (NumPy arrays),
+# which avoids most of the per-sample interpreter overhead. This is opt-in: streams implement `__iter_blocks__(size)`
+# and `has_blocks()`, and anything that doesn't is chunked from its per-sample iterator.
+# Mono streams yield 1-D blocks; streams of frames yield 2-D blocks of shape (samples, channels).
+
+# Default number of samples per block.
+BLOCK_SIZE = 512
+
+def iter_blocks(iterable, size=BLOCK_SIZE):
+    """Iterate over `iterable` in blocks of `size` samples.
+
+    Every block has exactly `size` samples except the last, which may be shorter (but never empty).
+    Blocks may be shared with the producer, so consumers must not modify them in place.
+    """
+    if isinstance(iterable, np.ndarray):
+        return (iterable[i:i + size] for i in range(0, len(iterable), size))
+    method = getattr(iterable, '__iter_blocks__', None)
+    if method is not None:
+        return method(size)
+    return _chunk_blocks(iter(iterable), size)
+
+def has_blocks(iterable):
+    "Return True if `iterable` supports block mode natively, without falling back to per-sample iteration anywhere."
+    if isinstance(iterable, np.ndarray):
+        return True
+    if isinstance(iterable, Stream):
+        return iterable.has_blocks()
+    return False
+
+
+# Seeking: streams that can jump ahead without computing the elements in between implement `seek(n)`,
+# and streams that know their length in advance implement `known_length()`.
+# Slicing uses these, so that e.g. `composition[300.0:]` does not need to compute the first five minutes.
+
+def seek(iterable, n):
+    """Return a stream of the elements of `iterable` from position `n` onwards, without computing the elements before it.
+
+    Returns None if `iterable` does not support seeking.
+    """
+    if isinstance(iterable, Stream):
+        return iterable.seek(n)
+    try:
+        return Stream(iterable[n:])
+    except TypeError:
+        return None
+
+def _drop(iterable, n):
+    # Like `seek()`, but falls back to skipping elements one by one.
+    if not n:
+        return iterable
+    rest = seek(iterable, n)
+    if rest is None:
+        return SliceStream(iterable, n, None, None)
+    return rest
+
+def known_length(iterable):
+    "Return the number of elements in `iterable` if it is known in advance, `math.inf` if it is known to be infinite, and None otherwise."
+    if isinstance(iterable, Stream):
+        return iterable.known_length()
+    if isinstance(iterable, collections.abc.Sized):
+        return len(iterable)
+    return None
+
+def _chunk_blocks(it, size):
+    # Fallback for iterables that don't implement blocks.
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield np.array(chunk)
+
+def _unblock(block):
+    # Convert a block back into samples (Python scalars, or frames for multichannel blocks).
+    if block.ndim > 1:
+        from .audio import frame
+        return map(frame, block.tolist())
+    return block.tolist()
+
+def _align(blocks):
+    # Make mono blocks broadcast against multichannel blocks, as scalars do with frames.
+    if all(block.ndim == 1 for block in blocks):
+        return blocks
+    return [block[:, None] if block.ndim == 1 else block for block in blocks]
+
+def _concat(blocks):
+    if len(blocks) == 1:
+        return blocks[0]
+    channels = max(block.shape[1] if block.ndim > 1 else 1 for block in blocks)
+    if any(block.ndim > 1 for block in blocks):
+        blocks = [block if block.ndim > 1 else np.broadcast_to(block[:, None], (len(block), channels)) for block in blocks]
+    return np.concatenate(blocks)
+
+def _rechunk(blocks, size):
+    # Regroup blocks of arbitrary lengths into blocks of exactly `size` (except the last).
+    pending = []
+    count = 0
+    for block in blocks:
+        if not count and len(block) == size:
+            yield block
+            continue
+        pending.append(block)
+        count += len(block)
+        while count >= size:
+            joined = _concat(pending)
+            yield joined[:size]
+            rest = joined[size:]
+            pending = [rest] if len(rest) else []
+            count = len(rest)
+    if count:
+        yield _concat(pending)
+
 class Stream(collections.abc.Iterable):
     def __init__(self, iterable):
         self.iterable = iterable
@@ -36,6 +181,30 @@ class Stream(collections.abc.Iterable):
     def __iter__(self):
         return iter(self.iterable)
 
+    def __iter_blocks__(self, size):
+        if type(self).__iter__ is Stream.__iter__:
+            return iter_blocks(self.iterable, size)
+        # Subclass that only knows how to produce samples.
+        return _chunk_blocks(iter(self), size)
+
+    def has_blocks(self):
+        if type(self).__iter__ is Stream.__iter__:
+            return has_blocks(self.iterable)
+        return False
+
+    def blocks(self, size=BLOCK_SIZE):
+        return iter_blocks(self, size)
+
+    def seek(self, n):
+        if type(self).__iter__ is Stream.__iter__:
+            return seek(self.iterable, n)
+        return None
+
+    def known_length(self):
+        if type(self).__iter__ is Stream.__iter__:
+            return known_length(self.iterable)
+        return None
+
     # `a >> b` means `a` followed by `b`: sequential composition.
     # For streams of audio samples, this is akin to splicing tape together, or arranging tracks horizontally in a DAW.
     def __rshift__(self, other):
@@ -60,7 +229,7 @@ class Stream(collections.abc.Iterable):
     def __add__(self, other):
         if isinstance(other, collections.abc.Iterable):
             return MixStream((self, other))
-        return self.map(lambda v: v + other)
+        return self.map(lambda v: v + other, vectorized=isinstance(other, numbers.Number))
 
     def __sub__(self, other):
         return self + -other
@@ -77,14 +246,14 @@ class Stream(collections.abc.Iterable):
         elif isinstance(index, slice):
             return SliceStream(self, index.start, index.stop, index.step)
     
-    __radd__ = _make_stream_op(operator.add, reversed=True)
-    __rsub__ = _make_stream_op(operator.sub, reversed=True)
+    __radd__ = _make_stream_op(operator.add, reversed=True, vectorized=_elementwise)
+    __rsub__ = _make_stream_op(operator.sub, reversed=True, vectorized=_elementwise)
 
     # `a * b` means a amplitude-modulated by b (order doesn't matter).
     # I don't know if this has a equivalent in tape, but in electronics terms this is a mixer.
-    __mul__ = _make_stream_op(operator.mul)
-    __rmul__ = _make_stream_op(operator.mul, reversed=True)
-    __truediv__ = _make_stream_op(operator.truediv)
+    __mul__ = _make_stream_op(operator.mul, vectorized=_elementwise)
+    __rmul__ = _make_stream_op(operator.mul, reversed=True, vectorized=_elementwise)
+    __truediv__ = _make_stream_op(operator.truediv, vectorized=_nonzero_constant)
     __rtruediv__ = _make_stream_op(operator.truediv, reversed=True)
     __floordiv__ = _make_stream_op(operator.floordiv)
     __rfloordiv__ = _make_stream_op(operator.floordiv, reversed=True)
@@ -96,19 +265,14 @@ class Stream(collections.abc.Iterable):
     __rpow__ = _make_stream_op(operator.pow, reversed=True)
 
     # Unary operators
-    def __neg__(self): return self.map(operator.neg)
-    def __pos__(self): return self.map(operator.pos)
-    def __abs__(self): return self.map(operator.abs)
-    def __invert__(self): return self.map(operator.invert)
+    def __neg__(self): return self.map(operator.neg, vectorized=True)
+    def __pos__(self): return self.map(operator.pos, vectorized=True)
+    def __abs__(self): return self.map(operator.abs, vectorized=True)
+    def __invert__(self): return self.map(operator.invert, vectorized=True)
 
-    @stream
-    def map(self, fn, *iterables):
-        if iterables:
-            for xs in self.zip(*iterables):
-                yield fn(*xs)
-        else:
-            for x in self:
-                yield fn(x)
+    # If `vectorized` is true, `fn` promises to work element-wise on NumPy arrays, so block mode can apply it to whole blocks.
+    def map(self, fn, *iterables, vectorized=False):
+        return MapStream(self, fn, iterables, vectorized)
 
     @stream
     def each(self, fn):
@@ -117,13 +281,10 @@ class Stream(collections.abc.Iterable):
             yield x
 
     def zip(self, *others):
-        return FunctionStream(lambda: zip(self, *others))
+        return ZipStream((self,) + others)
 
-    @stream
     def filter(self, predicate):
-        for x in self:
-            if predicate(x):
-                yield x
+        return FilterStream(self, predicate)
     
     # Monadic bind.
     # Like concat, but the second stream is not created until it is needed, and it has access to the return value of the first stream.
@@ -205,15 +366,215 @@ class Stream(collections.abc.Iterable):
         # NOTE: Unlike the original stream, the 'split' streams are not restartable!
         return [stream(it) for it in itertools.tee(self, n)]
 
+    def compile(self):
+        """Return an equivalent stream with element-wise operations fused together.
+
+        Trees of `map()`s, operators, and `zip()`s become a single stream that applies one generated function per element
+        (once they are big enough for this to pay off),
+        consecutive `filter()`s become one filter, and streams that contain such trees are rebuilt around their compiled versions.
+        Streams that cannot be inspected (e.g. those created with `@stream`) are left as they are.
+        """
+        return self
+
+
+def _compile(thing):
+    return thing.compile() if isinstance(thing, Stream) else thing
+
+def _children(node):
+    # The streams that `node` combines element-wise, if it is a map or a zip (and so can be fused with them).
+    if isinstance(node, MapStream):
+        return (node.stream,) + tuple(node.iterables)
+    if isinstance(node, ZipStream):
+        return tuple(node.streams)
+    return None
+
+# Maps run as builtin `map()`s, so a short chain costs little beyond the calls to its functions, which fusing doesn't save.
+# Fusing only pays off (by removing layers of iterators) for trees with at least this many maps.
+_MIN_FUSED_MAPS = 8
+
+def _count_maps(root):
+    count = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        count += isinstance(node, MapStream)
+        stack.extend(_children(node) or ())
+    return count
+
+# Fused expressions are split into statements at this depth, to stay well within the parser's limit on nested parentheses.
+_MAX_FUSED_DEPTH = 50
+
+def _fuse(root):
+    """Fuse the tree of maps and zips rooted at `root` into one function, which computes an element of `root` from an element of each leaf.
+
+    Returns the function, the (compiled) leaves, and whether the function works on blocks as well.
+    The tree is walked with an explicit stack, and deeply nested expressions are broken up into statements,
+    so long chains run into neither the recursion limit nor the parser's nesting limit.
+    """
+    leaves = []
+    namespace = {}
+    lines = []
+    vectorized = True
+    # Post-order: each node's children are visited (left to right) before the node itself.
+    # `results` holds the expressions for the visited nodes that are still waiting for their parents, with their nesting depths.
+    stack = [(root, False)]
+    results = []
+    while stack:
+        node, visited = stack.pop()
+        children = _children(node)
+        if children is None:
+            leaves.append(_compile(node))
+            results.append((f"x{len(leaves) - 1}", 0))
+            continue
+        if not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        args = results[len(results) - len(children):]
+        del results[len(results) - len(children):]
+        depth = 1 + max((d for _, d in args), default=0)
+        if isinstance(node, MapStream):
+            name = f"f{len(namespace)}"
+            namespace[name] = node.fn
+            vectorized = vectorized and node.vectorized
+            expr = f"{name}({', '.join(a for a, _ in args)})"
+        else:
+            vectorized = False
+            expr = f"({''.join(a + ', ' for a, _ in args)})"
+        if depth >= _MAX_FUSED_DEPTH:
+            lines.append(f"v{len(lines)} = {expr}")
+            expr, depth = f"v{len(lines) - 1}", 0
+        results.append((expr, depth))
+    return _fused_function(lines, results[0][0], len(leaves), namespace), leaves, vectorized
+
+def _fused_function(lines, result, arity, namespace):
+    # Bind the component functions as closure variables, which are faster to look up than globals.
+    params = ', '.join(f"x{i}" for i in range(arity))
+    body = ''.join(f"        {line}\n" for line in lines)
+    source = f"def make({', '.join(namespace)}):\n    def fused({params}):\n{body}        return {result}\n    return fused\n"
+    scope = {}
+    exec(source, scope)
+    return scope['make'](*namespace.values())
+
 
 
 class FunctionStream(Stream):
-    def __init__(self, func):
+    def __init__(self, func, block_func=None, seek_func=None, length_func=None):
         self.func = func
+        self.block_func = block_func
+        self.seek_func = seek_func
+        self.length_func = length_func
     
     def __iter__(self):
         return self.func()
 
+    def __iter_blocks__(self, size):
+        if self.block_func is None:
+            return _chunk_blocks(iter(self), size)
+        return self.block_func(size)
+
+    def has_blocks(self):
+        return self.block_func is not None
+
+    def seek(self, n):
+        return self.seek_func and self.seek_func(n)
+
+    def known_length(self):
+        return self.length_func and self.length_func()
+
+
+class MapStream(Stream):
+    def __init__(self, stream, fn, iterables=(), vectorized=False):
+        self.stream = stream
+        self.fn = fn
+        self.iterables = iterables
+        self.vectorized = vectorized
+
+    def __iter__(self):
+        return map(self.fn, self.stream, *self.iterables)
+
+    def __iter_blocks__(self, size):
+        fn = self.fn
+        inputs = [iter_blocks(self.stream, size)] + [iter_blocks(it, size) for it in self.iterables]
+        for blocks in zip(*inputs):
+            length = min(map(len, blocks))
+            if len(blocks) > 1:
+                blocks = _align([block[:length] for block in blocks])
+            if self.vectorized:
+                yield fn(*blocks)
+            else:
+                yield np.array(list(map(fn, *map(_unblock, blocks))))
+            if length < size:
+                return
+
+    def has_blocks(self):
+        return self.vectorized and has_blocks(self.stream) and all(map(has_blocks, self.iterables))
+
+    def compile(self):
+        if _count_maps(self) < _MIN_FUSED_MAPS:
+            # Too little to fuse.
+            return MapStream(_compile(self.stream), self.fn, tuple(map(_compile, self.iterables)), self.vectorized)
+        fn, leaves, vectorized = _fuse(self)
+        return MapStream(leaves[0], fn, tuple(leaves[1:]), vectorized)
+
+    def seek(self, n):
+        return MapStream(_drop(self.stream, n), self.fn, tuple(_drop(it, n) for it in self.iterables), self.vectorized)
+
+    def known_length(self):
+        lengths = [known_length(it) for it in (self.stream,) + tuple(self.iterables)]
+        if None in lengths:
+            return None
+        return min(lengths)
+
+
+class ZipStream(Stream):
+    def __init__(self, streams):
+        self.streams = streams
+
+    def __iter__(self):
+        return zip(*self.streams)
+
+    def seek(self, n):
+        return ZipStream(tuple(_drop(stream, n) for stream in self.streams))
+
+    def known_length(self):
+        lengths = [known_length(stream) for stream in self.streams]
+        if None in lengths:
+            return None
+        return min(lengths)
+
+    def compile(self):
+        if _count_maps(self) < _MIN_FUSED_MAPS:
+            # Nested zips alone are best left to the builtin zip.
+            return ZipStream(tuple(map(_compile, self.streams)))
+        # Flatten nested zips (and maps) into a single map that rebuilds the tuples.
+        fn, leaves, _ = _fuse(self)
+        return MapStream(leaves[0], fn, tuple(leaves[1:]))
+
+
+class FilterStream(Stream):
+    def __init__(self, stream, predicate):
+        self.stream = stream
+        self.predicate = predicate
+
+    def __iter__(self):
+        predicate = self.predicate
+        for x in self.stream:
+            if predicate(x):
+                yield x
+
+    def compile(self):
+        predicates = [self.predicate]
+        stream = self.stream
+        while isinstance(stream, FilterStream):
+            predicates.append(stream.predicate)
+            stream = stream.stream
+        if len(predicates) == 1:
+            return FilterStream(_compile(stream), self.predicate)
+        namespace = {f"p{i}": predicate for i, predicate in enumerate(predicates)}
+        expr = ' and '.join(f"p{i}(x0)" for i in reversed(range(len(predicates))))
+        return FilterStream(_compile(stream), _fused_function([], expr, 1, namespace))
+
 
 class ConcatStream(Stream):
     def __init__(self, streams):
@@ -229,6 +590,35 @@ class ConcatStream(Stream):
         for stream in self.streams:             
             yield from stream
 
+    def __iter_blocks__(self, size):
+        return _rechunk((block for stream in self.streams for block in iter_blocks(stream, size)), size)
+
+    def has_blocks(self):
+        return all(map(has_blocks, self.streams))
+
+    def compile(self):
+        return ConcatStream(map(_compile, self.streams))
+
+    def seek(self, n):
+        for i, stream in enumerate(self.streams):
+            length = known_length(stream)
+            if length is None:
+                # The skip may run past this stream, into the following ones, so it has to be done element by element
+                # (which seeking the remaining streams from here leaves to the caller).
+                return SliceStream(ConcatStream(self.streams[i:]), n, None, None) if i else None
+            if length <= n:
+                # Skip the whole stream.
+                n -= length
+                continue
+            return ConcatStream([_drop(stream, n)] + self.streams[i + 1:])
+        return empty
+
+    def known_length(self):
+        lengths = [known_length(stream) for stream in self.streams]
+        if None in lengths:
+            return None
+        return sum(lengths)
+
 
 class MixStream(Stream):
     def __init__(self, streams):
@@ -246,22 +636,121 @@ class MixStream(Stream):
         #       yield sum(values)
         # Instead, we basically implement itertools.zip_longest, with the difference
         # that we remove exhausted iterators rather than replacing them with fillers.
-        iterators = [iter(it) for it in self.streams]
-        while True:
-            while iterators:
-                try:
-                    acc = next(iterators[-1])
-                    break
-                except StopIteration:
-                    del iterators[-1]
-            for i in range(len(iterators) - 2, -1, -1):
-                try:
+        return _mix_samples([iter(stream) for stream in self.streams])
+
+    def __iter_blocks__(self, size):
+        return _mix_blocks([iter_blocks(stream, size) for stream in self.streams], size)
+
+    def has_blocks(self):
+        return all(map(has_blocks, self.streams))
+
+    def compile(self):
+        return MixStream(map(_compile, self.streams))
+
+    def seek(self, n):
+        streams = []
+        for stream in self.streams:
+            length = known_length(stream)
+            if length is None or length > n:
+                streams.append(_drop(stream, n))
+        return MixStream(streams)
+
+    def known_length(self):
+        lengths = [known_length(stream) for stream in self.streams]
+        if None in lengths:
+            return None
+        return max(lengths, default=0)
+
+# Mixing core, shared by MixStream and Mixer.
+# Both versions modify `iterators` in place, removing exhausted iterators by swapping in the last one
+# (which has already been visited in the current step, since we go from last to first).
+
+def _mix_samples(iterators, count=None, fill=0):
+    """Yield the sum of the next value from each of `iterators` until they are all exhausted.
+
+    If `count` is given, yield exactly `count` sums instead, using `fill` when there is nothing to sum.
+    """
+    from .audio import frame
+    for _ in itertools.repeat(None) if count is None else itertools.repeat(None, count):
+        while iterators:
+            try:
+                acc = next(iterators[-1])
+                break
+            except StopIteration:
+                iterators.pop()
+        else:
+            if count is None:
+                return
+            yield fill
+            continue
+        if isinstance(acc, frame):
+            yield _mix_frames(acc, iterators)
+            continue
+        # Tight loop for scalars. The handler is outside the loop, so it costs nothing until a voice finishes;
+        # then we retire the voice and pick up where we left off.
+        i = len(iterators) - 1
+        while i:
+            try:
+                for i in range(i - 1, -1, -1):
                     acc += next(iterators[i])
-                except StopIteration:
-                    del iterators[i]
-            if not iterators:
                 break
-            yield acc
+            except StopIteration:
+                iterators[i] = iterators[-1]
+                iterators.pop()
+        yield acc
+
+def _mix_frames(acc, iterators):
+    # Collect the remaining values and sum each channel once,
+    # rather than allocating a new frame for every addition.
+    from .audio import frame
+    values = [acc]
+    for i in range(len(iterators) - 2, -1, -1):
+        try:
+            values.append(next(iterators[i]))
+        except StopIteration:
+            iterators[i] = iterators[-1]
+            iterators.pop()
+    try:
+        return frame(map(sum, zip(*values)))
+    except TypeError:
+        # Mix of frames and scalars.
+        for x in values[1:]:
+            acc += x
+        return acc
+
+def _mix_blocks(inputs, size):
+    "Like `_mix_samples()`, but for iterators of blocks (see `iter_blocks()`)."
+    while True:
+        acc = None
+        # Whether `acc` is our own accumulator, or just the block of the first voice.
+        owned = False
+        length = 0
+        i = len(inputs) - 1
+        while i >= 0:
+            block = next(inputs[i], None)
+            i -= 1
+            if block is None:
+                inputs[i + 1] = inputs[-1]
+                inputs.pop()
+                continue
+            if acc is None:
+                acc = block
+            else:
+                if not owned:
+                    first = acc
+                    acc = np.zeros((size,) + first.shape[1:])
+                    acc[:len(first)] = first
+                    owned = True
+                if block.ndim > acc.ndim:
+                    # First multichannel voice: broadcast what we have so far to all channels.
+                    acc = np.repeat(acc[:, None], block.shape[1], axis=1)
+                elif block.ndim < acc.ndim:
+                    block = block[:, None]
+                acc[:len(block)] += block
+            length = max(length, len(block))
+        if acc is None:
+            return
+        yield acc[:length]
 
 class SliceStream(Stream):
     def __init__(self, stream, start, stop, step):
@@ -276,20 +765,138 @@ class SliceStream(Stream):
         assert(self.stop is None or self.stop >= 0)
 
     def __iter__(self):
-        it = iter(self.stream)
-        for _ in zip(range(self.start), it): pass
+        rest = seek(self.stream, self.start) if self.start else self.stream
+        if rest is None:
+            it = iter(self.stream)
+            for _ in zip(range(self.start), it): pass
+        else:
+            it = iter(rest)
         indices = count() if self.stop is None else range(self.stop - self.start)
         for i, x in zip(indices, it):
             if i % self.step == 0:
                 yield x
         return stream(it)
 
+    def __iter_blocks__(self, size):
+        return _rechunk(self._slice_blocks(size), size)
+
+    def _slice_blocks(self, size):
+        skip = self.start
+        stream = self.stream
+        if skip:
+            rest = seek(stream, skip)
+            if rest is not None:
+                stream, skip = rest, 0
+        remaining = None if self.stop is None else self.stop - self.start
+        if remaining is not None and remaining <= 0:
+            return
+        offset = 0
+        for block in iter_blocks(stream, size):
+            if skip:
+                if len(block) <= skip:
+                    skip -= len(block)
+                    continue
+                block = block[skip:]
+                skip = 0
+            if remaining is not None:
+                block = block[:remaining]
+                remaining -= len(block)
+            if self.step != 1:
+                length = len(block)
+                block = block[-offset % self.step::self.step]
+                offset += length
+            if len(block):
+                yield block
+            if remaining == 0:
+                return
+
+    def has_blocks(self):
+        return has_blocks(self.stream)
+
+    def compile(self):
+        return SliceStream(_compile(self.stream), self.start, self.stop, self.step)
+
+    def seek(self, n):
+        return SliceStream(self.stream, self.start + n * self.step, self.stop, self.step)
+
+    def known_length(self):
+        length = known_length(self.stream)
+        if length is None:
+            # Even with `stop`, the underlying stream might end sooner.
+            return None
+        end = length if self.stop is None else min(self.stop, length)
+        if end == math.inf:
+            return math.inf
+        return max(0, math.ceil((end - self.start) / self.step))
+
+
+class BlockReader(Stream):
+    """Reads arbitrary numbers of samples from an iterator of blocks (see `iter_blocks()`).
+
+    This is for consumers such as audio callbacks, which need a varying number of samples at a time.
+    Like an iterator, a BlockReader can only be consumed once.
+    """
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.pending = None
+
+    def _fill(self):
+        if self.pending is None:
+            self.pending = next(self.blocks, None)
+        return self.pending is not None
+
+    def channels(self):
+        "Number of channels in the upcoming samples (1 if the stream is mono or finished)."
+        if self._fill() and self.pending.ndim > 1:
+            return self.pending.shape[1]
+        return 1
+
+    def read(self, n):
+        "Return up to `n` samples as an array. Fewer than `n` samples are returned only at the end of the stream."
+        pieces = []
+        count = 0
+        while count < n and self._fill():
+            piece = self.pending[:n - count]
+            self.pending = self.pending[n - count:] if len(self.pending) > n - count else None
+            pieces.append(piece)
+            count += len(piece)
+        if not pieces:
+            return np.empty(0)
+        return _concat(pieces)
 
-@stream
-def const(value):
+    def __iter__(self):
+        for block in self.__iter_blocks__(BLOCK_SIZE):
+            yield from _unblock(block)
+
+    def __iter_blocks__(self, size):
+        while True:
+            block = self.read(size)
+            if len(block):
+                yield block
+            if len(block) < size:
+                return
+
+    def has_blocks(self):
+        return True
+
+
+def _const(value):
     while True:
         yield value
 
+def _const_blocks(size, value):
+    # Integer constants become float blocks: an int64 array would overflow or reject negative powers,
+    # whereas the per-sample path uses Python ints.
+    block = np.full(size, value, dtype=float if isinstance(value, numbers.Real) else complex)
+    while True:
+        yield block
+
+def const(value):
+    strm = FunctionStream(lambda: _const(value), seek_func=lambda n: strm, length_func=lambda: math.inf)
+    if isinstance(value, numbers.Number):
+        strm.block_func = lambda size: _const_blocks(size, value)
+    return strm
+
 @stream
 def repeat(f):
     while True:
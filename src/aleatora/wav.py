@@ -2,63 +2,421 @@ from . import streams
 
 import numpy as np
 
+import io
+import itertools
+import math
+import multiprocessing
+import os
+import struct
+import tempfile
 import time
-import wave
-
-
-def load_array(filename, resample=False):
-    with wave.open(filename, "rb") as w:
-        width = w.getsampwidth()
-        channels = w.getnchannels()
-        sample_rate = w.getframerate()
-        buffer = w.readframes(w.getnframes())
-    if width == 2:
-        data = np.frombuffer(buffer, dtype=np.int16).reshape(-1, channels).astype(np.float32) / np.iinfo(np.int16).max
-    elif width == 3:
-        audio = np.frombuffer(buffer, dtype=np.uint8).reshape(-1, 3)
-        converted = np.bitwise_or.reduce(audio << np.array([8, 16, 24]), dtype=np.int32, axis=1)
-        data = converted.astype(np.float32).reshape(-1, channels) / np.iinfo(np.int32).max
-    elif width == 4:
-        data = np.frombuffer(buffer, dtype=np.int32).astype(np.float32).reshape(-1, channels) / np.iinfo(np.int32).max
-    else:
-        raise NotImplementedError(f"{width*8}-bit wave files not supported")
-    if resample and streams.SAMPLE_RATE != w.getframerate():
-        new_data = np.empty((int(streams.SAMPLE_RATE / sample_rate * len(data)), data.shape[1]))
-        x = np.arange(len(data)) / sample_rate
-        new_x = np.arange(len(new_data)) / streams.SAMPLE_RATE
-        for i in range(data.shape[1]):
-            new_data[:, i] = np.interp(new_x, x, data[:, i])
-        data = new_data
+
+
+# Sample types by (format tag, bits per sample), as NumPy dtypes. 24-bit samples are unpacked separately.
+SAMPLE_TYPES = {
+    (1, 8): np.dtype('u1'),
+    (1, 16): np.dtype('<i2'),
+    (1, 24): np.dtype('u1'),
+    (1, 32): np.dtype('<i4'),
+    (3, 32): np.dtype('<f4'),
+    (3, 64): np.dtype('<f8'),
+}
+
+def _read_header(f):
+    # Return (format tag, channels, sample rate, bits per sample, data offset, data size) for a RIFF or RF64 wave file.
+    riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+    if riff not in (b'RIFF', b'RF64') or wave_id != b'WAVE':
+        raise ValueError("Not a wave file")
+    fmt = None
+    data_size64 = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("Wave file has no data")
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("Wave file has no format chunk before its data")
+            if size == 0xFFFFFFFF and data_size64 is not None:
+                size = data_size64
+            return fmt + (f.tell(), size)
+        body = f.read(size + size % 2)
+        if chunk_id == b'fmt ':
+            tag, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+            if tag == 0xFFFE:
+                # WAVE_FORMAT_EXTENSIBLE: the real format tag starts the subformat GUID.
+                tag, = struct.unpack('<H', body[24:26])
+            fmt = (tag, channels, sample_rate, bits)
+        elif chunk_id == b'ds64':
+            _, data_size64 = struct.unpack('<QQ', body[:16])
+
+def _open(source):
+    # Memory-map the samples in `source` (a filename or file object).
+    # Returns the raw samples, with shape (frames, channels) (or (frames, channels, 3) for 24-bit), and the header.
+    f = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        f.seek(0)
+        tag, channels, sample_rate, bits, offset, size = header = _read_header(f)
+        if (tag, bits) not in SAMPLE_TYPES:
+            raise NotImplementedError(f"{bits}-bit wave files with format {tag} not supported")
+        dtype = SAMPLE_TYPES[tag, bits]
+        f.seek(0, os.SEEK_END)
+        # The data chunk may claim more than there is (e.g. if it was never finalized).
+        frames = min(size, f.tell() - offset) // (channels * bits // 8)
+        shape = (frames, channels, 3) if bits == 24 else (frames, channels)
+        if not frames:
+            raw = np.empty(shape, dtype)
+        else:
+            try:
+                raw = np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=shape)
+            except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+                # Not a real file (e.g. BytesIO).
+                f.seek(offset)
+                raw = np.frombuffer(f.read(frames * channels * bits // 8), dtype).reshape(shape)
+    finally:
+        if f is not source:
+            f.close()
+    return raw, header
+
+def _decode(raw, bits):
+    # Convert raw samples (from `_open()`) to float32.
+    if bits == 8:
+        return (raw.astype(np.float32) - 128) / 128
+    if bits == 16:
+        return raw.astype(np.float32) / np.iinfo(np.int16).max
+    if bits == 24:
+        converted = np.bitwise_or.reduce(raw.astype(np.int32) << np.array([8, 16, 24]), dtype=np.int32, axis=-1)
+        return converted.astype(np.float32) / np.iinfo(np.int32).max
+    if raw.dtype.kind == 'i':
+        return raw.astype(np.float32) / np.iinfo(np.int32).max
+    return raw.astype(np.float32)
+
+class WavStream(streams.Stream):
+    """Samples from a memory-mapped wave file, decoded a block at a time, so even large files load instantly.
+
+    Yields frames of all channels if `multichannel` is set, or else mixes them down to mono.
+    Supports blocks, seeking, and slicing without reading the skipped part.
+    """
+    def __init__(self, raw, bits, multichannel=False, start=0):
+        self.raw = raw
+        self.bits = bits
+        self.multichannel = multichannel
+        self.start = start
+
+    def decode(self, start=0, stop=None):
+        "Return samples from `start` to `stop` (relative to the start of this stream) as an array."
+        data = _decode(self.raw[self.start + start:None if stop is None else self.start + stop], self.bits)
+        return data if self.multichannel else data.mean(axis=1)
+
+    def __iter__(self):
+        for block in self.__iter_blocks__(streams.BLOCK_SIZE):
+            yield from streams.core._unblock(block)
+
+    def __iter_blocks__(self, size):
+        for i in range(0, len(self.raw) - self.start, size):
+            yield self.decode(i, i + size)
+
+    def has_blocks(self):
+        return True
+
+    def seek(self, n):
+        return WavStream(self.raw, self.bits, self.multichannel, min(self.start + n, len(self.raw)))
+
+    def known_length(self):
+        return len(self.raw) - self.start
+
+def load_array(filename, resample=False, quality='medium'):
+    raw, (_, _, sample_rate, bits, _, _) = _open(filename)
+    data = _decode(raw, bits)
+    if resample and streams.SAMPLE_RATE != sample_rate:
+        resampler = streams.Resampler(sample_rate / streams.SAMPLE_RATE, quality)
+        data = np.concatenate((resampler.process(data), resampler.flush())).astype(np.float32)
     return data
 
-def load(filename, resample=False, multichannel=False):
-    data = load_array(filename, resample=resample)
-    if multichannel:
-        return streams.stream([streams.frame(x) for x in data.tolist()])
-    return streams.stream(data.mean(axis=1).tolist())
+def load(filename, resample=False, multichannel=False, quality='medium'):
+    raw, (_, _, sample_rate, bits, _, _) = _open(filename)
+    if resample and streams.SAMPLE_RATE != sample_rate:
+        # Resampling reads the whole file up front (see `streams.Resampler` for `quality`).
+        data = load_array(filename, resample=True, quality=quality)
+        return streams.FrozenStream(data if multichannel else data.mean(axis=1))
+    return WavStream(raw, bits, multichannel)
 
 
-def save(comp, filename, chunk_size=16384, verbose=False):
-    w = wave.open(filename, "wb")
-    sample, comp = streams.peek(comp)
-    channels = getattr(sample, "__len__", lambda: 1)()
-    chunk_size //= channels
-    w.setnchannels(channels)
-    w.setsampwidth(2)
-    w.setframerate(streams.SAMPLE_RATE)
-    chunk = np.empty((chunk_size, channels), dtype=np.float32)
-    siter = iter(comp)
+# Sample formats supported by WavWriter: (bytes per sample, format tag).
+FORMATS = {
+    'int16': (2, 1),
+    'int24': (3, 1),
+    'float32': (4, 3),
+}
+
+class WavWriter:
+    """Incrementally write samples to a wave file, in one of FORMATS.
+
+    Files start out as regular RIFF wave files, with room reserved (as a JUNK chunk) to become RF64 files
+    on `close()`, if the audio turns out to be too long for RIFF's 32-bit sizes (about 4 GB).
+    """
+    def __init__(self, filename, channels, format='int16', sample_rate=None):
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported format {format!r} (expected one of {', '.join(FORMATS)})")
+        self.channels = channels
+        self.format = format
+        self.width, self.tag = FORMATS[format]
+        self.sample_rate = int(sample_rate or streams.SAMPLE_RATE)
+        self.frames = 0
+        self.file = open(filename, 'wb')
+        self._write_header()
+
+    def _write_header(self, riff_size=0, data_size=0, rf64=False):
+        # All sizes are patched in by close().
+        block_align = self.channels * self.width
+        fmt = struct.pack('<HHIIHH', self.tag, self.channels, self.sample_rate, self.sample_rate * block_align, block_align, self.width * 8)
+        if self.tag != 1:
+            # Non-PCM formats have an extension size, and a fact chunk with the length in frames.
+            fmt += struct.pack('<H', 0)
+            fact = b'fact' + struct.pack('<II', 4, min(self.frames, 0xFFFFFFFF))
+        else:
+            fact = b''
+        if rf64:
+            header = b'RF64' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+            header += b'ds64' + struct.pack('<IQQQI', 28, riff_size, data_size, self.frames, 0)
+            data_size = 0xFFFFFFFF
+        else:
+            header = b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+            header += b'JUNK' + struct.pack('<I', 28) + bytes(28)
+        header += b'fmt ' + struct.pack('<I', len(fmt)) + fmt + fact
+        header += b'data' + struct.pack('<I', data_size)
+        self.file.seek(0)
+        self.file.write(header)
+        self.data_start = len(header)
+
+    def write(self, block):
+        "Write a block of samples (see `streams.iter_blocks()`) in the range [-1, 1]."
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block[:, None]
+        if block.shape[1] != self.channels:
+            # Mono blocks may turn up in a multichannel stream (e.g. once the multichannel parts of a mix finish).
+            block = np.broadcast_to(block, (len(block), self.channels))
+        if self.format == 'float32':
+            data = block.astype('<f4')
+        elif self.format == 'int16':
+            data = (np.clip(block, -1, 1) * (2**15-1)).astype('<i2')
+        else:
+            # Take the low three bytes of each 32-bit integer.
+            data = (np.clip(block, -1, 1) * (2**23-1)).astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3]
+        self.file.write(np.ascontiguousarray(data).tobytes())
+        self.frames += len(block)
+
+    def close(self):
+        if self.file is None:
+            return
+        data_size = self.frames * self.channels * self.width
+        if data_size % 2:
+            # Chunks are padded to an even size.
+            self.file.write(b'\0')
+        riff_size = self.data_start - 8 + data_size + data_size % 2
+        if riff_size > 0xFFFFFFFF:
+            self._write_header(riff_size, data_size, rf64=True)
+        else:
+            self._write_header(riff_size, data_size)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def save(comp, filename, chunk_size=16384, verbose=False, format='int16'):
+    """Save `comp` to a wave file, in one of FORMATS ('int16', 'int24', or 'float32')."""
+    chunks, channels = _chunks(comp, chunk_size)
     # Avoid holding onto memory if e.g. memoize() is involved:
     del comp
-    i = chunk_size - 1
     if verbose:
-        t = 0
         start_time = time.time()
-    while i == chunk_size - 1:
-        for i, sample in zip(range(chunk_size), siter):
-            chunk[i] = sample
-        w.writeframes((chunk[:i+1] * (2**15-1)).astype(np.int16))
-        if verbose:
-            t += (i + 1)
-            print(f"{t} ({t/streams.SAMPLE_RATE}) - real time: {time.time() - start_time}")
-    w.close()
+        progress = lambda t: print(f"{t} ({t/streams.SAMPLE_RATE}) - real time: {time.time() - start_time}")
+    else:
+        progress = None
+    _write(filename, chunks, channels, format, progress)
+
+def _chunks(comp, chunk_size):
+    # Chunks of samples from `comp` (as arrays), and the number of channels.
+    if streams.has_blocks(comp):
+        # Pull whole blocks from the graph.
+        blocks = streams.iter_blocks(comp, chunk_size)
+        first = next(blocks, np.empty(0))
+        channels = first.shape[1] if first.ndim > 1 else 1
+        return itertools.chain([first], blocks), channels
+    sample, comp = streams.peek(comp)
+    channels = getattr(sample, "__len__", lambda: 1)()
+    return _chunk_samples(iter(comp), chunk_size // channels, channels), channels
+
+def _write(filename, chunks, channels, format='int16', progress=None):
+    # Write chunks to a wave file, calling `progress` with the number of samples written so far.
+    with WavWriter(filename, channels, format) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+            if progress:
+                progress(writer.frames)
+
+class SinkStream(streams.Stream):
+    "Passes `stream` through unchanged, writing it to a wave file as it goes. See `sink()`."
+    def __init__(self, stream, filename, format='int16', chunk_size=16384):
+        self.stream = stream
+        self.filename = filename
+        self.format = format
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        writer = None
+        buffer = []
+        try:
+            for sample in self.stream:
+                buffer.append(sample)
+                if len(buffer) == self.chunk_size:
+                    writer = self._write(writer, buffer)
+                    buffer = []
+                yield sample
+        finally:
+            # Also reached if playback stops early, so we still end up with a valid file.
+            if buffer or writer is None:
+                writer = self._write(writer, buffer)
+            writer.close()
+
+    def __iter_blocks__(self, size):
+        writer = None
+        try:
+            for block in streams.iter_blocks(self.stream, size):
+                writer = self._write(writer, block)
+                yield block
+        finally:
+            if writer is None:
+                writer = self._write(writer, np.empty(0))
+            writer.close()
+
+    def _write(self, writer, block):
+        if isinstance(block, list):
+            channels = writer.channels if writer else getattr(block[0], "__len__", lambda: 1)() if block else 1
+            block = _to_block(block, channels)
+        if writer is None:
+            writer = WavWriter(self.filename, block.shape[1] if block.ndim > 1 else 1, self.format)
+        writer.write(block)
+        return writer
+
+    def has_blocks(self):
+        return streams.has_blocks(self.stream)
+
+def sink(filename, format='int16', chunk_size=16384):
+    """Stage that passes a stream through while writing it to a wave file, for recording while monitoring.
+
+    Example: `play(comp | wav.sink("take1.wav"))`
+    """
+    return lambda stream: SinkStream(stream, filename, format, chunk_size)
+
+def render(comp, filename, processes=None, progress=None, chunk_size=16384, verbose=False, format='int16'):
+    """Render `comp` to a wave file as fast as possible.
+
+    If `comp` is a mix (a MixStream, as from `a + b`) or an arrangement (a Timeline, as from `arrange()`),
+    its tracks are divided among `processes` worker processes (by default, one per CPU).
+    Each worker renders its share to a memory-mapped file, and the results are summed into the output file.
+    Otherwise (or where processes can't be forked), `comp` is rendered in this process.
+    Samples are written in one of FORMATS, as with `save()`.
+
+    `progress`, if given, is called periodically with the number of seconds of audio rendered so far
+    (summed over all workers) and the speed in multiples of real time.
+    """
+    if progress is None and verbose:
+        progress = lambda seconds, speed: print(f"{seconds:.1f}s rendered ({speed:.1f}x real time)")
+    start_time = time.time()
+    def report(samples):
+        if progress:
+            seconds = samples / streams.SAMPLE_RATE
+            progress(seconds, seconds / max(time.time() - start_time, 1e-9))
+
+    parts = _split_tracks(comp, processes or os.cpu_count() or 1)
+    if len(parts) < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+        chunks, channels = _chunks(comp, chunk_size)
+        del comp
+        _write(filename, chunks, channels, format, report)
+        return
+
+    # Forking (rather than spawning) lets the workers inherit the streams, which often can't be pickled.
+    context = multiprocessing.get_context('fork')
+    # Samples rendered by each worker, for progress reports.
+    counts = context.Array('q', len(parts), lock=False)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"part{i}") for i in range(len(parts))]
+        workers = [context.Process(target=_render_part, args=(part, path, counts, i, chunk_size))
+                   for i, (part, path) in enumerate(zip(parts, paths))]
+        del comp, parts
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(0.25)
+                report(sum(counts))
+        for worker in workers:
+            if worker.exitcode:
+                raise RuntimeError(f"Rendering failed in worker process {worker.pid}")
+        total = sum(counts)
+        mix = streams.MixStream([streams.load_frozen(path) for path in paths])
+        chunks, channels = _chunks(mix, chunk_size)
+        _write(filename, chunks, channels, format)
+        del mix, chunks
+    report(total)
+
+def _render_part(strm, path, counts, index, chunk_size):
+    # Runs in a worker process.
+    writer = streams.FrozenWriter(path, np.float32)
+    for block in streams.iter_blocks(strm, chunk_size):
+        writer.write(block)
+        counts[index] += len(block)
+    writer.close()
+
+def _split_tracks(comp, count):
+    # Split a mix or arrangement into at most `count` streams that sum to `comp`, balancing their (estimated) lengths.
+    if isinstance(comp, streams.MixStream):
+        tracks = [(streams.known_length(strm), strm) for strm in comp.streams]
+        def combine(group):
+            return group[0] if len(group) == 1 else streams.MixStream(group)
+    elif isinstance(comp, streams.Timeline) and not comp.persist and comp.fill == 0:
+        tracks = [(length, (time, strm, length)) for time, strm, length in comp.items]
+        def combine(group):
+            timeline = streams.Timeline()
+            for item in group:
+                timeline.add(*item)
+            return timeline.seek(comp.offset) if comp.offset else timeline
+    else:
+        return [comp]
+    known = [length for length, _ in tracks if length is not None and length != math.inf]
+    default = sum(known) / len(known) if known else 1
+    groups = [[] for _ in range(min(count, len(tracks)))]
+    loads = [0] * len(groups)
+    # Longest first, each to the least loaded group.
+    for length, track in sorted(tracks, key=lambda track: -(default if track[0] in (None, math.inf) else track[0])):
+        i = loads.index(min(loads))
+        groups[i].append(track)
+        loads[i] += default if length in (None, math.inf) else length
+    return [combine(group) for group in groups if group]
+
+def _chunk_samples(siter, chunk_size, channels):
+    while True:
+        samples = list(itertools.islice(siter, chunk_size))
+        if not samples:
+            return
+        yield _to_block(samples, channels)
+
+def _to_block(samples, channels):
+    # Convert a list of samples (scalars or frames) to an array with `channels` columns.
+    try:
+        block = np.array(samples, dtype=np.float32)
+    except ValueError:
+        block = None
+    if block is None or block.ndim != (1 if channels == 1 else 2):
+        # Mix of frames and scalars (or frames of different sizes): broadcast each sample.
+        block = np.empty((len(samples), channels), dtype=np.float32)
+        for i, sample in enumerate(samples):
+            block[i] = sample
+    return block
@@ -0,0 +1,43 @@
+import numpy as np
+
+from aleatora.streams import count, iter_blocks, MapStream, osc, Stream, ZipStream
+
+
+def fused(strm):
+    # Whether `strm` was compiled into a single map over its leaves.
+    return isinstance(strm, MapStream) and not any(isinstance(s, (MapStream, ZipStream)) for s in (strm.stream,) + strm.iterables)
+
+def chain(length):
+    strm = count()
+    for i in range(length):
+        strm = strm.map(lambda x, i=i: x + i)
+    return strm[:100]
+
+def test_short_chains_are_not_fused():
+    strm = count().map(str)
+    compiled = strm.compile()
+    assert isinstance(compiled, MapStream) and compiled.fn is str
+    assert not fused(chain(3).compile().stream)
+
+def test_long_chains_compile():
+    # Long enough to exceed the parser's nesting limit, if the fused function nested all of its calls.
+    compiled = chain(250).compile()
+    assert fused(compiled.stream)
+    assert list(compiled) == [x + 250 * 249 // 2 for x in range(100)]
+
+def test_trees_of_maps_and_zips():
+    a, b = Stream(range(10)), Stream(range(10, 20))
+    strm = (a * 2 * b.map(abs) * 3 - 1).zip(a.map(str).map(len), b * b).map(lambda t: (t[0] - 1, t[1], t[2]))
+    assert fused(strm.compile())
+    assert list(strm.compile()) == list(strm)
+
+def test_filters():
+    strm = count().filter(lambda x: x % 2).filter(lambda x: x % 3)[:10]
+    assert list(strm.compile()) == list(strm)
+
+def test_fused_blocks():
+    strm = ((osc(440) * 0.5 * osc(3) * 2 * osc(5) * 0.1 - 1) * osc(7) + 0.5)[:1000]
+    compiled = strm.compile()
+    assert fused(compiled.stream)
+    assert compiled.has_blocks()
+    np.testing.assert_allclose(np.concatenate(list(iter_blocks(compiled, 256))), list(strm))
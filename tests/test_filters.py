@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from aleatora.filters import _matrix_powers, lpf, rbj, svf, SVFStream
+from aleatora.streams import const, iter_blocks, osc, saw
+
+
+LENGTH = 3000
+
+def render(strm, size=512):
+    return np.concatenate(list(iter_blocks(strm, size)))
+
+def test_matrix_powers():
+    A = np.array([[0.9, -0.2], [0.3, 0.7]])
+    expected = [np.eye(2)]
+    for _ in range(40):
+        expected.append(A @ expected[-1])
+    np.testing.assert_allclose(_matrix_powers(A, 40), expected, atol=1e-14)
+
+@pytest.mark.parametrize('topology', ['chamberlin', 'tpt'])
+@pytest.mark.parametrize('freq', [1000, lambda: 1000 + 500*osc(3)])
+def test_blocks_match_samples(topology, freq):
+    make = (lambda: freq) if isinstance(freq, int) else freq
+    # Tuples of (low, high, band), computed sample by sample.
+    expected = np.array(list(svf(saw(110)[:LENGTH], make(), 2, topology=topology)))
+    for mode, weights in (('low', (1, 0, 0)), ('high', (0, 1, 0)), ('band', (0, 0, 1)), ('peak', (-1, 1, 0))):
+        got = render(SVFStream(saw(110)[:LENGTH], make(), 2, mode, topology), 300)
+        np.testing.assert_allclose(got, expected @ weights, atol=1e-9)
+
+@pytest.mark.parametrize('make', [
+    lambda freq, smooth: lpf(saw(110)[:LENGTH], freq, 2, smooth=smooth),
+    lambda freq, smooth: lpf(saw(110)[:LENGTH], freq, 2, topology='tpt', smooth=smooth),
+    lambda freq, smooth: rbj(saw(110)[:LENGTH], 'lowpass', freq, smooth=smooth),
+])
+def test_smooth_uses_block_mean_cutoff(make):
+    # A constant cutoff stream gives the same result as a constant cutoff.
+    np.testing.assert_allclose(render(make(const(800.0), True)), render(make(800.0, False)), atol=1e-9)
+    # A modulated one is filtered a block at a time, with each block's average cutoff.
+    freqs = 1000 + 500*osc(3)
+    got = render(make(freqs, True))
+    means = [float(block.mean()) for block in iter_blocks(freqs[:LENGTH])]
+    stepped = np.concatenate([np.full(512, mean) for mean in means])[:LENGTH]
+    np.testing.assert_allclose(got, render(make(stepped, False)), atol=1e-9)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from aleatora.streams import FrozenStream, freeze_to, frame, Stream
+
+
+def test_samples_are_written_raw(tmp_path):
+    frozen = freeze_to(str(tmp_path / 'samples'), Stream([0.5, 1, -0.25]))
+    assert isinstance(frozen, FrozenStream)
+    assert list(frozen) == [0.5, 1.0, -0.25]
+
+def test_frames_are_written_raw(tmp_path):
+    frozen = freeze_to(str(tmp_path / 'frames'), Stream([frame(0.5, -0.5), frame(1, 0)]))
+    assert isinstance(frozen, FrozenStream)
+    assert list(frozen) == [frame(0.5, -0.5), frame(1.0, 0.0)]
+
+def test_non_samples_are_pickled(tmp_path):
+    # These must not be converted to floats (None to nan, '1' to 1.0).
+    items = [1.0, None, '1', 2]
+    frozen = freeze_to(str(tmp_path / 'objects'), Stream(items))
+    assert not isinstance(frozen, FrozenStream)
+    assert list(frozen) == items
+
+def test_non_samples_after_raw_data_are_pickled(tmp_path):
+    items = [0.25] * 20000 + ['1', None]
+    frozen = freeze_to(str(tmp_path / 'late'), Stream(items))
+    assert list(frozen) == items
+
+def test_mixed_samples_and_frames_are_pickled(tmp_path):
+    items = [0.5, frame(1, 2)]
+    frozen = freeze_to(str(tmp_path / 'mixed'), Stream(items))
+    assert list(frozen) == items
+    assert np.isnan(list(freeze_to(str(tmp_path / 'nan'), Stream([float('nan')])))[0])
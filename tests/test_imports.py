@@ -0,0 +1,13 @@
+import aleatora
+
+
+def test_audio_module_is_not_shadowed():
+    # Star imports in the package must not replace `aleatora.audio` with `aleatora.streams.audio`.
+    from aleatora import audio
+    assert audio.__name__ == 'aleatora.audio'
+    assert audio.play is aleatora.play
+    assert callable(audio.setup)
+
+def test_cache_exports():
+    assert aleatora.render_cache is aleatora.streams.cache.render_cache
+    assert not hasattr(aleatora, 'hashlib')
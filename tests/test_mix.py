@@ -0,0 +1,14 @@
+from aleatora.streams import frame, Mixer, MixStream, Stream
+
+
+def test_voices_retire_at_any_position():
+    voices = [Stream([1, 2, 3]), Stream([10, 20]), Stream([100, 200, 300, 400]), Stream([]), Stream([1000])]
+    assert list(MixStream(voices)) == [1111, 222, 303, 400]
+    assert list(MixStream(voices[::-1])) == [1111, 222, 303, 400]
+
+def test_frames_and_scalars():
+    voices = [Stream([frame(1, 2)] * 3), Stream([1, 2]), Stream([frame(1, 1)])]
+    assert list(MixStream(voices)) == [frame(3, 4), frame(3, 4), frame(1, 2)]
+
+def test_mixer_fills_after_voices_end():
+    assert list(Mixer([Stream([1, 2]), Stream([3])], fill=0)[:4]) == [4, 2, 0, 0]
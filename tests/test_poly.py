@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from aleatora import midi
+from aleatora.streams import const, iter_blocks, Stream
+
+
+def notes(*onsets, length=1000):
+    events = [()] * length
+    for i, onset in enumerate(onsets):
+        events[onset] = (midi.Message('note_on', 60 + i, 100),)
+    return Stream(events)
+
+@pytest.mark.parametrize('size', [64, 256, 512, 1000])
+def test_block_voices_start_on_their_notes(size):
+    # The same one-shot instrument, with and without block support.
+    in_blocks = midi.poly(lambda events: const(1.0)[:300])
+    in_samples = midi.poly(lambda events: Stream([1.0] * 300))
+    expected = np.array(list(in_samples(notes(100, 700))))
+    assert len(expected) == 1000
+    assert np.flatnonzero(expected).tolist() == list(range(100, 400)) + list(range(700, 1000))
+    for strm in (in_blocks(notes(100, 700)), in_samples(notes(100, 700))):
+        assert np.array_equal(np.concatenate(list(iter_blocks(strm, size))), expected)
+
+@pytest.mark.parametrize('size', [64, 512])
+def test_stolen_block_voices_match_samples(size):
+    in_blocks = midi.poly(lambda events: const(1.0)[:300], max_voices=1)
+    in_samples = midi.poly(lambda events: Stream([1.0] * 300), max_voices=1)
+    expected = np.array(list(in_samples(notes(100, 250, 600))))
+    assert np.flatnonzero(expected).tolist() == list(range(100, 550)) + list(range(600, 900))
+    assert np.array_equal(np.concatenate(list(iter_blocks(in_blocks(notes(100, 250, 600)), size))), expected)
@@ -0,0 +1,45 @@
+import gc
+import sys
+import weakref
+
+import pytest
+
+from aleatora import profile
+from aleatora.streams import osc, stream
+
+
+@pytest.fixture
+def profiling():
+    profile.reset()
+    profile.enable()
+    yield profile.tree()
+    profile.disable()
+    profile.reset()
+
+def test_same_labels_are_counted_together(profiling):
+    list((osc(440) + osc(660))[:100])
+    [sliced] = profiling.children.values()
+    [mix] = sliced.children.values()
+    [oscs] = mix.children.values()
+    assert oscs.label == 'osc'
+    assert oscs.samples == 200
+
+def test_streams_are_not_kept_alive(profiling):
+    strm = osc(440)[:100]
+    list(strm)
+    ref = weakref.ref(strm)
+    del strm
+    gc.collect()
+    assert ref() is None
+
+def test_node_count_is_capped(profiling, monkeypatch):
+    # `aleatora.profile` is also the name of the profiler itself, so get the module by name.
+    module = sys.modules['aleatora.profile']
+    monkeypatch.setattr(module, '_MAX_NODES', 50)
+    @stream
+    def nested(depth):
+        yield depth
+        if depth:
+            yield from nested(depth - 1)
+    assert list(nested(200)) == list(range(200, -1, -1))
+    assert module._Node.count <= 2 * 50